@@ -2,12 +2,22 @@ import ujson
 
 import anthill.common.admin as a
 
-from . model.environment import EnvironmentNotFound, EnvironmentExists
+from . model.endpoints import EndpointsInvalid
+from . model.environment import EnvironmentNotFound, EnvironmentExists, EnvironmentInvalid, SchemeInvalid
 from . model.application import VersionNotFound, VersionExists, ApplicationNotFound, ApplicationExists, ReservedName
+from . model.application import VersionPatternNotFound
 from . model.application import ApplicationError
+from . model.region import RegionNotFound, RegionExists, RegionError
+
+
+# how many applications or versions are listed on a single admin page
+ITEMS_PER_PAGE = 100
 
 
 class ApplicationController(a.AdminController):
+    # the default environment select value that means no default
+    NO_DEFAULT = "0"
+
     async def delete(self, **ignored):
         record_id = self.context.get("record_id")
 
@@ -26,8 +36,9 @@ class ApplicationController(a.AdminController):
 
         raise a.Redirect("apps", message="Application has been deleted")
 
-    async def get(self, record_id):
+    async def get(self, record_id, after=None, prefix=None, after_id=None):
 
+        environment = self.application.environment
         applications = self.application.applications
 
         try:
@@ -35,17 +46,26 @@ class ApplicationController(a.AdminController):
         except ApplicationNotFound:
             raise a.ActionError("Application was not found.")
 
-        versions = await applications.list_application_versions(record_id)
+        versions = await applications.list_application_versions(
+            record_id, after=after, limit=ITEMS_PER_PAGE, prefix=prefix, after_id=after_id)
+        patterns = await applications.list_version_patterns(record_id)
+        default_env = await applications.get_default_environment(record_id)
 
         result = {
             "application_name": app.name,
             "application_title": app.title,
             "versions": versions,
+            "patterns": patterns,
+            "envs": (await environment.list_environments()),
+            "default_env": ApplicationController.NO_DEFAULT if default_env is None else default_env
         }
 
         return result
 
     def render(self, data):
+        default_envs = {ApplicationController.NO_DEFAULT: "None (such versions are not found)"}
+        default_envs.update({env.environment_id: env.name for env in data["envs"]})
+
         return [
             a.breadcrumbs([
                 a.link("apps", "Applications"),
@@ -57,13 +77,35 @@ class ApplicationController(a.AdminController):
                 "update": a.method("Update", "primary", order=1),
                 "delete": a.method("Delete", "danger", order=2)
             }, data=data),
+            a.form("Default environment", fields={
+                "default_env": a.field("Environment for the versions not defined otherwise", "select", "primary",
+                                       "non-empty", values=default_envs)
+            }, methods={
+                "update_default": a.method("Update", "primary")
+            }, data=data),
+            a.form("Search versions", fields={
+                "prefix": a.field("Version name starts with", "text", "primary")
+            }, methods={
+                "search": a.method("Search", "primary")
+            }, data={"prefix": self.context.get("prefix", "")}),
             a.links("Application versions", links=[
                 a.link("app_version", v.name, icon="tags", app_id=data.get("application_name"),
                        version_id=v.version_id) for v in data["versions"]
+            ] + ([
+                a.link("app", "Next page", icon="chevron-right", record_id=self.context.get("record_id"),
+                       after=data["versions"][-1].name, after_id=data["versions"][-1].version_id,
+                       prefix=self.context.get("prefix", ""))
+            ] if len(data["versions"]) >= ITEMS_PER_PAGE else [])),
+            a.links("Version patterns", links=[
+                a.link("app_pattern", p.pattern, icon="filter", app_id=data.get("application_name"),
+                       pattern_id=p.pattern_id) for p in data["patterns"]
             ]),
             a.links("Navigate", [
                 a.link("apps", "Go back", icon="chevron-left"),
-                a.link("new_app_version", "New application version", "plus", app_id=data.get("application_name"))
+                a.link("new_app_version", "New application version", "plus", app_id=data.get("application_name")),
+                a.link("new_app_pattern", "New version pattern", "plus", app_id=data.get("application_name")),
+                a.link("move_versions", "Move versions to another environment", "exchange",
+                       app_id=data.get("application_name"))
             ])
         ]
 
@@ -99,6 +141,43 @@ class ApplicationController(a.AdminController):
             message="Application has been updated",
             record_id=record_id)
 
+    async def search(self, prefix):
+        raise a.Redirect("app", record_id=self.context.get("record_id"), prefix=prefix)
+
+    async def update_default(self, default_env):
+        record_id = self.context.get("record_id")
+
+        environment = self.application.environment
+        applications = self.application.applications
+
+        try:
+            app = await applications.get_application(record_id)
+        except ApplicationNotFound:
+            raise a.ActionError("Application was not found.")
+
+        if default_env == ApplicationController.NO_DEFAULT:
+            default_env = None
+            env_name = None
+        else:
+            try:
+                env = await environment.get_environment(default_env)
+            except EnvironmentNotFound:
+                raise a.ActionError("No such environment")
+
+            env_name = env.name
+
+        updated = await applications.set_default_environment(record_id, default_env)
+
+        if updated:
+            self.audit("mobile", "Updated default environment of an application",
+                       application_name=app.name,
+                       default_environment=env_name)
+
+        raise a.Redirect(
+            "app",
+            message="Default environment has been updated",
+            record_id=record_id)
+
 
 class ApplicationVersionController(a.AdminController):
     async def delete(self, **ignored):
@@ -238,9 +317,9 @@ class ApplicationVersionController(a.AdminController):
 
 
 class ApplicationsController(a.AdminController):
-    async def get(self):
+    async def get(self, after=None, prefix=None):
         applications = self.application.applications
-        apps = await applications.list_applications()
+        apps = await applications.list_applications(after=after, limit=ITEMS_PER_PAGE, prefix=prefix)
 
         result = {
             "apps": apps
@@ -251,9 +330,17 @@ class ApplicationsController(a.AdminController):
     def render(self, data):
         return [
             a.breadcrumbs([], "Applications"),
+            a.form("Search applications", fields={
+                "prefix": a.field("Application ID starts with", "text", "primary")
+            }, methods={
+                "search": a.method("Search", "primary")
+            }, data={"prefix": self.context.get("prefix", "")}),
             a.links("Applications", links=[
                 a.link("app", app.title, icon="mobile", record_id=app.application_id) for app in data["apps"]
-            ]),
+            ] + ([
+                a.link("apps", "Next page", icon="chevron-right",
+                       after=data["apps"][-1].name, prefix=self.context.get("prefix", ""))
+            ] if len(data["apps"]) >= ITEMS_PER_PAGE else [])),
             a.links("Navigate", [
                 a.link("index", "Go back", icon="chevron-left"),
                 a.link("new_app", "New application", "plus")
@@ -263,6 +350,9 @@ class ApplicationsController(a.AdminController):
     def access_scopes(self):
         return ["env_admin"]
 
+    async def search(self, prefix):
+        raise a.Redirect("apps", prefix=prefix)
+
 
 class EnvironmentController(a.AdminController):
     async def delete(self, **ignored):
@@ -293,11 +383,13 @@ class EnvironmentController(a.AdminController):
             raise a.ActionError("Environment was not found.")
 
         scheme = await environment.get_scheme()
+        regions = await self.application.regions.list_regions(record_id)
 
         return {
             "env_name": env.name,
             "env_discovery": env.discovery,
             "env_data": env.data,
+            "regions": regions,
             "scheme": scheme
         }
 
@@ -308,16 +400,23 @@ class EnvironmentController(a.AdminController):
             ], data.get("env_name")),
             a.form("Environment information", fields={
                 "env_name": a.field("Environment name", "text", "primary", "non-empty"),
-                "env_discovery": a.field("Discovery service location", "text", "primary", "non-empty"),
+                "env_discovery": a.field(
+                    "Discovery service location (or several, with weights, like: http://a 3, http://b 1)",
+                    "text", "primary", "non-empty"),
                 "env_data": a.field("Environment variables", "dorn", "primary", "non-empty",
                                     schema=data["scheme"]),
             }, methods={
                 "update": a.method("Update", "primary"),
                 "delete": a.method("Delete", "danger")
             }, data=data),
+            a.links("Regional overrides", links=[
+                a.link("env_region", r.name, icon="globe", env_id=self.context.get("record_id"),
+                       region_id=r.region_id) for r in data["regions"]
+            ]),
             a.links("Navigate", [
                 a.link("envs", "Go back", icon="chevron-left"),
-                a.link("new_env", "New environment", "plus")
+                a.link("new_env", "New environment", "plus"),
+                a.link("new_env_region", "New regional override", "plus", env_id=self.context.get("record_id"))
             ])
         ]
 
@@ -339,7 +438,12 @@ class EnvironmentController(a.AdminController):
         except EnvironmentNotFound:
             raise a.ActionError("No such environment")
 
-        updated = await environment.update_environment(record_id, env_name, env_discovery, env_data)
+        try:
+            updated = await environment.update_environment(record_id, env_name, env_discovery, env_data)
+        except EnvironmentInvalid as e:
+            raise a.ActionError("Environment variables do not fit in the scheme: " + e.message)
+        except EndpointsInvalid as e:
+            raise a.ActionError("Malformed discovery service location: " + e.message)
 
         if updated:
             self.audit("random", "Updated an environment",
@@ -353,6 +457,116 @@ class EnvironmentController(a.AdminController):
             record_id=record_id)
 
 
+class EnvironmentRegionController(a.AdminController):
+    async def delete(self, **ignored):
+        env_id = self.context.get("env_id")
+        region_id = self.context.get("region_id")
+
+        regions = self.application.regions
+
+        try:
+            region = await regions.get_region(env_id, region_id)
+        except RegionNotFound:
+            raise a.ActionError("No such regional override")
+
+        deleted = await regions.delete_region(env_id, region_id)
+
+        if deleted:
+            self.audit("times", "Deleted a regional override",
+                       environment_id=env_id,
+                       region_name=region.name)
+
+        raise a.Redirect(
+            "environment",
+            message="Regional override has been deleted",
+            record_id=env_id)
+
+    async def get(self, env_id, region_id):
+
+        environment = self.application.environment
+
+        try:
+            env = await environment.get_environment(env_id)
+        except EnvironmentNotFound:
+            raise a.ActionError("Environment was not found.")
+
+        try:
+            region = await self.application.regions.get_region(env_id, region_id)
+        except RegionNotFound:
+            raise a.ActionError("Regional override was not found.")
+
+        return {
+            "env_name": env.name,
+            "region_name": region.name,
+            "region_discovery": region.discovery,
+            "region_data": region.data
+        }
+
+    def render(self, data):
+        return [
+            a.breadcrumbs([
+                a.link("envs", "Environments"),
+                a.link("environment", data.get("env_name"), record_id=self.context.get("env_id"))
+            ], data.get("region_name")),
+            a.form("Regional override", fields={
+                "region_name": a.field("Region, like apac (as the clients name it, or the prefixes table does)",
+                                       "text", "primary", "non-empty"),
+                "region_discovery": a.field("Discovery service location for the region (or leave empty)",
+                                            "text", "primary"),
+                "region_data": a.field("Environment variables to override", "json", "primary", "non-empty")
+            }, methods={
+                "update": a.method("Update", "primary", order=1),
+                "delete": a.method("Delete", "danger", order=2)
+            }, data=data),
+            a.links("Navigate", [
+                a.link("environment", "Go back", icon="chevron-left", record_id=self.context.get("env_id"))
+            ])
+        ]
+
+    def access_scopes(self):
+        return ["env_envs_admin"]
+
+    async def update(self, region_name, region_discovery, region_data):
+        env_id = self.context.get("env_id")
+        region_id = self.context.get("region_id")
+
+        try:
+            region_data = ujson.loads(region_data)
+        except (KeyError, ValueError):
+            raise a.ActionError("Corrupted JSON")
+
+        regions = self.application.regions
+
+        try:
+            region = await regions.get_region(env_id, region_id)
+        except RegionNotFound:
+            raise a.ActionError("No such regional override")
+
+        try:
+            updated = await regions.update_region(env_id, region_id, region_name, region_discovery, region_data)
+        except RegionExists:
+            raise a.ActionError("The environment is overridden for such region already")
+        except RegionError as e:
+            raise a.ActionError(e.message)
+        except EndpointsInvalid as e:
+            raise a.ActionError("Malformed discovery service location: " + e.message)
+        except EnvironmentInvalid as e:
+            raise a.ActionError("Environment variables do not fit in the scheme: " + e.message)
+
+        if updated:
+            self.audit("globe", "Updated a regional override",
+                       environment_id=env_id,
+                       region_name=(region.name, region_name),
+                       discovery_service_location=(region.discovery, region_discovery),
+                       environment_variables=(region.data, region_data))
+
+        raise a.Redirect(
+            "env_region",
+            message="Regional override has been updated",
+            env_id=env_id,
+            region_id=region_id)
+
+
 class EnvironmentVariablesController(a.AdminController):
     async def get(self):
 
@@ -395,7 +609,10 @@ class EnvironmentVariablesController(a.AdminController):
 
         old_scheme = await environment.get_scheme()
 
-        updated = await environment.set_scheme(scheme)
+        try:
+            updated = await environment.set_scheme(scheme)
+        except SchemeInvalid as e:
+            raise a.ActionError(e.message)
 
         if updated:
             self.audit("cogs", "Updated environment variables",
@@ -409,11 +626,17 @@ class EnvironmentsController(a.AdminController):
         environment = self.application.environment
 
         return {
-            "envs": await environment.list_environments()
+            "envs": await environment.list_environments(),
+            "invalid": list(environment.invalid_environments.values())
         }
 
     def render(self, data):
-        return [
+        notices = [
+            a.notice("Environments that do not fit in the scheme", "\n".join(
+                "{0}: {1}".format(name, error) for name, error in data["invalid"]))
+        ] if data["invalid"] else []
+
+        return notices + [
             a.breadcrumbs([], "Environments"),
             a.links("Environments", links=[
                 a.link("environment", env.name, icon="random", record_id=env.environment_id) for env in data["envs"]
@@ -429,6 +652,102 @@ class EnvironmentsController(a.AdminController):
         return ["env_envs_admin"]
 
 
+class MoveVersionsController(a.AdminController):
+    # the source environment select value that means any environment
+    ANY_ENVIRONMENT = "0"
+
+    async def get(self, app_id):
+
+        environment = self.application.environment
+        applications = self.application.applications
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App " + str(app_id) + " was not found.")
+
+        return {
+            "app_title": app.title,
+            "application_id": app.application_id,
+            "envs": (await environment.list_environments()),
+            "from_env": MoveVersionsController.ANY_ENVIRONMENT
+        }
+
+    async def move(self, to_env, from_env=ANY_ENVIRONMENT, version_names="", pattern="", **ignored):
+        app_id = self.context.get("app_id")
+
+        environment = self.application.environment
+        applications = self.application.applications
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App " + str(app_id) + " was not found.")
+
+        try:
+            new_env = await environment.get_environment(to_env)
+
+            if from_env == MoveVersionsController.ANY_ENVIRONMENT:
+                from_env, old_env_name = None, None
+            else:
+                old_env_name = (await environment.get_environment(from_env)).name
+        except EnvironmentNotFound:
+            raise a.ActionError("No such environment")
+
+        version_names = [name.strip() for name in version_names.split(",") if name.strip()] or None
+        pattern = pattern.strip() or None
+
+        try:
+            moved = await applications.move_versions(
+                app.application_id, to_env,
+                version_names=version_names, pattern=pattern, from_environment_id=from_env)
+        except ApplicationError as e:
+            raise a.ActionError(e.message)
+
+        if moved:
+            self.audit("exchange", "Moved application versions",
+                       application_name=app.name,
+                       versions=version_names,
+                       pattern=pattern,
+                       amount=moved,
+                       version_environment=(old_env_name, new_env.name))
+
+        raise a.Redirect(
+            "app",
+            message="{0} version(s) have been moved".format(moved),
+            record_id=app.application_id)
+
+    def render(self, data):
+        from_envs = {MoveVersionsController.ANY_ENVIRONMENT: "Any environment"}
+        from_envs.update({env.environment_id: env.name for env in data["envs"]})
+
+        return [
+            a.breadcrumbs([
+                a.link("apps", "Applications"),
+                a.link("app", data.get("app_title", "Application"), record_id=data.get("application_id")),
+            ], "Move versions"),
+            a.form("Move versions to another environment", fields={
+                "version_names": a.field("Comma-separated version names (or leave empty)", "text", "primary",
+                                         order=1),
+                "pattern": a.field("Or a pattern, like 1.4.* or >=2.0 <2.3 (or leave empty)", "text", "primary",
+                                   order=2),
+                "from_env": a.field("Only the versions in the environment", "select", "primary", "non-empty",
+                                    values=from_envs, order=3),
+                "to_env": a.field("Move to the environment", "select", "primary", "non-empty", values={
+                    env.environment_id: env.name for env in data["envs"]
+                }, order=4)
+            }, methods={
+                "move": a.method("Move", "danger")
+            }, data=data),
+            a.links("Navigate", [
+                a.link("app", "Go back", icon="chevron-left", record_id=data.get("application_id"))
+            ])
+        ]
+
+    def access_scopes(self):
+        return ["env_admin"]
+
+
 class NewApplicationController(a.AdminController):
     async def create(self, app_name, app_title):
 
@@ -566,6 +885,8 @@ class NewEnvironmentController(a.AdminController):
             record_id = await environment.create_environment(env_name, env_discovery)
         except VersionExists:
             raise a.ActionError("Such environment already exists.")
+        except EndpointsInvalid as e:
+            raise a.ActionError("Malformed discovery service location: " + e.message)
 
         self.audit("plus", "Created new environment",
                    environment_name=env_name,
@@ -583,7 +904,9 @@ class NewEnvironmentController(a.AdminController):
             ], "New environment"),
             a.form("New environment", fields={
                 "env_name": a.field("Environment name", "text", "primary", "non-empty"),
-                "env_discovery": a.field("Discovery service location", "text", "primary", "non-empty"),
+                "env_discovery": a.field(
+                    "Discovery service location (or several, with weights, like: http://a 3, http://b 1)",
+                    "text", "primary", "non-empty"),
             }, methods={
                 "create": a.method("Create", "primary")
             }, data=data),
@@ -596,6 +919,156 @@ class NewEnvironmentController(a.AdminController):
         return ["env_envs_admin"]
 
 
+class NewEnvironmentRegionController(a.AdminController):
+    async def create(self, region_name, region_discovery, region_data):
+        env_id = self.context.get("env_id")
+
+        try:
+            region_data = ujson.loads(region_data)
+        except (KeyError, ValueError):
+            raise a.ActionError("Corrupted JSON")
+
+        try:
+            region_id = await self.application.regions.create_region(
+                env_id, region_name, region_discovery, region_data)
+        except EnvironmentNotFound:
+            raise a.ActionError("No such environment")
+        except RegionExists:
+            raise a.ActionError("The environment is overridden for such region already")
+        except RegionError as e:
+            raise a.ActionError(e.message)
+        except EndpointsInvalid as e:
+            raise a.ActionError("Malformed discovery service location: " + e.message)
+        except EnvironmentInvalid as e:
+            raise a.ActionError("Environment variables do not fit in the scheme: " + e.message)
+
+        self.audit("plus", "Created a regional override",
+                   environment_id=env_id,
+                   region_name=region_name,
+                   discovery_service_location=region_discovery,
+                   environment_variables=region_data)
+
+        raise a.Redirect(
+            "env_region",
+            message="Regional override has been created",
+            env_id=env_id,
+            region_id=region_id)
+
+    async def get(self, env_id):
+
+        environment = self.application.environment
+
+        try:
+            env = await environment.get_environment(env_id)
+        except EnvironmentNotFound:
+            raise a.ActionError("Environment was not found.")
+
+        return {
+            "env_name": env.name,
+            "region_data": {}
+        }
+
+    def render(self, data):
+        return [
+            a.breadcrumbs([
+                a.link("envs", "Environments"),
+                a.link("environment", data.get("env_name"), record_id=self.context.get("env_id"))
+            ], "New regional override"),
+            a.form("New regional override", fields={
+                "region_name": a.field("Region, like apac (as the clients name it, or the prefixes table does)",
+                                       "text", "primary", "non-empty"),
+                "region_discovery": a.field("Discovery service location for the region (or leave empty)",
+                                            "text", "primary"),
+                "region_data": a.field("Environment variables to override", "json", "primary", "non-empty")
+            }, methods={
+                "create": a.method("Create", "primary")
+            }, data=data),
+            a.links("Navigate", [
+                a.link("environment", "Go back", icon="chevron-left", record_id=self.context.get("env_id"))
+            ])
+        ]
+
+    def access_scopes(self):
+        return ["env_envs_admin"]
+
+
+class NewVersionPatternController(a.AdminController):
+    async def create(self, pattern, pattern_env):
+
+        applications = self.application.applications
+
+        app_id = self.context.get("app_id")
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App " + str(app_id) + " was not found.")
+
+        environment = self.application.environment
+
+        try:
+            env = await environment.get_environment(pattern_env)
+        except EnvironmentNotFound:
+            raise a.ActionError("No such environment")
+
+        try:
+            pattern_id = await applications.create_version_pattern(app.application_id, pattern, pattern_env)
+        except ApplicationError as e:
+            raise a.ActionError(e.message)
+
+        self.audit("plus", "Created new version pattern",
+                   pattern=pattern,
+                   environment=env.name,
+                   application_name=app.name,
+                   application_title=app.title)
+
+        raise a.Redirect(
+            "app_pattern",
+            message="New version pattern has been created",
+            app_id=app_id,
+            pattern_id=pattern_id)
+
+    async def get(self, app_id):
+
+        environment = self.application.environment
+        applications = self.application.applications
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App " + str(app_id) + " was not found.")
+
+        result = {
+            "app_name": app.title,
+            "application_id": app.application_id,
+            "envs": (await environment.list_environments())
+        }
+
+        return result
+
+    def render(self, data):
+        return [
+            a.breadcrumbs([
+                a.link("apps", "Applications"),
+                a.link("app", data.get("app_name", "Application"), record_id=data.get("application_id")),
+            ], "New version pattern"),
+            a.form("New version pattern", fields={
+                "pattern": a.field("Pattern, like 1.4.* or >=2.0 <2.3", "text", "primary", "non-empty"),
+                "pattern_env": a.field("Environment", "select", "primary", "non-empty", values={
+                    env.environment_id: env.name for env in data["envs"]
+                })
+            }, methods={
+                "create": a.method("Create", "primary")
+            }, data=data),
+            a.links("Navigate", [
+                a.link("app", "Go back", icon="chevron-left", record_id=data.get("application_id"))
+            ])
+        ]
+
+    def access_scopes(self):
+        return ["env_admin"]
+
+
 class RootAdminController(a.AdminController):
     def render(self, data):
         return [
@@ -607,3 +1080,125 @@ class RootAdminController(a.AdminController):
 
     def access_scopes(self):
         return ["env_admin"]
+
+
+class VersionPatternController(a.AdminController):
+    async def delete(self, **ignored):
+
+        applications = self.application.applications
+
+        pattern_id = self.context.get("pattern_id")
+        app_name = self.context.get("app_id")
+
+        try:
+            app = await applications.find_application(app_name)
+        except ApplicationNotFound:
+            raise a.ActionError("App was not found.")
+
+        try:
+            pattern = await applications.get_version_pattern(app.application_id, pattern_id)
+        except VersionPatternNotFound:
+            raise a.ActionError("No such version pattern")
+
+        deleted = await applications.delete_version_pattern(app.application_id, pattern_id)
+
+        if deleted:
+            self.audit("times", "Deleted version pattern",
+                       pattern=pattern.pattern,
+                       application_name=app.name,
+                       application_title=app.title)
+
+        raise a.Redirect(
+            "app",
+            message="Version pattern has been deleted",
+            record_id=app.application_id)
+
+    async def get(self, app_id, pattern_id):
+
+        environment = self.application.environment
+        applications = self.application.applications
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App was not found.")
+
+        try:
+            pattern = await applications.get_version_pattern(app.application_id, pattern_id)
+        except VersionPatternNotFound:
+            raise a.ActionError("Version pattern was not found.")
+
+        result = {
+            "app_title": app.title,
+            "application_id": app.application_id,
+            "envs": (await environment.list_environments()),
+            "pattern": pattern.pattern,
+            "pattern_env": pattern.environment
+        }
+
+        return result
+
+    def render(self, data):
+        return [
+            a.breadcrumbs([
+                a.link("apps", "Applications"),
+                a.link("app", data.get("app_title", "Application"), record_id=data.get("application_id")),
+            ], data.get("pattern")),
+            a.form("Version pattern", fields={
+                "pattern": a.field("Pattern, like 1.4.* or >=2.0 <2.3", "text", "primary", "non-empty"),
+                "pattern_env": a.field("Environment", "select", "primary", "non-empty", values={
+                    env.environment_id: env.name for env in data["envs"]
+                })
+            }, methods={
+                "update": a.method("Update", "primary", order=1),
+                "delete": a.method("Delete", "danger", order=2)
+            }, data=data),
+            a.links("Navigate", [
+                a.link("app", "Go back", icon="chevron-left", record_id=data.get("application_id")),
+                a.link("new_app_pattern", "New version pattern", "plus", app_id=self.context.get("app_id"))
+            ])
+        ]
+
+    def access_scopes(self):
+        return ["env_admin"]
+
+    async def update(self, pattern, pattern_env):
+        pattern_id = self.context.get("pattern_id")
+        app_id = self.context.get("app_id")
+
+        applications = self.application.applications
+
+        try:
+            app = await applications.find_application(app_id)
+        except ApplicationNotFound:
+            raise a.ActionError("App was not found.")
+
+        try:
+            old_pattern = await applications.get_version_pattern(app.application_id, pattern_id)
+        except VersionPatternNotFound:
+            raise a.ActionError("Version pattern was not found.")
+
+        environment = self.application.environment
+
+        try:
+            new_env = await environment.get_environment(pattern_env)
+            old_env = await environment.get_environment(old_pattern.environment)
+        except EnvironmentNotFound:
+            raise a.ActionError("No such environment")
+
+        try:
+            updated = await applications.update_version_pattern(
+                app.application_id, pattern_id, pattern, pattern_env)
+        except ApplicationError as e:
+            raise a.ActionError(e.message)
+
+        if updated:
+            self.audit("filter", "Updated version pattern", only_if=True,
+                       application_name=app.name,
+                       pattern=(old_pattern.pattern, pattern),
+                       pattern_environment=(old_env.name, new_env.name))
+
+        raise a.Redirect(
+            "app_pattern",
+            message="Version pattern has been updated",
+            app_id=app_id, pattern_id=pattern_id)
@@ -1,11 +1,84 @@
 
 
-from tornado.web import HTTPError
+from tornado.web import HTTPError, RequestHandler
 
-from anthill.common.handler import JsonHandler
+from anthill.common.access import scoped
+from anthill.common.handler import AuthenticatedHandler, JsonHandler
+from anthill.common.options import options
 
-from . model.environment import EnvironmentNotFound
+from . model.environment import EnvironmentModel, EnvironmentNotFound, EnvironmentUnavailable
 from . model.application import ApplicationNotFound
+from . model.transfer import TransferModel, TransferError
+from . model.metrics import registry, REQUEST_DURATION, DISCOVER_RESPONSES, MetricsRegistry
+
+import hmac
+import ipaddress
+import math
+import ujson
+
+
+# the most fields a discovery answer could be projected to
+MAX_FIELDS = 64
+
+
+def parse_versions(versions):
+    """
+    Checks a list of [app_name, app_version] pairs as passed to the batch discovery.
+    Returns a list of (app_name, app_version) tuples, with None in place of each malformed pair.
+    """
+
+    if not isinstance(versions, list):
+        raise HTTPError(400, "Versions should be a list of [app_name, app_version] pairs")
+
+    if len(versions) > options.discover_batch_limit:
+        raise HTTPError(400, "Too many versions, {0} at most".format(options.discover_batch_limit))
+
+    return [
+        tuple(pair)
+        if isinstance(pair, list) and len(pair) == 2 and all(isinstance(value, str) for value in pair)
+        else None
+        for pair in versions
+    ]
+
+
+def parse_fields(fields):
+    """
+    Turns a comma-separated 'fields' argument into a list of fields, or None if every field is requested.
+    """
+
+    if fields is None:
+        return None
+
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+
+    if len(fields) > MAX_FIELDS:
+        raise HTTPError(400, "Too many fields requested")
+
+    return fields or None
+
+
+def dumps(data):
+    """
+    Renders json the same way JsonHandler does, the slashes of the urls left unescaped.
+    """
+    return ujson.dumps(data, escape_forward_slashes=False)
+
+
+def version_not_found(app_name, app_version):
+    return "Version {0} of the app {1} was not found.".format(app_version, app_name)
+
+
+def version_unavailable(app_name, app_version):
+    return "Version {0} of the app {1} could not be resolved, try again later.".format(app_version, app_name)
+
+
+def app_info(app):
+    return {
+        "id": app.application_id,
+        "name": app.name,
+        "title": app.title,
+        "versions": app.versions
+    }
 
 
 class InternalHandler(object):
@@ -15,29 +88,105 @@ class InternalHandler(object):
     async def get_app_info(self, app_name):
         applications = self.application.applications
 
+        apps = await applications.get_applications_info([app_name])
+
+        if not apps:
+            raise HTTPError(404, "Application {0} was not found".format(app_name))
+
+        return app_info(apps[0])
+
+    async def get_apps_info(self, app_names=None):
+        """
+        Returns the same as get_app_info does, for each of the applications given (or for all if omitted),
+        the missing ones are omitted.
+        """
+
+        applications = self.application.applications
+
+        if app_names is not None and not isinstance(app_names, list):
+            raise HTTPError(400, "App names should be a list")
+
+        apps = await applications.get_applications_info(app_names)
+
+        return [app_info(app) for app in apps]
+
+    async def get_versions_environment(self, versions):
+        """
+        Resolves a list of [app_name, app_version] pairs at once. Returns a list in the same order,
+        each item either has an 'environment', or an 'error'.
+        """
+
+        pairs = parse_versions(versions)
+        resolved = await self.application.environment.get_versions_environment(
+            [pair for pair in pairs if pair is not None])
+
+        result = []
+
+        for original, pair in zip(versions, pairs):
+            if pair is None:
+                result.append({
+                    "error": {"code": 400, "message": "Malformed version: {0}".format(original)}
+                })
+                continue
+
+            app_name, app_version = pair
+            version = resolved.get(pair)
+
+            if version is None:
+                result.append({
+                    "app": app_name,
+                    "version": app_version,
+                    "error": {"code": 404, "message": version_not_found(app_name, app_version)}
+                })
+            elif version is EnvironmentModel.UNAVAILABLE:
+                result.append({
+                    "app": app_name,
+                    "version": app_version,
+                    "error": {"code": 503, "message": version_unavailable(app_name, app_version)}
+                })
+            else:
+                result.append({
+                    "app": app_name,
+                    "version": app_version,
+                    "environment": dict(
+                        version.data, discovery=self.application.environment.select_endpoint(version))
+                })
+
+        return result
+
+    async def get_app_versions(self, app_name, after=None, limit=None, prefix=None, after_id=None):
+        """
+        Lists versions of the application ordered by name, paged the same way as get_apps. The names are not
+        unique, so pass the version_id of the last version of a page as 'after_id' as well.
+        """
+
+        applications = self.application.applications
+
         try:
             app = await applications.find_application(app_name)
         except ApplicationNotFound:
             raise HTTPError(404, "Application {0} was not found".format(app_name))
 
-        application_id = app.application_id
+        versions = await applications.list_application_versions(
+            app.application_id, after=after, limit=limit, prefix=prefix, after_id=after_id)
 
-        versions = await applications.list_application_versions(application_id)
-
-        return {
-            "id": app.application_id,
-            "name": app.name,
-            "title": app.title,
-            "versions": {
-                version.name: version.version_id
-                for version in versions
+        return [
+            {
+                "version_id": version.version_id,
+                "version_name": version.name,
+                "version_environment": version.environment
             }
-        }
+            for version in versions
+        ]
 
-    async def get_apps(self):
+    async def get_apps(self, after=None, limit=None, prefix=None):
+        """
+        Lists applications ordered by name. Pass the name of the last application of a page
+        as 'after' to get the next one, and a 'prefix' to only list the applications starting with it.
+        """
 
         applications = self.application.applications
-        apps = await applications.list_applications()
+        apps = await applications.list_applications(after=after, limit=limit, prefix=prefix)
 
         return [
             {
@@ -49,21 +198,289 @@ class InternalHandler(object):
         ]
 
 
-class DiscoverHandler(JsonHandler):
+class MeasuredHandlerMixin(object):
+    """
+    Observes the duration of every request into the DURATION child of REQUEST_DURATION, which is
+    bound once per handler class so nothing is looked up per request.
+    """
+
+    DURATION = None
+
+    def on_finish(self):
+        super(MeasuredHandlerMixin, self).on_finish()
+        self.DURATION.observe(self.request.request_time())
+
+
+class DiscoverHandler(MeasuredHandlerMixin, JsonHandler):
+    DURATION = REQUEST_DURATION.labels("discover")
+    # the app label of the responses for the applications that do not exist, so a client could not
+    # make up an unlimited amount of labels
+    UNKNOWN_APP = "_unknown"
+
+    def on_finish(self):
+        super(DiscoverHandler, self).on_finish()
+
+        app_name = self.path_args[0].lower() if self.path_args else ""
+        code = self.get_status()
+
+        if code not in (200, 304):
+            application_names = self.application.environment.application_names
+
+            if application_names is None or app_name not in application_names:
+                app_name = DiscoverHandler.UNKNOWN_APP
+
+        DISCOVER_RESPONSES.labels(app_name, code).inc()
+
     async def get(self, app_name, app_version):
         environment = self.application.environment
+        regions = self.application.regions
+        fields = parse_fields(self.get_argument("fields", None))
+        # the same client keeps getting the same endpoint (and so the same answer), its address if nothing else
+        client_id = self.get_argument("client_id", None) or self.request.remote_ip
 
         try:
             version = await environment.get_version_environment(app_name, app_version)
         except EnvironmentNotFound:
-            raise HTTPError(
-                404, "Version {0} of the app {1} was not found.".format(
-                    app_version, app_name))
+            raise HTTPError(404, version_not_found(app_name, app_version))
+        except EnvironmentUnavailable:
+            raise HTTPError(503, version_unavailable(app_name, app_version))
+
+        region = regions.detect_region(self.request.headers.get(options.region_header), self.request.remote_ip)
+        version = regions.localize(version, region)
+
+        if version.region is not None:
+            self.set_header("X-Environment-Region", version.region.name)
+
+        response = version.response_for(environment.select_endpoint(version, client_id))
+
+        if fields is not None:
+            response = response.project(fields)
+
+        response = response.negotiate(
+            self.request.headers.get("Accept"), self.request.headers.get("Accept-Encoding"))
+
+        if regions.region_names:
+            self.set_header("Vary", "Accept, Accept-Encoding, " + options.region_header)
+
+            if regions.prefixes is not None:
+                # the answer depends on the address of the client as well, which no shared cache could tell
+                self.set_header("Cache-Control", "private")
+        else:
+            self.set_header("Vary", "Accept, Accept-Encoding")
 
-        res = {
-            "discovery": version.discovery
-        }
+        self.set_header("Etag", response.etag)
+
+        revision = environment.get_revision(app_name, app_version)
+
+        if revision is not None:
+            # so a client could watch for changes starting from what it has just got
+            self.set_header("X-Environment-Revision", str(revision))
+
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        self.set_header("Content-Type", response.content_type)
+
+        if response.encoding is not None:
+            self.set_header("Content-Encoding", response.encoding)
+
+        self.write(response.body)
+
+
+class BatchDiscoverHandler(MeasuredHandlerMixin, JsonHandler):
+    DURATION = REQUEST_DURATION.labels("batch")
+
+    async def post(self):
+        """
+        Resolves a json list of [app_name, app_version] pairs passed as 'versions' argument.
+        Responds with a list in the same order, each item either has an 'environment', or an 'error'.
+        A comma-separated 'fields' argument limits the environments to these fields.
+        A 'client_id' argument keeps the client pointed to the same discovery endpoint, the address of the client
+        is used instead if omitted.
+        """
+
+        environment = self.application.environment
+        regions = self.application.regions
+        fields = parse_fields(self.get_argument("fields", None))
+        # the same client keeps getting the same endpoint (and so the same answer), its address if nothing else
+        client_id = self.get_argument("client_id", None) or self.request.remote_ip
+        region = regions.detect_region(self.request.headers.get(options.region_header), self.request.remote_ip)
+
+        versions = self.get_argument("versions")
+
+        try:
+            versions = ujson.loads(versions)
+        except ValueError:
+            raise HTTPError(400, "Corrupted versions")
+
+        pairs = parse_versions(versions)
+        resolved = await environment.get_versions_environment(
+            [pair for pair in pairs if pair is not None])
+
+        items = []
+
+        for original, pair in zip(versions, pairs):
+            if pair is None:
+                items.append(dumps({
+                    "error": {"code": 400, "message": "Malformed version: {0}".format(original)}
+                }).encode("utf-8"))
+                continue
+
+            app_name, app_version = pair
+            version = resolved.get(pair)
+
+            if version is None:
+                items.append(dumps({
+                    "app": app_name,
+                    "version": app_version,
+                    "error": {"code": 404, "message": version_not_found(app_name, app_version)}
+                }).encode("utf-8"))
+            elif version is EnvironmentModel.UNAVAILABLE:
+                items.append(dumps({
+                    "app": app_name,
+                    "version": app_version,
+                    "error": {"code": 503, "message": version_unavailable(app_name, app_version)}
+                }).encode("utf-8"))
+            else:
+                version = regions.localize(version, region)
+                response = version.response_for(environment.select_endpoint(version, client_id))
+
+                if fields is not None:
+                    response = response.project(fields)
+
+                # the environment is already rendered, so it is spliced in as it is
+                items.append(
+                    dumps({"app": app_name, "version": app_version})[:-1].encode("utf-8") +
+                    b',"environment":' + response.body + b'}')
+
+        self.set_header("Content-Type", "application/json")
+        self.write(b"[" + b",".join(items) + b"]")
+
+
+class WatchHandler(MeasuredHandlerMixin, JsonHandler):
+    DURATION = REQUEST_DURATION.labels("watch")
+
+    async def get(self, app_name=None, app_version=None):
+        """
+        Long-polls for a change: answers as soon as the revision of the application version (of everything,
+        if none is given) differs from the 'revision' argument, or once 'timeout' seconds have passed.
+        Responds with {"revision": <current revision>, "changed": <whether it has changed>}.
+        """
+
+        environment = self.application.environment
+
+        if not environment.snapshot_enabled:
+            raise HTTPError(501, "Watching requires the routing snapshot to be enabled")
+
+        try:
+            revision = int(self.get_argument("revision", 0))
+            timeout = float(self.get_argument("timeout", options.watch_max_timeout))
+        except ValueError:
+            raise HTTPError(400, "Revision and timeout should be numbers")
+
+        # nan would not wait at all, turning the watchers into a busy loop
+        if not math.isfinite(timeout):
+            raise HTTPError(400, "Timeout should be a finite number")
+
+        timeout = min(max(timeout, 0), options.watch_max_timeout)
+
+        current, changed = await environment.wait_for_revision(
+            revision, timeout, app_name=app_name, app_version=app_version)
+
+        self.dumps({
+            "revision": current,
+            "changed": changed
+        })
+
+
+class ExportHandler(MeasuredHandlerMixin, AuthenticatedHandler):
+    DURATION = REQUEST_DURATION.labels("export")
+
+    @scoped(scopes=["env_admin", "env_envs_admin"])
+    async def get(self):
+        """
+        Streams the whole configuration as json lines, see TransferModel.
+        """
+
+        transfer = self.application.transfer
+
+        self.set_header("Content-Type", "application/x-ndjson")
+        self.set_header("Content-Disposition", "attachment; filename=environment.jsonl")
+
+        written = 0
+
+        try:
+            async for line in transfer.export_configuration():
+                self.write(dumps(line) + "\n")
+                written += 1
+
+                if written % TransferModel.EXPORT_PAGE == 0:
+                    await self.flush()
+        except TransferError as e:
+            raise HTTPError(500, e.message)
+
+
+class ImportHandler(MeasuredHandlerMixin, AuthenticatedHandler):
+    DURATION = REQUEST_DURATION.labels("import")
+
+    @scoped(scopes=["env_admin", "env_envs_admin"])
+    async def post(self):
+        """
+        Applies the configuration passed as json lines in the request body, see TransferModel.
+        With 'overwrite=true', existing items that differ are updated instead of being reported as conflicts,
+        with 'dry_run=true' nothing is applied, but the report is the same.
+        """
+
+        transfer = self.application.transfer
+
+        overwrite = self.get_argument("overwrite", "false") == "true"
+        dry_run = self.get_argument("dry_run", "false") == "true"
+
+        try:
+            lines = self.request.body.decode("utf-8").splitlines()
+        except UnicodeDecodeError:
+            raise HTTPError(400, "Body is not utf-8")
+
+        try:
+            report = await transfer.import_configuration(lines, overwrite=overwrite, dry_run=dry_run)
+        except TransferError as e:
+            raise HTTPError(500, e.message)
+
+        self.dumps(report.dump())
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Exposes the metrics in prometheus text exposition format, to the scrapers that pass the metrics_token option
+    as a bearer token, from the networks of the metrics_networks option. Not found if there is no token configured.
+    """
+
+    def initialize(self):
+        self.networks = [
+            ipaddress.ip_network(network.strip(), strict=False)
+            for network in options.metrics_networks.split(",")
+            if network.strip()
+        ]
+
+    def get(self):
+        token = options.metrics_token
+
+        if not token:
+            raise HTTPError(404)
+
+        authorization = self.request.headers.get("Authorization", "")
+
+        if not hmac.compare_digest(authorization.encode("utf-8"), ("Bearer " + token).encode("utf-8")):
+            raise HTTPError(401)
+
+        try:
+            address = ipaddress.ip_address(self.request.remote_ip)
+        except ValueError:
+            raise HTTPError(403)
 
-        res.update(version.data)
+        if not any(address in network for network in self.networks):
+            raise HTTPError(403)
 
-        self.dumps(res)
+        self.set_header("Content-Type", MetricsRegistry.CONTENT_TYPE)
+        self.write(registry.render())
@@ -2,10 +2,51 @@
 from anthill.common.database import DuplicateError, DatabaseError
 from anthill.common.model import Model
 
+from . matcher import VersionMatcher
+from . metrics import timed
+from . transaction import transaction
 
+import functools
+
+
+# a reserved version name (in any case, as the names are compared case-insensitively), every version that is
+# neither defined, nor matched by a pattern, resolves to it
 DEFAULT = "def"
 
 
+def like_prefix(prefix):
+    """
+    Turns a prefix into a LIKE pattern that matches every string starting with it.
+    """
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def page_conditions(column, after, prefix, id_column=None, after_id=None):
+    """
+    Builds the conditions of a keyset page: the rows that go after the cursor, and start with the prefix.
+    For a column that is not unique, the rows are ordered by id_column as well, and the cursor is the
+    (after, after_id) pair of the last row.
+    Returns a (list of conditions, list of arguments) pair.
+    """
+
+    conditions = []
+    args = []
+
+    if after is not None:
+        if after_id is None:
+            conditions.append("{0}>%s".format(column))
+            args.append(after)
+        else:
+            conditions.append("({0}>%s OR ({0}=%s AND {1}>%s))".format(column, id_column))
+            args.extend([after, after, after_id])
+
+    if prefix:
+        conditions.append("{0} LIKE %s".format(column))
+        args.append(like_prefix(prefix))
+
+    return conditions, args
+
+
 class ApplicationError(Exception):
     def __init__(self, message):
         self.message = message
@@ -29,6 +70,15 @@ class ApplicationAdapter(object):
         self.title = data.get("application_title")
 
 
+class ApplicationInfoAdapter(object):
+    def __init__(self, data):
+        self.application_id = data.get("application_id")
+        self.name = data.get("application_name")
+        self.title = data.get("application_title")
+        # version_name -> version_id
+        self.versions = {}
+
+
 class ApplicationVersionAdapter(object):
     def __init__(self, data):
         self.version_id = data.get("version_id")
@@ -37,6 +87,14 @@ class ApplicationVersionAdapter(object):
         self.environment = data.get("version_environment")
 
 
+class VersionPatternAdapter(object):
+    def __init__(self, data):
+        self.pattern_id = data.get("pattern_id")
+        self.application_id = data.get("application_id")
+        self.pattern = data.get("pattern")
+        self.environment = data.get("pattern_environment")
+
+
 class ApplicationsModel(Model):
     def __init__(self, db, environment):
         self.db = db
@@ -55,8 +113,26 @@ class ApplicationsModel(Model):
 
         await self.create_application_version(test_app.application_id, "1.0", dev_env.environment_id)
 
+    async def started(self, application):
+        await self.environment.setup_or_retry(
+            functools.partial(super(ApplicationsModel, self).started, application), "applications")
+
     def get_setup_tables(self):
-        return ["applications", "application_versions"]
+        return ["applications", "application_versions", "application_version_patterns"]
+
+    @staticmethod
+    async def __stamp_application(db, application_id, revision):
+        """
+        Marks the application changed as a whole, for the writes that change how its versions resolve
+        without a version row to carry the revision (patterns, removed or renamed versions).
+        """
+
+        await db.execute(
+            """
+                UPDATE `applications`
+                SET `application_revision`=%s
+                WHERE `application_id`=%s;
+            """, revision, application_id)
 
     async def create_application(self, application_name, application_title):
 
@@ -68,22 +144,26 @@ class ApplicationsModel(Model):
             raise ApplicationExists()
 
         try:
-            record_id = await self.db.insert(
-                """
-                    INSERT INTO `applications`
-                    (`application_name`, `application_title`)
-                    VALUES (%s, %s);
-                """, application_name, application_title)
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                record_id = await db.insert(
+                    """
+                        INSERT INTO `applications`
+                        (`application_name`, `application_title`, `application_revision`)
+                        VALUES (%s, %s, %s);
+                    """, application_name, application_title, revision)
+                await db.commit()
         except DuplicateError:
             raise ApplicationExists()
         except DatabaseError as e:
             raise ApplicationError("Failed to create application: " + e.args[1])
 
+        await self.environment.applications_changed()
         return record_id
 
     async def create_application_version(self, application_id, version_name, version_environment):
 
-        if version_name == DEFAULT:
+        if version_name.lower() == DEFAULT:
             raise ApplicationError("Version '{0}' is reserved".format(DEFAULT))
 
         try:
@@ -94,45 +174,126 @@ class ApplicationsModel(Model):
             raise ReservedName()
 
         try:
-            version_id = await self.db.insert(
-                """
-                    INSERT INTO `application_versions`
-                    (`application_id`, `version_name`, version_environment)
-                    VALUES (%s, %s, %s);
-                """,
-                application_id, version_name, version_environment)
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                version_id = await db.insert(
+                    """
+                        INSERT INTO `application_versions`
+                        (`application_id`, `version_name`, version_environment, `version_revision`)
+                        VALUES (%s, %s, %s, %s);
+                    """,
+                    application_id, version_name, version_environment, revision)
+                await db.commit()
 
         except DatabaseError as e:
             raise ApplicationError("Failed to create application version: " + e.args[1])
 
+        await self.environment.versions_changed(version_id=version_id, version_name=version_name)
         return version_id
 
+    async def __check_version_pattern(self, application_id, pattern, pattern_id=None):
+        matcher = VersionMatcher([(pattern, pattern_id)])
+
+        if matcher.errors:
+            raise ApplicationError(matcher.errors[0])
+
+        patterns = await self.list_version_patterns(application_id)
+
+        matcher = VersionMatcher([
+            (existing.pattern, existing.pattern_id)
+            for existing in patterns
+            if str(existing.pattern_id) != str(pattern_id)
+        ] + [(pattern, pattern_id)])
+
+        if matcher.conflicts:
+            conflict, other = matcher.conflicts[0]
+            raise ApplicationError("Pattern '{0}' overlaps with '{1}'".format(conflict, other))
+
+    async def create_version_pattern(self, application_id, pattern, pattern_environment):
+        """
+        Maps every version that matches the pattern to the environment (unless that exact version is defined).
+        Patterns of the same application may not overlap.
+        """
+
+        pattern = pattern.strip()
+        await self.__check_version_pattern(application_id, pattern)
+
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                pattern_id = await db.insert(
+                    """
+                        INSERT INTO `application_version_patterns`
+                        (`application_id`, `pattern`, `pattern_environment`)
+                        VALUES (%s, %s, %s);
+                    """, application_id, pattern, pattern_environment)
+                await ApplicationsModel.__stamp_application(db, application_id, revision)
+                await db.commit()
+        except DatabaseError as e:
+            raise ApplicationError("Failed to create version pattern: " + e.args[1])
+
+        await self.environment.versions_changed(application_id=application_id)
+        return pattern_id
+
     async def delete_application(self, application_id):
 
         try:
-            deleted = await self.db.execute(
-                """
-                    DELETE FROM `applications`
-                    WHERE `application_id`=%s;
-                """, application_id)
+            async with transaction(self.db) as db:
+                await self.environment.next_revision(db)
+                deleted = await db.execute(
+                    """
+                        DELETE FROM `applications`
+                        WHERE `application_id`=%s;
+                    """, application_id)
+                await db.commit()
 
         except DatabaseError as e:
             raise ApplicationError("Failed to delete application: " + e.args[1])
-        else:
-            return bool(deleted)
+
+        await self.environment.versions_changed(application_id=application_id)
+        return bool(deleted)
 
     async def delete_application_version(self, version_id):
         try:
-            deleted = await self.db.execute(
-                """
-                    DELETE FROM `application_versions`
-                    WHERE `version_id`=%s;
-                """, version_id)
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                await db.execute(
+                    """
+                        UPDATE `applications`, `application_versions`
+                        SET `applications`.`application_revision`=%s
+                        WHERE `application_versions`.`version_id`=%s
+                            AND `applications`.`application_id`=`application_versions`.`application_id`;
+                    """, revision, version_id)
+                deleted = await db.execute(
+                    """
+                        DELETE FROM `application_versions`
+                        WHERE `version_id`=%s;
+                    """, version_id)
+                await db.commit()
         except DatabaseError as e:
             raise ApplicationError("Failed to delete application version: " + e.args[1])
-        else:
-            return bool(deleted)
 
+        await self.environment.versions_changed(version_id=version_id)
+        return bool(deleted)
+
+    async def delete_version_pattern(self, application_id, pattern_id):
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                deleted = await db.execute(
+                    """
+                        DELETE FROM `application_version_patterns`
+                        WHERE `application_id`=%s AND `pattern_id`=%s;
+                    """, application_id, pattern_id)
+                await ApplicationsModel.__stamp_application(db, application_id, revision)
+                await db.commit()
+        except DatabaseError as e:
+            raise ApplicationError("Failed to delete version pattern: " + e.args[1])
+
+        await self.environment.versions_changed(application_id=application_id)
+        return bool(deleted)
+
+    @timed("find_application")
     async def find_application(self, application_name):
 
         try:
@@ -150,6 +311,7 @@ class ApplicationsModel(Model):
 
         return ApplicationAdapter(app)
 
+    @timed("find_application_version")
     async def find_application_version(self, application_id, version_name):
 
         try:
@@ -168,6 +330,7 @@ class ApplicationsModel(Model):
 
         return ApplicationVersionAdapter(version)
 
+    @timed("get_application")
     async def get_application(self, application_id):
         try:
             application = await self.db.get(
@@ -185,6 +348,7 @@ class ApplicationsModel(Model):
 
         return ApplicationAdapter(application)
 
+    @timed("get_application_version")
     async def get_application_version(self, application_id, version_id):
 
         try:
@@ -203,64 +367,341 @@ class ApplicationsModel(Model):
 
         return ApplicationVersionAdapter(version)
 
-    async def list_application_versions(self, application_id):
+    @timed("get_applications_info")
+    async def get_applications_info(self, application_names=None):
+        """
+        Returns a list of ApplicationInfoAdapter (an application along with its versions) for each of
+        the application names given (the missing ones are omitted), or for all applications if None.
+        Everything is fetched with a single query.
+        """
+
+        if application_names is not None and not application_names:
+            return []
+
+        if application_names is None:
+            condition, args = "", []
+        else:
+            condition = "WHERE `applications`.`application_name` IN ({0})".format(
+                ", ".join(["%s"] * len(application_names)))
+            args = list(application_names)
+
+        try:
+            rows = await self.db.query(
+                """
+                    SELECT `applications`.`application_id`, `application_name`, `application_title`,
+                        `version_id`, `version_name`
+                    FROM `applications`
+                    LEFT JOIN `application_versions`
+                        ON `application_versions`.`application_id`=`applications`.`application_id`
+                            AND `application_versions`.`version_name`<>%s
+                    {0}
+                    ORDER BY `application_name` ASC;
+                """.format(condition), DEFAULT, *args)
+        except DatabaseError as e:
+            raise ApplicationError("Failed to get applications info: " + e.args[1])
+
+        result = {}
+
+        for row in rows:
+            info = result.get(row["application_id"])
+
+            if info is None:
+                info = result[row["application_id"]] = ApplicationInfoAdapter(row)
+
+            if row["version_id"] is not None:
+                info.versions[row["version_name"]] = row["version_id"]
+
+        return list(result.values())
+
+    async def get_default_environment(self, application_id):
+        """
+        Returns the id of the environment unknown versions of the application resolve to, or None.
+        """
+
+        try:
+            version = await self.find_application_version(application_id, DEFAULT)
+        except VersionNotFound:
+            return None
+
+        return version.environment
+
+    async def get_version_pattern(self, application_id, pattern_id):
+        try:
+            pattern = await self.db.get(
+                """
+                    SELECT *
+                    FROM `application_version_patterns`
+                    WHERE `application_id`=%s AND `pattern_id`=%s;
+                """, application_id, pattern_id)
+        except DatabaseError as e:
+            raise ApplicationError("Failed to get version pattern: " + e.args[1])
+
+        if pattern is None:
+            raise VersionPatternNotFound()
+
+        return VersionPatternAdapter(pattern)
+
+    @timed("list_application_versions")
+    async def list_application_versions(self, application_id, after=None, limit=None, prefix=None, after_id=None):
+        """
+        Lists versions of the application ordered by name (and id, the names are not unique). Pass the name and
+        the id of the last version of a page as 'after' and 'after_id' to get the next one, and a 'prefix'
+        to only list the versions starting with it.
+        """
+
+        conditions, args = page_conditions("`version_name`", after, prefix, "`version_id`", after_id)
+
+        if limit is not None:
+            args.append(int(limit))
 
         try:
             versions = await self.db.query(
                 """
                     SELECT *
                     FROM `application_versions`
-                    WHERE `application_id`=%s
-                    ORDER BY `version_name` ASC;
-                """, application_id)
+                    WHERE `application_id`=%s AND `version_name`<>%s {0}
+                    ORDER BY `version_name` ASC, `version_id` ASC
+                    {1};
+                """.format(
+                    "".join(" AND " + condition for condition in conditions),
+                    "" if limit is None else "LIMIT %s"),
+                application_id, DEFAULT, *args)
         except DatabaseError as e:
             raise ApplicationError("Failed to list application versions: " + e.args[1])
 
         return list(map(ApplicationVersionAdapter, versions))
 
-    async def list_applications(self):
+    @timed("list_applications")
+    async def list_applications(self, after=None, limit=None, prefix=None):
+        """
+        Lists applications ordered by name. Pass the name of the last application of a page
+        as 'after' to get the next one, and a 'prefix' to only list the applications starting with it.
+        """
+
+        conditions, args = page_conditions("`application_name`", after, prefix)
+
+        if limit is not None:
+            args.append(int(limit))
 
         try:
             apps = await self.db.query(
                 """
                     SELECT `application_id`, `application_name`, `application_title`
                     FROM `applications`
-                    ORDER BY `application_name` ASC;
-                """)
+                    {0}
+                    ORDER BY `application_name` ASC
+                    {1};
+                """.format(
+                    "WHERE " + " AND ".join(conditions) if conditions else "",
+                    "" if limit is None else "LIMIT %s"),
+                *args)
 
         except DatabaseError as e:
             raise ApplicationError("Failed to list applications: " + e.args[1])
 
         return list(map(ApplicationAdapter, apps))
 
-    async def update_application(self, application_id, application_name, application_title):
+    async def list_version_patterns(self, application_id):
         try:
-            updated = await self.db.execute(
+            patterns = await self.db.query(
                 """
-                    UPDATE `applications`
-                    SET `application_name`=%s, `application_title`=%s
-                    WHERE `application_id`=%s;
-                """, application_name, application_title, application_id)
+                    SELECT *
+                    FROM `application_version_patterns`
+                    WHERE `application_id`=%s
+                    ORDER BY `pattern` ASC;
+                """, application_id)
+        except DatabaseError as e:
+            raise ApplicationError("Failed to list version patterns: " + e.args[1])
+
+        return list(map(VersionPatternAdapter, patterns))
+
+    async def move_versions(self, application_id, environment_id, version_names=None, pattern=None,
+                            from_environment_id=None):
+        """
+        Re-points a set of versions of the application to the environment with a single UPDATE, and
+        invalidates them at once. The versions are either the listed version_names, or the ones that match
+        a pattern (in the same notation the version patterns use), or all of them if neither is given.
+        With from_environment_id, only the versions currently pointing to that environment are moved.
+        Returns the amount of versions moved.
+        """
+
+        if version_names is not None and pattern is not None:
+            raise ApplicationError("Either version names or a pattern should be given, not both")
+
+        if version_names is not None and not version_names:
+            return 0
+
+        matcher = None
+
+        if pattern is not None:
+            matcher = VersionMatcher([(pattern, True)])
+
+            if matcher.errors:
+                raise ApplicationError(matcher.errors[0])
+
+        conditions = ["`application_id`=%s", "`version_name`<>%s"]
+        args = [application_id, DEFAULT]
+
+        if from_environment_id is not None:
+            conditions.append("`version_environment`=%s")
+            args.append(from_environment_id)
+
+        try:
+            async with transaction(self.db) as db:
+                if version_names is not None:
+                    conditions.append("`version_name` IN ({0})".format(", ".join(["%s"] * len(version_names))))
+                    args.extend(version_names)
+                elif matcher is not None:
+                    # version ranges are not something sql could do, so the names are matched here
+                    versions = await db.query(
+                        """
+                            SELECT `version_id`, `version_name`
+                            FROM `application_versions`
+                            WHERE {0}
+                            FOR UPDATE;
+                        """.format(" AND ".join(conditions)), *args)
+
+                    version_ids = [
+                        version["version_id"]
+                        for version in versions
+                        if matcher.match(version["version_name"])
+                    ]
+
+                    if not version_ids:
+                        await db.commit()
+                        return 0
+
+                    conditions.append("`version_id` IN ({0})".format(", ".join(["%s"] * len(version_ids))))
+                    args.extend(version_ids)
+
+                revision = await self.environment.next_revision(db)
+                moved = await db.execute(
+                    """
+                        UPDATE `application_versions`
+                        SET `version_environment`=%s, `version_revision`=%s
+                        WHERE {0};
+                    """.format(" AND ".join(conditions)), environment_id, revision, *args)
+
+                await db.commit()
+        except DatabaseError as e:
+            raise ApplicationError("Failed to move application versions: " + e.args[1])
+
+        if moved:
+            await self.environment.versions_changed(application_id=application_id)
+
+        return moved
+
+    async def set_default_environment(self, application_id, environment_id):
+        """
+        Makes unknown versions of the application resolve to the environment, or to nothing if it is None.
+        The default is kept as an application version with the reserved name.
+        """
+
+        try:
+            version = await self.find_application_version(application_id, DEFAULT)
+        except VersionNotFound:
+            version = None
+
+        if environment_id is None and version is None:
+            return False
+
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+
+                if environment_id is None:
+                    await db.execute(
+                        """
+                            DELETE FROM `application_versions`
+                            WHERE `version_id`=%s;
+                        """, version.version_id)
+                    await ApplicationsModel.__stamp_application(db, application_id, revision)
+                elif version is None:
+                    await db.insert(
+                        """
+                            INSERT INTO `application_versions`
+                            (`application_id`, `version_name`, `version_environment`, `version_revision`)
+                            VALUES (%s, %s, %s, %s);
+                        """, application_id, DEFAULT, environment_id, revision)
+                else:
+                    await db.execute(
+                        """
+                            UPDATE `application_versions`
+                            SET `version_environment`=%s, `version_revision`=%s
+                            WHERE `version_id`=%s;
+                        """, environment_id, revision, version.version_id)
+
+                await db.commit()
+        except DatabaseError as e:
+            raise ApplicationError("Failed to set default environment: " + e.args[1])
+
+        await self.environment.versions_changed(application_id=application_id)
+        return True
+
+    async def update_application(self, application_id, application_name, application_title):
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                updated = await db.execute(
+                    """
+                        UPDATE `applications`
+                        SET `application_name`=%s, `application_title`=%s, `application_revision`=%s
+                        WHERE `application_id`=%s;
+                    """, application_name, application_title, revision, application_id)
+                await db.commit()
         except DuplicateError:
             raise ApplicationExists()
         except DatabaseError as e:
             raise ApplicationError("Failed to update application: " + e.args[1])
 
+        await self.environment.versions_changed(application_id=application_id)
+        await self.environment.applications_changed()
         return bool(updated)
 
     async def update_application_version(self, application_id, version_id, version_name, version_env):
+
+        if version_name.lower() == DEFAULT:
+            raise ApplicationError("Version '{0}' is reserved".format(DEFAULT))
+
         try:
-            updated = await self.db.execute(
-                """
-                    UPDATE `application_versions`
-                    SET `version_name`=%s, version_environment=%s
-                    WHERE `version_id`=%s AND `application_id`=%s;
-                """,
-                version_name, version_env, version_id, application_id
-            )
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                updated = await db.execute(
+                    """
+                        UPDATE `application_versions`
+                        SET `version_name`=%s, version_environment=%s, `version_revision`=%s
+                        WHERE `version_id`=%s AND `application_id`=%s;
+                    """,
+                    version_name, version_env, revision, version_id, application_id
+                )
+                # the version might have been renamed, so its previous name resolves differently now
+                await ApplicationsModel.__stamp_application(db, application_id, revision)
+                await db.commit()
         except DatabaseError as e:
             raise ApplicationError("Failed to update application version: " + e.args[1])
 
+        await self.environment.versions_changed(version_id=version_id, version_name=version_name)
+        return bool(updated)
+
+    async def update_version_pattern(self, application_id, pattern_id, pattern, pattern_environment):
+        pattern = pattern.strip()
+        await self.__check_version_pattern(application_id, pattern, pattern_id)
+
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                updated = await db.execute(
+                    """
+                        UPDATE `application_version_patterns`
+                        SET `pattern`=%s, `pattern_environment`=%s
+                        WHERE `pattern_id`=%s AND `application_id`=%s;
+                    """, pattern, pattern_environment, pattern_id, application_id)
+                await ApplicationsModel.__stamp_application(db, application_id, revision)
+                await db.commit()
+        except DatabaseError as e:
+            raise ApplicationError("Failed to update version pattern: " + e.args[1])
+
+        await self.environment.versions_changed(application_id=application_id)
         return bool(updated)
 
 
@@ -274,3 +715,7 @@ class ReservedName(Exception):
 
 class VersionNotFound(Exception):
     pass
+
+
+class VersionPatternNotFound(Exception):
+    pass
@@ -0,0 +1,87 @@
+import logging
+import time
+
+
+class CircuitBreaker(object):
+    """
+    Stops the callers from waiting on a database that keeps failing or responding too slow.
+
+    Once 'failures' calls in a row have failed (or took longer than 'latency' seconds), the breaker opens and
+    allow() returns False for 'reset_timeout' seconds. After that a single probe call is let through: if it
+    succeeds the breaker closes, otherwise it opens again for another 'reset_timeout'.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    DEFAULT_FAILURES = 5
+    DEFAULT_LATENCY = 1.0
+    DEFAULT_RESET_TIMEOUT = 10
+
+    def __init__(self, name, failures=DEFAULT_FAILURES, latency=DEFAULT_LATENCY,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        """
+        :param failures: amount of failures in a row to open the breaker at, 0 to never open it
+        :param latency: seconds a call could take before it is counted as a failure, 0 for no limit
+        :param reset_timeout: seconds to stay open before a probe call is let through
+        """
+
+        self.name = name
+        self.failures = failures
+        self.latency = latency
+        self.reset_timeout = reset_timeout
+
+        self.state = CircuitBreaker.CLOSED
+        self.failed = 0
+        # when the breaker has opened, or when the probe has been let through
+        self.changed = 0
+
+    def allow(self):
+        """
+        Returns True if a call should be made, False if the caller should not wait for it.
+        """
+
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+
+        now = time.monotonic()
+
+        # a probe that never reported back is not waited for forever
+        if now - self.changed < self.reset_timeout:
+            return False
+
+        self.state = CircuitBreaker.HALF_OPEN
+        self.changed = now
+        return True
+
+    def success(self, elapsed):
+        """
+        Reports a call that has completed in 'elapsed' seconds.
+        """
+
+        if self.latency and elapsed > self.latency:
+            self.failure()
+            return
+
+        self.failed = 0
+
+        if self.state != CircuitBreaker.CLOSED:
+            self.state = CircuitBreaker.CLOSED
+            logging.warning("Circuit breaker {0} closed".format(self.name))
+
+    def failure(self):
+        """
+        Reports a call that has failed.
+        """
+
+        self.failed += 1
+
+        if not self.failures:
+            return
+
+        if self.state == CircuitBreaker.HALF_OPEN or (
+                self.state == CircuitBreaker.CLOSED and self.failed >= self.failures):
+            self.state = CircuitBreaker.OPEN
+            self.changed = time.monotonic()
+            logging.warning("Circuit breaker {0} opened after {1} failures".format(self.name, self.failed))
@@ -0,0 +1,212 @@
+from tornado.ioloop import IOLoop
+
+import hashlib
+import hmac
+import logging
+import socket
+import time
+import ujson
+import uuid
+
+
+class InvalidationBusError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class InvalidationBus(object):
+    """
+    Broadcasts change events between service instances, so each of them could drop its caches right away.
+    An event is a json-serializable dict; every event carries the 'origin' of the instance that published it,
+    and subscribers are not called for the events published by the same instance.
+    Each kind of bus defines its own publish(event).
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Registers an async callback(event) to be called on every event published by other instances.
+        """
+        self.subscribers.append(callback)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def deliver(self, event):
+        if event.get("origin") == self.origin:
+            return
+
+        for callback in self.subscribers:
+            try:
+                await callback(event)
+            except Exception:
+                logging.exception("Failed to process invalidation event")
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """
+    An in-process stand-in: instances that share a channel name within the same process see each other's events.
+    With a single instance nothing is delivered anywhere, which is exactly right for a single node deployment.
+    """
+
+    channels = {}
+
+    def __init__(self, channel="default"):
+        super(LocalInvalidationBus, self).__init__()
+        self.channel = channel
+
+    async def start(self):
+        LocalInvalidationBus.channels.setdefault(self.channel, []).append(self)
+
+    async def stop(self):
+        members = LocalInvalidationBus.channels.get(self.channel, [])
+        if self in members:
+            members.remove(self)
+
+    async def publish(self, event):
+        event = dict(event, origin=self.origin)
+
+        for member in list(LocalInvalidationBus.channels.get(self.channel, [])):
+            await member.deliver(event)
+
+
+class DatagramInvalidationBus(InvalidationBus):
+    """
+    Sends every event as a UDP datagram to each of the peers, and listens for the events of the peers.
+    Meant for a handful of nodes on a private network; a lost datagram is only as bad as a cache entry
+    living until its ttl expires.
+
+    Every datagram is signed with a secret shared by the instances (HMAC-SHA256 of the event, prepended to it),
+    and carries the time it has been sent at, so the datagrams that are not signed, or are too old to be
+    anything but replayed, are dropped.
+    """
+
+    MAX_DATAGRAM = 65507
+    # seconds a datagram is accepted for after it has been sent, the clocks of the instances should agree on it
+    MAX_AGE = 30
+    SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+    def __init__(self, listen, peers, secret):
+        super(DatagramInvalidationBus, self).__init__()
+        self.listen = listen
+        self.peers = peers
+        self.secret = secret.encode("utf-8")
+        self.socket = None
+
+    def sign(self, event):
+        data = ujson.dumps(dict(event, origin=self.origin, sent=time.time())).encode("utf-8")
+        return hmac.new(self.secret, data, hashlib.sha256).digest() + data
+
+    def verify(self, datagram):
+        """
+        Returns the event of a datagram, or None if it is not signed with the secret, corrupted or too old.
+        """
+
+        size = DatagramInvalidationBus.SIGNATURE_SIZE
+        signature, data = datagram[:size], datagram[size:]
+
+        if not hmac.compare_digest(signature, hmac.new(self.secret, data, hashlib.sha256).digest()):
+            return None
+
+        try:
+            event = ujson.loads(data)
+        except ValueError:
+            return None
+
+        if not isinstance(event, dict) or not isinstance(event.get("sent"), (int, float)):
+            return None
+
+        if abs(time.time() - event["sent"]) > DatagramInvalidationBus.MAX_AGE:
+            return None
+
+        return event
+
+    async def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.bind(self.listen)
+
+        IOLoop.current().add_handler(self.socket.fileno(), self.__on_readable, IOLoop.READ)
+
+    async def stop(self):
+        if self.socket is None:
+            return
+
+        IOLoop.current().remove_handler(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+
+    def __on_readable(self, fd, events):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(DatagramInvalidationBus.MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logging.exception("Failed to receive invalidation event")
+                return
+
+            event = self.verify(data)
+
+            if event is None:
+                logging.warning("Dropped an unsigned, corrupted or outdated invalidation event from {0}".format(
+                    address[0]))
+                continue
+
+            IOLoop.current().spawn_callback(self.deliver, event)
+
+    async def publish(self, event):
+        if self.socket is None:
+            return
+
+        data = self.sign(event)
+
+        for peer in self.peers:
+            try:
+                self.socket.sendto(data, peer)
+            except OSError as e:
+                logging.warning("Failed to send invalidation event to {0}: {1}".format(peer, e))
+
+
+def parse_address(address):
+    host, sep, port = address.strip().rpartition(":")
+
+    if not sep or not port.isdigit():
+        raise InvalidationBusError("Bad address: {0}".format(address))
+
+    # only the same host could reach a listener that has not been given an interface
+    return host or "127.0.0.1", int(port)
+
+
+def create_bus(location, peers, secret=""):
+    """
+    Creates an invalidation bus out of a location:
+        local[:channel]    an in-process bus
+        udp:[host]:port    a datagram bus listening on host:port (127.0.0.1 if omitted), and sending
+                           to comma-separated peers, signed with the secret (required)
+    """
+
+    kind, sep, rest = location.partition(":")
+
+    if kind == "local":
+        return LocalInvalidationBus(rest or "default")
+
+    if kind == "udp":
+        if not secret:
+            raise InvalidationBusError("A datagram invalidation bus requires a secret")
+
+        return DatagramInvalidationBus(
+            parse_address(rest),
+            [parse_address(peer) for peer in peers.split(",") if peer.strip()],
+            secret)
+
+    raise InvalidationBusError("Unknown invalidation bus: {0}".format(location))
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+import time
+
+
+class LRUCache(object):
+    """
+    A bounded in-process cache that evicts least recently used entries first.
+    If ttl (in seconds) is given, entries also expire that long after they were put.
+    Counts hits, misses and evictions (of both the least recently used and the expired entries).
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if self.ttl is not None:
+            expires, value = value
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                self.evictions += 1
+                return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        if self.ttl is not None:
+            value = (time.monotonic() + self.ttl, value)
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def remove_if(self, predicate):
+        """
+        Removes every entry predicate(key, value) holds true for.
+        """
+
+        if self.ttl is not None:
+            stale = [key for key, (expires, value) in self.entries.items() if predicate(key, value)]
+        else:
+            stale = [key for key, value in self.entries.items() if predicate(key, value)]
+
+        for key in stale:
+            del self.entries[key]
+
+        return len(stale)
+
+    def clear(self):
+        self.entries.clear()
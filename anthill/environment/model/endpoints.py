@@ -0,0 +1,107 @@
+import hashlib
+import math
+import random
+
+
+# length of the `environment_discovery` column
+MAX_DISCOVERY_LENGTH = 1024
+MAX_WEIGHT = 1000
+
+
+class EndpointsInvalid(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class Endpoint(object):
+    def __init__(self, url, weight=1):
+        self.url = url
+        self.weight = weight
+
+
+def parse_endpoints(discovery):
+    """
+    Parses a discovery service location: a comma-separated list of urls, each optionally followed by
+    a weight after a space, like "http://discovery-1 3, http://discovery-2 1". A single url, as it always
+    has been, is a list of one endpoint.
+    Returns a list of Endpoint, raises EndpointsInvalid if malformed.
+    """
+
+    if not isinstance(discovery, str) or not discovery.strip():
+        raise EndpointsInvalid("No discovery service location")
+
+    if len(discovery) > MAX_DISCOVERY_LENGTH:
+        raise EndpointsInvalid("Discovery service location is too long")
+
+    endpoints = []
+    urls = set()
+
+    for item in discovery.split(","):
+        parts = item.split()
+
+        if not parts or len(parts) > 2:
+            raise EndpointsInvalid("Malformed endpoint: '{0}'".format(item.strip()))
+
+        url = parts[0]
+        weight = 1
+
+        if len(parts) == 2:
+            try:
+                weight = int(parts[1])
+            except ValueError:
+                raise EndpointsInvalid("Weight of {0} is not a number".format(url))
+
+            if weight < 1 or weight > MAX_WEIGHT:
+                raise EndpointsInvalid("Weight of {0} should be from 1 to {1}".format(url, MAX_WEIGHT))
+
+        if url in urls:
+            raise EndpointsInvalid("Endpoint {0} is listed twice".format(url))
+
+        urls.add(url)
+        endpoints.append(Endpoint(url, weight))
+
+    return endpoints
+
+
+def read_endpoints(discovery):
+    """
+    Same as parse_endpoints, for the locations already stored: whatever cannot be parsed (say, stored before
+    the lists were supported) is taken as a single url as it is.
+    """
+
+    try:
+        return parse_endpoints(discovery)
+    except EndpointsInvalid:
+        return [Endpoint(discovery)]
+
+
+def rendezvous_score(client_id, endpoint):
+    digest = hashlib.blake2b((client_id + "\0" + endpoint.url).encode("utf-8"), digest_size=8).digest()
+    # uniform in (0, 1), never exactly 0 or 1: 53 bits is what a float holds
+    uniform = ((int.from_bytes(digest, "big") >> 11) + 1) / float(2 ** 53 + 2)
+    return -endpoint.weight / math.log(uniform)
+
+
+def select_endpoint(endpoints, client_id=None, exclude=None):
+    """
+    Picks one of the endpoints in proportion to their weights, leaving out the urls in 'exclude'
+    (unless that leaves nothing, then all of them are considered).
+
+    With a client_id the pick is deterministic (weighted rendezvous hashing): a client keeps getting the same
+    endpoint, and only the clients of an endpoint that has been left out move elsewhere.
+    Without it the pick is random.
+    """
+
+    if len(endpoints) == 1:
+        return endpoints[0]
+
+    if exclude:
+        endpoints = [endpoint for endpoint in endpoints if endpoint.url not in exclude] or endpoints
+
+    if client_id is None:
+        return random.choices(endpoints, weights=[endpoint.weight for endpoint in endpoints])[0]
+
+    return max(endpoints, key=lambda endpoint: rendezvous_score(client_id, endpoint))
@@ -3,6 +3,32 @@ from anthill.common.database import DuplicateError, DatabaseError
 from anthill.common.model import Model
 from anthill.common.validate import validate
 
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.locks import Condition, Lock
+
+from jsonschema.exceptions import SchemaError, best_match
+from jsonschema.validators import validator_for
+
+from . application import DEFAULT
+from . breaker import CircuitBreaker
+from . bus import LocalInvalidationBus
+from . cache import LRUCache
+from . endpoints import parse_endpoints, read_endpoints, select_endpoint
+from . matcher import VersionMatcher
+from . metrics import timed
+from . migration import migrate
+from . response import DiscoverResponse
+from . snapshot import RoutingSnapshot
+from . store import SnapshotStoreError
+from . transaction import transaction
+
+from datetime import timedelta
+
+import functools
+import logging
+import time
 import ujson
 
 
@@ -14,27 +40,587 @@ class EnvironmentDataError(Exception):
         return self.message
 
 
+def compile_scheme(scheme):
+    """
+    Turns a json schema into a validator, the expensive part of validation that only needs to be done once.
+    """
+
+    validator_class = validator_for(scheme)
+
+    try:
+        validator_class.check_schema(scheme)
+    except SchemaError as e:
+        raise SchemeInvalid("Scheme is not a valid json schema: " + e.message)
+
+    return validator_class(scheme)
+
+
+def validation_error(validator, data):
+    """
+    Returns a message describing why the data does not fit in the scheme, or None if it does.
+    """
+
+    error = best_match(validator.iter_errors(data))
+
+    if error is None:
+        return None
+
+    if error.absolute_path:
+        return "{0}: {1}".format("/".join(map(str, error.absolute_path)), error.message)
+
+    return error.message
+
+
 class EnvironmentAdapter(object):
     def __init__(self, data):
         self.environment_id = data.get("environment_id")
         self.name = data.get("environment_name")
         self.discovery = data.get("environment_discovery")
         self.data = data.get("environment_data")
+        self.endpoints = read_endpoints(self.discovery)
 
 
 class EnvironmentPlusVersionAdapter(object):
     def __init__(self, data):
+        self.application_id = data.get("application_id")
+        self.version_id = data.get("version_id")
+        self.environment_id = data.get("environment_id")
         self.discovery = data.get("environment_discovery")
         self.data = data.get("environment_data")
+        self.revision = data.get("environment_revision", 0)
+        self.endpoints = read_endpoints(self.discovery)
+        # the RegionAdapter the environment has been localized with, if any
+        self.region = None
+        # endpoint url -> DiscoverResponse pointing to it
+        self._responses = {}
+        # region name -> the environment localized for it
+        self._localized = {}
+
+    @property
+    def response(self):
+        """
+        The answer pointing to the first endpoint, for where it cannot be picked per request.
+        """
+        return self.response_for(self.endpoints[0].url)
+
+    def response_for(self, url):
+        response = self._responses.get(url)
+        if response is None:
+            response = DiscoverResponse(url, self.data)
+            self._responses[url] = response
+        return response
+
+    def localized(self, region):
+        """
+        Returns the environment as the clients of a region see it: the discovery location of the region
+        (if it has one) and its variables over the environment's own. Kept along until the region changes.
+        """
+
+        localized = self._localized.get(region.name)
+
+        if localized is None or localized.region is not region:
+            data = dict(self.data)
+            data.update(region.data)
+
+            localized = EnvironmentPlusVersionAdapter({
+                "application_id": self.application_id,
+                "version_id": self.version_id,
+                "environment_id": self.environment_id,
+                "environment_discovery": region.discovery or self.discovery,
+                "environment_data": data,
+                "environment_revision": self.revision
+            })
+            localized.region = region
+            self._localized[region.name] = localized
+
+        return localized
 
 
 class EnvironmentModel(Model):
-    def __init__(self, db):
+    DEFAULT_CACHE_SIZE = 10000
+    DEFAULT_ENVIRONMENT_CACHE_TIME = 600
+    DEFAULT_MISSING_CACHE_TIME = 10
+    DEFAULT_SNAPSHOT_REFRESH = 60
+    # seconds between the attempts to set up the database, while serving a stored snapshot, doubled each time
+    SETUP_RETRY_MIN = 1
+    SETUP_RETRY_MAX = 60
+
+    # length of `application_name` and `version_name` columns, anything longer cannot exist
+    MAX_NAME_LENGTH = 45
+    # a version known to not exist
+    MISSING = object()
+    # a version that could not be resolved: the database is unavailable, and nothing is known about it
+    UNAVAILABLE = object()
+    # the breaker-guarded queries are given that many times the latency the breaker tolerates, then abandoned
+    QUERY_TIMEOUT_FACTOR = 2
+
+    def __init__(self, db, cache_size=DEFAULT_CACHE_SIZE, missing_cache_time=DEFAULT_MISSING_CACHE_TIME,
+                 snapshot=True, snapshot_refresh=DEFAULT_SNAPSHOT_REFRESH,
+                 environment_cache_time=DEFAULT_ENVIRONMENT_CACHE_TIME, bus=None, snapshot_store=None, breaker=None):
         self.db = db
 
+        # every write is published over the bus, so the other instances would drop their caches as well
+        self.bus = bus or LocalInvalidationBus()
+        self.bus.subscribe(self.__on_bus_event)
+
+        # ("id", environment_id), ("name", environment_name) or ("list", ) -> what the getters return
+        self.environments_cache = LRUCache(cache_size, ttl=environment_cache_time)
+        self.environments_generation = 0
+
+        # (app_name, app_version) -> EnvironmentPlusVersionAdapter
+        self.versions_cache = LRUCache(cache_size)
+        # (app_name, app_version) -> True, for lookups known to end up with EnvironmentNotFound
+        self.missing_cache = LRUCache(cache_size, ttl=missing_cache_time)
+        # app_name -> VersionMatcher of EnvironmentPlusVersionAdapter, for the versions not defined exactly
+        self.patterns_cache = LRUCache(cache_size)
+        # bumped on every invalidation so a lookup that raced with a write would not cache a stale result
+        self.versions_generation = 0
+        # (app_name, app_version) -> the last resolved environment (or MISSING), never invalidated;
+        # served instead of an error while the database is failing
+        self.stale_cache = LRUCache(cache_size)
+        # stops discovery from waiting on a failing database
+        self.breaker = breaker or CircuitBreaker("discovery")
+        # (app_name, app_version) -> (Future of the lookup in progress, versions_generation it has started at),
+        # so concurrent lookups of the same version would share a single query
+        self.inflight = {}
+        # a set of every existing application name (lowercase, as the names are compared case-insensitively),
+        # or None if it is not known
+        self.application_names = None
+
+        # the scheme and its compiled validator, once loaded
+        self.scheme = None
+        self.scheme_validator = None
+        self.scheme_generation = 0
+        # environment id (as a string) -> (environment name, why its variables do not fit in the scheme),
+        # as of the last re-validation
+        self.invalid_environments = {}
+
+        self.snapshot_enabled = snapshot
+        self.snapshot_refresh = snapshot_refresh
+        self.snapshot_refresh_callback = None
+        self.snapshot_lock = Lock()
+        # every reload request gets a number, so a reload that has started after a request was made satisfies it
+        self.snapshot_requested = 0
+        self.snapshot_loaded = 0
+        # a RoutingSnapshot once loaded, discovery is resolved from it without touching the database
+        self.snapshot = None
+        # callbacks(snapshot) called every time a new snapshot is swapped in
+        self.snapshot_listeners = []
+        # notified every time a new snapshot is swapped in, the watchers wait on it
+        self.revision_condition = Condition()
+        # discovery endpoint urls the clients should not be pointed to, kept by EndpointHealthChecker
+        self.unhealthy_endpoints = frozenset()
+        # a SnapshotStore to keep the last loaded snapshot in, for the next start
+        self.snapshot_store = snapshot_store
+        self.snapshot_storing = False
+        # the rows to store once the write in progress is done, only the latest ones are worth the disk
+        self.snapshot_pending = None
+
     def get_setup_db(self):
         return self.db
 
+    async def started(self, application):
+        await self.setup_or_retry(
+            functools.partial(self.__set_up, application), "environments", recovered=self.__snapshot_recovered)
+        await self.bus.start()
+
+        IOLoop.current().spawn_callback(self.__revalidate_environments)
+
+        if not self.snapshot_enabled:
+            await self.applications_changed(publish=False)
+            return
+
+        try:
+            await self.reload_snapshot()
+        except EnvironmentDataError as e:
+            if self.snapshot is None:
+                logging.warning("Failed to load routing snapshot, falling back to database: " + e.message)
+            else:
+                logging.warning("Failed to load routing snapshot, serving the stored one: " + e.message)
+
+            # on a fresh install the tables of the other models are yet to be created, so it is retried
+            # shortly rather than on the next refresh
+            IOLoop.current().spawn_callback(self.__retry_first_snapshot)
+
+        if self.snapshot_refresh > 0:
+            self.snapshot_refresh_callback = PeriodicCallback(
+                self.__schedule_snapshot_refresh, self.snapshot_refresh * 1000)
+            self.snapshot_refresh_callback.start()
+
+    async def __retry_first_snapshot(self):
+        delay = EnvironmentModel.SETUP_RETRY_MIN
+
+        # until any snapshot has been loaded from the database, a refresh or a write might get one first
+        while self.snapshot_loaded == 0:
+            await gen.sleep(delay)
+
+            if self.snapshot_loaded:
+                break
+
+            try:
+                await self.reload_snapshot()
+            except EnvironmentDataError as e:
+                delay = min(delay * 2, EnvironmentModel.SETUP_RETRY_MAX)
+                logging.warning("Failed to load routing snapshot, retrying in {0}s: {1}".format(delay, e.message))
+
+    async def __set_up(self, application):
+        await super(EnvironmentModel, self).started(application)
+        # the tables created by an earlier version lack the columns added since, the other models rely on
+        # them as well, so they are added before those are started
+        await migrate(self.db)
+
+    async def setup_or_retry(self, setup, name, recovered=None):
+        """
+        Runs the setup of a model (the tables to create and such). If that fails while a stored snapshot
+        has been loaded, the service starts anyway, serving discovery from the snapshot, and the setup is
+        retried in background until the database is back.
+
+        :param setup: a coroutine function to run the setup
+        :param recovered: a coroutine function to call once the setup retried in background has succeeded
+        :returns: False if the setup has been left to the background
+        """
+
+        try:
+            await setup()
+        except DatabaseError as e:
+            if self.snapshot is None:
+                raise
+
+            logging.warning("Failed to set up {0}, serving the stored routing snapshot: {1}".format(name, e))
+            IOLoop.current().spawn_callback(self.__retry_setup, setup, name, recovered)
+            return False
+
+        return True
+
+    async def __retry_setup(self, setup, name, recovered):
+        delay = EnvironmentModel.SETUP_RETRY_MIN
+
+        while True:
+            await gen.sleep(delay)
+
+            try:
+                await setup()
+            except DatabaseError as e:
+                delay = min(delay * 2, EnvironmentModel.SETUP_RETRY_MAX)
+                logging.warning("Failed to set up {0}, retrying in {1}s: {2}".format(name, delay, e))
+                continue
+
+            logging.info("Set up {0}, the database is back".format(name))
+            break
+
+        if recovered is not None:
+            await recovered()
+
+    async def __snapshot_recovered(self):
+        if not self.snapshot_enabled:
+            return
+
+        try:
+            await self.reload_snapshot()
+        except EnvironmentDataError as e:
+            logging.warning("Failed to reload routing snapshot: " + e.message)
+
+    async def stopped(self):
+        if self.snapshot_refresh_callback:
+            self.snapshot_refresh_callback.stop()
+            self.snapshot_refresh_callback = None
+
+        await self.bus.stop()
+        await super(EnvironmentModel, self).stopped()
+
+    async def __on_bus_event(self, event):
+        kind = event.get("kind")
+
+        if kind == "versions":
+            await self.versions_changed(
+                application_id=event.get("application_id"),
+                version_id=event.get("version_id"),
+                environment_id=event.get("environment_id"),
+                version_name=event.get("version_name"),
+                publish=False)
+        elif kind == "applications":
+            await self.applications_changed(publish=False)
+        elif kind == "environments":
+            await self.environments_changed(environment_id=event.get("environment_id"), publish=False)
+        elif kind == "everything":
+            await self.everything_changed(publish=False)
+        elif kind == "scheme":
+            await self.scheme_changed(publish=False)
+
+    def __schedule_snapshot_refresh(self):
+        IOLoop.current().spawn_callback(self.__refresh_snapshot)
+
+    async def __refresh_snapshot(self):
+        try:
+            await self.reload_snapshot()
+        except EnvironmentDataError as e:
+            # keep serving the previous snapshot, nothing is known to have changed
+            logging.warning("Failed to refresh routing snapshot: " + e.message)
+
+    @timed("fetch_snapshot")
+    async def __fetch_snapshot_rows(self):
+        try:
+            async with transaction(self.db) as db:
+                # a single transaction gives all the reads the same consistent view
+                revision = await db.get(
+                    """
+                        SELECT `revision`
+                        FROM `revisions`;
+                    """)
+                applications = await db.query(
+                    """
+                        SELECT `application_id`, `application_name`, `application_revision`
+                        FROM `applications`;
+                    """)
+                versions = await db.query(
+                    """
+                        SELECT `application_id`, `version_name`, `version_environment`, `version_revision`
+                        FROM `application_versions`;
+                    """)
+                patterns = await db.query(
+                    """
+                        SELECT `application_id`, `pattern`, `pattern_environment`
+                        FROM `application_version_patterns`;
+                    """)
+                environments = await db.query(
+                    """
+                        SELECT `environment_id`, `environment_discovery`, `environment_data`, `environment_revision`
+                        FROM `environments`;
+                    """)
+                await db.commit()
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to load routing snapshot: " + e.args[1])
+
+        # plain dicts, so the rows could be stored as they are
+        return {
+            "revision": revision["revision"] if revision is not None else 0,
+            "applications": [dict(app) for app in applications],
+            "versions": [dict(version) for version in versions],
+            "patterns": [dict(pattern) for pattern in patterns],
+            "environments": [dict(env) for env in environments]
+        }
+
+    @staticmethod
+    def __build_snapshot(rows, previous=None):
+        """
+        Environments that have not changed since the previous snapshot are taken from it as they are,
+        so their rendered responses (and every variant of them) survive a reload.
+        """
+
+        environments = {}
+        previous_environments = previous.environments if previous is not None else {}
+
+        for env in rows["environments"]:
+            environment_id = env["environment_id"]
+            existing = previous_environments.get(environment_id)
+
+            if existing is not None and existing.revision == env.get("environment_revision", 0) and \
+                    existing.discovery == env["environment_discovery"] and existing.data == env["environment_data"]:
+                environments[environment_id] = existing
+            else:
+                environments[environment_id] = EnvironmentPlusVersionAdapter(env)
+
+        return RoutingSnapshot(
+            rows["applications"], rows["versions"], rows["patterns"], environments,
+            revision=rows.get("revision", 0))
+
+    def load_stored_snapshot(self):
+        """
+        Swaps in the snapshot kept by the snapshot store, if there is one. Meant to be called before the database
+        is connected to, so discovery could be answered right away (even if the database is down), until a
+        fresh snapshot is loaded.
+        """
+
+        if self.snapshot_store is None or not self.snapshot_enabled:
+            return False
+
+        rows = self.snapshot_store.load()
+
+        if rows is None:
+            return False
+
+        try:
+            snapshot = EnvironmentModel.__build_snapshot(rows)
+        except (KeyError, TypeError, AttributeError):
+            logging.warning("Stored routing snapshot is ignored: malformed")
+            return False
+
+        self.snapshot = snapshot
+        self.application_names = set(snapshot.applications)
+        self.revision_condition.notify_all()
+
+        logging.info("Loaded stored routing snapshot of {0} applications".format(len(snapshot.applications)))
+        return True
+
+    async def __store_snapshot(self, rows):
+        # only a single write at a time, the rows that come in meanwhile are stored once it is done,
+        # the latest ones only
+        self.snapshot_pending = rows
+
+        if self.snapshot_storing:
+            return
+
+        self.snapshot_storing = True
+
+        try:
+            while self.snapshot_pending is not None:
+                rows, self.snapshot_pending = self.snapshot_pending, None
+
+                try:
+                    await IOLoop.current().run_in_executor(None, self.snapshot_store.save, rows)
+                except (OSError, SnapshotStoreError) as e:
+                    logging.warning("Failed to store routing snapshot: {0}".format(e))
+        finally:
+            self.snapshot_storing = False
+
+    async def reload_snapshot(self):
+        """
+        Rebuilds the routing snapshot and swaps it in at once. Concurrent requests for a reload are coalesced:
+        a caller returns as soon as a reload that has started after its own request has completed.
+        """
+
+        self.snapshot_requested += 1
+        requested = self.snapshot_requested
+
+        async with self.snapshot_lock:
+            if self.snapshot_loaded >= requested:
+                return
+
+            loading = self.snapshot_requested
+            rows = await self.__fetch_snapshot_rows()
+            self.snapshot = EnvironmentModel.__build_snapshot(rows, self.snapshot)
+            self.snapshot_loaded = loading
+            self.application_names = set(self.snapshot.applications)
+
+        if self.snapshot_store is not None:
+            IOLoop.current().spawn_callback(self.__store_snapshot, rows)
+
+        self.revision_condition.notify_all()
+
+        for callback in self.snapshot_listeners:
+            callback(self.snapshot)
+
+    def add_snapshot_listener(self, callback):
+        """
+        Registers a callback(snapshot) to be called once a routing snapshot is loaded. The callback is not
+        awaited, anything heavy should be scheduled.
+        """
+        self.snapshot_listeners.append(callback)
+
+    def get_revision(self, app_name=None, app_version=None):
+        """
+        Returns the revision of the given application version as the routing snapshot has it (the revision of
+        everything if no application is given), or None if there is no snapshot loaded.
+        """
+
+        snapshot = self.snapshot
+
+        if snapshot is None:
+            return None
+
+        if app_name is None:
+            return snapshot.revision
+
+        return snapshot.revision_of(app_name, app_version)
+
+    async def wait_for_revision(self, revision, timeout, app_name=None, app_version=None):
+        """
+        Waits for the revision of the given application version (of everything if no application is given)
+        to differ from the one a watcher has, or for the timeout in seconds to pass, whichever comes first.
+        Nothing is polled: a waiter only wakes up when a new snapshot is swapped in.
+        Returns a tuple (the current revision, whether it has changed).
+        """
+
+        deadline = IOLoop.current().time() + timeout
+
+        while True:
+            current = self.get_revision(app_name, app_version)
+
+            if current is not None and current != revision:
+                return current, True
+
+            if not await self.revision_condition.wait(deadline):
+                return (revision if current is None else current), False
+
+    def select_endpoint(self, version, client_id=None):
+        """
+        Picks the discovery endpoint url of a resolved environment to point a client to, leaving out
+        the unhealthy ones. The same client_id gets the same endpoint for as long as it is healthy.
+        """
+        return select_endpoint(version.endpoints, client_id, self.unhealthy_endpoints).url
+
+    async def list_endpoints(self):
+        """
+        Returns the discovery endpoints of every environment, a list per environment. These are read off
+        the routing snapshot if there is one, without asking the database.
+        """
+
+        snapshot = self.snapshot
+
+        if snapshot is not None:
+            return [env.endpoints for env in snapshot.environments.values()]
+
+        return [env.endpoints for env in await self.list_environments()]
+
+    def register_metrics(self, registry):
+        """
+        Exposes the state of the caches, the circuit breaker and the snapshot. Nothing is tracked for that,
+        the values are read at the time of a scrape.
+        """
+
+        caches = {
+            "environments": self.environments_cache,
+            "versions": self.versions_cache,
+            "missing": self.missing_cache,
+            "patterns": self.patterns_cache,
+            "stale": self.stale_cache
+        }
+
+        registry.collected(
+            "environment_cache_hits_total", "Cache hits, per cache", ["cache"], "counter",
+            lambda: [((name, ), cache.hits) for name, cache in caches.items()])
+        registry.collected(
+            "environment_cache_misses_total", "Cache misses, per cache", ["cache"], "counter",
+            lambda: [((name, ), cache.misses) for name, cache in caches.items()])
+        registry.collected(
+            "environment_cache_evictions_total", "Cache evictions, per cache", ["cache"], "counter",
+            lambda: [((name, ), cache.evictions) for name, cache in caches.items()])
+        registry.collected(
+            "environment_cache_entries", "Cache entries, per cache", ["cache"], "gauge",
+            lambda: [((name, ), len(cache)) for name, cache in caches.items()])
+        registry.collected(
+            "environment_breaker_open", "Whether discovery is not asking the database", [], "gauge",
+            lambda: [((), int(self.breaker.state != CircuitBreaker.CLOSED))])
+        registry.collected(
+            "environment_snapshot_applications", "Applications in the routing snapshot (0 if there is none)",
+            [], "gauge",
+            lambda: [((), len(self.snapshot.applications) if self.snapshot is not None else 0)])
+        registry.collected(
+            "environment_endpoints_unhealthy", "Discovery endpoints the clients are not pointed to", [], "gauge",
+            lambda: [((), len(self.unhealthy_endpoints))])
+
+    async def applications_changed(self, publish=True):
+        """
+        Reloads the set of known application names, used to reject lookups of unknown applications
+        without a database round trip. Should be called by every write that creates or renames an application.
+        """
+
+        if publish:
+            await self.bus.publish({"kind": "applications"})
+
+        try:
+            applications = await self.db.query(
+                """
+                    SELECT `application_name`
+                    FROM `applications`;
+                """)
+        except DatabaseError as e:
+            # better to not filter anything than to reject an application that exists
+            self.application_names = None
+            logging.warning("Failed to load application names: " + e.args[1])
+        else:
+            self.application_names = {app["application_name"].lower() for app in applications}
+
     async def setup_table_environments(self):
         await self.create_environment("dev", "http://localhost:9502")
 
@@ -42,119 +628,710 @@ class EnvironmentModel(Model):
         await self.set_scheme({"type": "object", "properties": {"test-option": {"type": "string"}}})
 
     def get_setup_tables(self):
-        return ["environments", "scheme"]
+        return ["revisions", "environments", "scheme"]
+
+    @staticmethod
+    async def next_revision(db):
+        """
+        Returns a new revision for a write to stamp the rows it changes with. Should be called within the
+        transaction of the write: the counter stays locked until it is committed, so the writes are committed
+        in the order of their revisions, and a snapshot never sees a revision without the writes before it.
+        """
+
+        return await db.insert(
+            """
+                INSERT INTO `revisions`
+                (`key`, `revision`)
+                VALUES (1, LAST_INSERT_ID(1))
+                ON DUPLICATE KEY
+                UPDATE `revision`=LAST_INSERT_ID(`revision` + 1);
+            """)
 
     async def create_environment(self, environment_name, environment_discovery):
+        parse_endpoints(environment_discovery)
 
         try:
-            record_id = await self.db.insert(
-                """
-                    INSERT INTO `environments`
-                    (`environment_name`, `environment_discovery`, `environment_data`)
-                    VALUES (%s, %s, %s);
-                """,
-                environment_name, environment_discovery, "{}"
-            )
+            async with transaction(self.db) as db:
+                revision = await EnvironmentModel.next_revision(db)
+                record_id = await db.insert(
+                    """
+                        INSERT INTO `environments`
+                        (`environment_name`, `environment_discovery`, `environment_data`, `environment_revision`)
+                        VALUES (%s, %s, %s, %s);
+                    """,
+                    environment_name, environment_discovery, "{}", revision
+                )
+                await db.commit()
         except DuplicateError:
             raise EnvironmentExists()
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to create environment: " + e.args[1])
 
+        await self.environments_changed()
         return record_id
 
     async def delete_environment(self, environment_id):
 
         try:
-            deleted = await self.db.execute(
-                """
-                    DELETE FROM `environments`
-                    WHERE `environment_id`=%s;
-                """, environment_id)
+            async with transaction(self.db) as db:
+                revision = await EnvironmentModel.next_revision(db)
+                # the versions and patterns pointing to it go away along, so do their applications change
+                await db.execute(
+                    """
+                        UPDATE `applications`
+                        SET `application_revision`=%s
+                        WHERE `application_id` IN (
+                            SELECT `application_id`
+                            FROM `application_versions`
+                            WHERE `version_environment`=%s
+                        ) OR `application_id` IN (
+                            SELECT `application_id`
+                            FROM `application_version_patterns`
+                            WHERE `pattern_environment`=%s
+                        );
+                    """, revision, environment_id, environment_id)
+                deleted = await db.execute(
+                    """
+                        DELETE FROM `environments`
+                        WHERE `environment_id`=%s;
+                    """, environment_id)
+                await db.commit()
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to delete environment: " + e.args[1])
-        else:
-            return bool(deleted)
+
+        await self.environments_changed(environment_id=environment_id)
+        return bool(deleted)
+
+    async def environments_changed(self, environment_id=None, publish=True):
+        """
+        Drops cached environments, and everything resolved from the given one.
+        Should be called by every write to the environments.
+        """
+
+        self.environments_generation += 1
+        self.environments_cache.clear()
+
+        if environment_id is not None:
+            await self.versions_changed(environment_id=environment_id, publish=False)
+
+        if publish:
+            await self.bus.publish({"kind": "environments", "environment_id": environment_id})
 
     async def find_environment(self, environment_name):
+        key = ("name", environment_name)
+        cached = self.environments_cache.get(key)
+
+        if cached is not None:
+            return cached
+
+        generation = self.environments_generation
+
         try:
             env = await self.db.get(
                 """
                     SELECT `environment_id`
                     FROM `environments`
                     WHERE environment_name=%s;
-                """, environment_name, cache_time=60)
+                """, environment_name)
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to find environment: " + e.args[1])
 
         if env is None:
             raise EnvironmentNotFound()
 
-        return EnvironmentAdapter(env)
+        env = EnvironmentAdapter(env)
+
+        if generation == self.environments_generation:
+            self.environments_cache.put(key, env)
+
+        return env
 
     async def get_environment(self, environment_id):
+        key = ("id", str(environment_id))
+        cached = self.environments_cache.get(key)
+
+        if cached is not None:
+            return cached
+
+        generation = self.environments_generation
+
         try:
             env = await self.db.get(
                 """
                     SELECT *
                     FROM `environments`
                     WHERE `environment_id`=%s;
-                """, environment_id, cache_time=60)
+                """, environment_id)
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to get environment: " + e.args[1])
 
         if env is None:
             raise EnvironmentNotFound()
 
-        return EnvironmentAdapter(env)
+        env = EnvironmentAdapter(env)
+
+        if generation == self.environments_generation:
+            self.environments_cache.put(key, env)
+
+        return env
 
     async def list_environments(self):
+        key = ("list", )
+        cached = self.environments_cache.get(key)
+
+        if cached is not None:
+            return list(cached)
+
+        generation = self.environments_generation
+
         try:
             environments = await self.db.query(
                 """
                     SELECT *
                     FROM `environments`;
-                """, cache_time=60
-            )
+                """)
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to list environments: " + e.args[1])
 
-        return list(map(EnvironmentAdapter, environments))
+        environments = list(map(EnvironmentAdapter, environments))
+
+        if generation == self.environments_generation:
+            self.environments_cache.put(key, environments)
+
+        return list(environments)
 
     async def get_scheme(self, exception=False):
-        try:
-            env = await self.db.get(
-                """
-                    SELECT `data` FROM `scheme`;
-                """)
-        except DatabaseError as e:
-            raise EnvironmentDataError("Failed to get scheme: " + e.args[1])
+        scheme = self.scheme
 
-        if env is None:
+        if scheme is None:
+            generation = self.scheme_generation
+
+            try:
+                env = await self.db.get(
+                    """
+                        SELECT `data` FROM `scheme`;
+                    """)
+            except DatabaseError as e:
+                raise EnvironmentDataError("Failed to get scheme: " + e.args[1])
+
+            scheme = EnvironmentModel.MISSING if env is None else env["data"]
+
+            if generation == self.scheme_generation:
+                self.scheme = scheme
+
+        if scheme is EnvironmentModel.MISSING:
             if exception:
                 raise SchemeNotExists()
 
             return {}
 
-        return env["data"]
+        return scheme
+
+    async def get_scheme_validator(self):
+        """
+        Returns the compiled validator of the current scheme, it is only compiled again once the scheme changes.
+        """
+
+        validator = self.scheme_validator
+
+        if validator is None:
+            generation = self.scheme_generation
+            validator = compile_scheme(await self.get_scheme())
+
+            if generation == self.scheme_generation:
+                self.scheme_validator = validator
+
+        return validator
+
+    async def validate_environment_data(self, env_data):
+        """
+        Raises EnvironmentInvalid if the environment variables do not fit in the scheme.
+        """
+
+        try:
+            validator = await self.get_scheme_validator()
+        except SchemeInvalid as e:
+            # a broken scheme cannot be held against the environments
+            logging.warning(e.message)
+            return
+
+        error = validation_error(validator, env_data)
+
+        if error is not None:
+            raise EnvironmentInvalid(error)
+
+    async def scheme_changed(self, publish=True):
+        """
+        Drops the cached scheme and its validator, and re-validates every environment against the new one
+        in background. The ones that do not fit in anymore end up in invalid_environments.
+        """
+
+        self.scheme_generation += 1
+        self.scheme = None
+        self.scheme_validator = None
+
+        if publish:
+            await self.bus.publish({"kind": "scheme"})
+
+        IOLoop.current().spawn_callback(self.__revalidate_environments)
+
+    async def __revalidate_environments(self):
+        generation = self.scheme_generation
+
+        try:
+            validator = await self.get_scheme_validator()
+            environments = await self.list_environments()
+        except (EnvironmentDataError, SchemeInvalid) as e:
+            logging.warning("Failed to re-validate environments: " + e.message)
+            return
+
+        invalid = {}
+
+        for env in environments:
+            error = validation_error(validator, env.data)
+
+            if error is not None:
+                invalid[str(env.environment_id)] = (env.name, error)
+
+        if generation != self.scheme_generation:
+            return
+
+        self.invalid_environments = invalid
+
+        for name, error in invalid.values():
+            logging.warning("Environment {0} does not fit in the scheme: {1}".format(name, error))
+
+    async def versions_changed(self, application_id=None, version_id=None, environment_id=None, version_name=None,
+                               publish=True):
+        """
+        Drops cached version environments that match any of the given identifiers, and rebuilds the
+        routing snapshot. Should be called by every write that may change the result of get_version_environment.
+        A version_name should be passed when a version gets that name, so the lookups for it are no longer
+        considered missing.
+        """
+
+        if publish:
+            await self.bus.publish({
+                "kind": "versions",
+                "application_id": application_id,
+                "version_id": version_id,
+                "environment_id": environment_id,
+                "version_name": version_name
+            })
+
+        self.versions_generation += 1
+
+        if application_id is not None or environment_id is not None:
+            self.patterns_cache.clear()
+
+        if application_id is not None:
+            self.missing_cache.clear()
+        elif version_name is not None:
+            self.missing_cache.remove_if(lambda key, missing: key[1] == version_name)
+
+        def affected(key, version):
+            # a version that has been matched with a pattern, may have an exact mapping from now on
+            return (version_name is not None and key[1] == version_name) or \
+                   (application_id is not None and str(version.application_id) == str(application_id)) or \
+                   (version_id is not None and str(version.version_id) == str(version_id)) or \
+                   (environment_id is not None and str(version.environment_id) == str(environment_id))
+
+        self.versions_cache.remove_if(affected)
+
+        await self.__snapshot_changed()
+
+    async def everything_changed(self, publish=True):
+        """
+        Drops every cache, and rebuilds the routing snapshot. Should be called after bulk changes
+        that are too many to be invalidated one by one.
+        """
+
+        if publish:
+            await self.bus.publish({"kind": "everything"})
+
+        self.environments_generation += 1
+        self.environments_cache.clear()
+
+        self.versions_generation += 1
+        self.versions_cache.clear()
+        self.missing_cache.clear()
+        self.patterns_cache.clear()
+
+        await self.scheme_changed(publish=False)
+        await self.applications_changed(publish=False)
+        await self.__snapshot_changed()
+
+    async def __snapshot_changed(self):
+        if not self.snapshot_enabled:
+            return
+
+        try:
+            await self.reload_snapshot()
+        except EnvironmentDataError as e:
+            # the snapshot is known to be stale now, so resolve from the database until the next refresh
+            self.snapshot = None
+            logging.warning("Failed to rebuild routing snapshot after a change: " + e.message)
+
+    def __resolve_from_memory(self, app_name, app_version):
+        """
+        Returns the resolved environment, MISSING if the version is known to not exist,
+        or None if the database has to be asked.
+        """
+
+        snapshot = self.snapshot
+
+        if snapshot is not None:
+            return snapshot.resolve(app_name, app_version) or EnvironmentModel.MISSING
+
+        if len(app_name) > EnvironmentModel.MAX_NAME_LENGTH or len(app_version) > EnvironmentModel.MAX_NAME_LENGTH:
+            return EnvironmentModel.MISSING
+
+        application_names = self.application_names
+
+        if application_names is not None and app_name.lower() not in application_names:
+            return EnvironmentModel.MISSING
+
+        key = (app_name, app_version)
+        cached = self.versions_cache.get(key)
+
+        if cached is not None:
+            return cached
+
+        if self.missing_cache.get(key):
+            return EnvironmentModel.MISSING
+
+        return None
+
+    async def __get_version_matcher(self, app_name):
+        matcher = self.patterns_cache.get(app_name)
+
+        if matcher is not None:
+            return matcher
+
+        generation = self.versions_generation
+
+        try:
+            patterns = await self.db.query(
+                """
+                    SELECT `applications`.`application_id`, `pattern`,
+                        `environments`.`environment_id`, `environment_discovery`, `environment_data`
+                    FROM `applications`, `application_version_patterns`, `environments`
+                    WHERE `application_version_patterns`.`application_id`=`applications`.`application_id`
+                        AND `applications`.`application_name`=%s
+                        AND `environment_id`=`application_version_patterns`.`pattern_environment`;
+                """, app_name)
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to get version patterns: " + e.args[1])
+
+        matcher = VersionMatcher([
+            (pattern["pattern"], EnvironmentPlusVersionAdapter(pattern))
+            for pattern in patterns
+        ])
+
+        if generation == self.versions_generation:
+            self.patterns_cache.put(app_name, matcher)
+
+        return matcher
+
+    async def get_versions_environment(self, versions):
+        """
+        Resolves a list of (app_name, app_version) pairs with a single pass over the memory,
+        and a single database query for the rest.
+        Returns a dict (app_name, app_version) -> resolved environment, the pairs that were not found are omitted,
+        the ones that could not be resolved are mapped to UNAVAILABLE.
+        """
+
+        result = {}
+        query = []
+
+        for app_name, app_version in versions:
+            key = (app_name, app_version)
+            version = self.__resolve_from_memory(app_name, app_version)
+
+            if version is None:
+                query.append(key)
+            elif version is not EnvironmentModel.MISSING:
+                result[key] = version
+
+        if not query:
+            return result
+
+        query = list(dict.fromkeys(query))
+
+        # the versions some other lookup is already resolving are not asked for again
+        waiting = {key: self.inflight[key] for key in query if key in self.inflight}
+        query = [key for key in query if key not in waiting]
+
+        if query:
+            futures = {key: Future() for key in query}
+            generation = self.versions_generation
+            self.inflight.update((key, (future, generation)) for key, future in futures.items())
+
+            try:
+                found = await self.__load_versions_environment(query)
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                    # nobody might be waiting for it, that is fine
+                    future.exception()
+                raise
+            else:
+                for key, future in futures.items():
+                    future.set_result(found[key])
+            finally:
+                for key, future in futures.items():
+                    self.inflight.pop(key, None)
+
+                    if not future.done():
+                        future.cancel()
+
+            for key, version in found.items():
+                if version is not EnvironmentModel.MISSING:
+                    result[key] = version
+
+        outdated = []
+
+        for key, (future, generation) in waiting.items():
+            version = await future
+
+            if generation != self.versions_generation:
+                # something has changed since that lookup has started, its outcome might predate the change
+                outdated.append(key)
+            elif version is not EnvironmentModel.MISSING:
+                result[key] = version
+
+        if outdated:
+            result.update(await self.get_versions_environment(outdated))
+
+        return result
+
+    async def __load_versions_environment(self, query):
+        """
+        Resolves (app_name, app_version) pairs that are not in the memory, returns a dict of each of them
+        to the environment, MISSING, or UNAVAILABLE.
+        """
+
+        if not self.breaker.allow():
+            return {key: self.__resolve_stale(key) for key in query}
+
+        generation = self.versions_generation
+        started = time.monotonic()
+
+        try:
+            found = await self.__guard(self.__query_versions_environment(query))
+        except EnvironmentDataError as e:
+            self.breaker.failure()
+            logging.warning("Failed to resolve versions, falling back to the last known ones: " + e.message)
+            return {key: self.__resolve_stale(key) for key in query}
+
+        self.breaker.success(time.monotonic() - started)
+
+        result = {}
+
+        for key in query:
+            version = found.get(key)
+            result[key] = EnvironmentModel.MISSING if version is None else version
+            self.stale_cache.put(key, result[key])
+
+        if generation == self.versions_generation:
+            for key in query:
+                version = found.get(key)
+
+                if version is None:
+                    self.missing_cache.put(key, True)
+                else:
+                    self.versions_cache.put(key, version)
+
+        return result
+
+    @timed("get_versions_environment")
+    async def __query_versions_environment(self, query):
+        """
+        Resolves (app_name, app_version) pairs with the database, returns a dict of the ones found.
+        """
+
+        # the defaults of the applications are fetched along, so a miss would not cost another query
+        defaults = [(app_name, DEFAULT) for app_name in dict.fromkeys(app_name for app_name, app_version in query)]
+
+        try:
+            found = await self.db.query(
+                """
+                    SELECT `applications`.`application_id`, `application_versions`.`version_id`,
+                        `environments`.`environment_id`, `environment_discovery`, `environment_data`,
+                        `application_name`, `version_name`
+                    FROM `applications`, `application_versions`, `environments`
+                    WHERE `application_versions`.`application_id`=`applications`.`application_id`
+                        AND `environment_id`=`application_versions`.`version_environment`
+                        AND ({0});
+                """.format(" OR ".join([
+                    "(`applications`.`application_name`=%s AND `application_versions`.`version_name`=%s)"
+                ] * (len(query) + len(defaults)))), *[value for key in query + defaults for value in key])
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to get versions environment: " + e.args[1])
+
+        # the names are compared case-insensitively by the database, so the rows are matched back the same way
+        found = {
+            (version["application_name"].lower(), version["version_name"].lower()):
+                EnvironmentPlusVersionAdapter(version)
+            for version in found
+        }
+
+        result = {}
+
+        for app_name, app_version in query:
+            key = (app_name, app_version)
+            version = found.get((app_name.lower(), app_version.lower()))
+
+            if version is None:
+                matcher = await self.__get_version_matcher(app_name)
+                version = matcher.match(app_version) or found.get((app_name.lower(), DEFAULT))
+
+            if version is not None:
+                result[key] = version
+
+        return result
+
+    async def __guard(self, query):
+        """
+        Awaits a query the breaker guards, abandoning it (as a failed one) once it takes far longer than
+        the breaker tolerates.
+        """
+
+        if not self.breaker.latency:
+            return await query
+
+        timeout = timedelta(seconds=self.breaker.latency * EnvironmentModel.QUERY_TIMEOUT_FACTOR)
+
+        try:
+            return await gen.with_timeout(timeout, query, quiet_exceptions=(EnvironmentDataError,))
+        except gen.TimeoutError:
+            raise EnvironmentDataError("Database has not answered in {0}s".format(timeout.total_seconds()))
+
+    def __resolve_stale(self, key):
+        """
+        Returns the last known environment of a version (or MISSING), for when the database cannot be asked,
+        or UNAVAILABLE if nothing is known about it.
+        """
+
+        version = self.stale_cache.get(key)
+
+        if version is not None:
+            return version
+
+        return EnvironmentModel.UNAVAILABLE
 
     async def get_version_environment(self, app_name, app_version):
 
+        version = self.__resolve_from_memory(app_name, app_version)
+
+        if version is EnvironmentModel.MISSING:
+            raise EnvironmentNotFound()
+
+        if version is not None:
+            return version
+
+        key = (app_name, app_version)
+        flight = self.inflight.get(key)
+
+        if flight is not None:
+            # the very same version is being resolved right now, its outcome is shared
+            future, generation = flight
+            version = await future
+
+            if generation != self.versions_generation:
+                # unless something has changed since that lookup has started, its outcome might predate the change
+                return await self.get_version_environment(app_name, app_version)
+        else:
+            future = Future()
+            self.inflight[key] = (future, self.versions_generation)
+
+            try:
+                version = await self.__load_version_environment(key)
+            except Exception as e:
+                future.set_exception(e)
+                # nobody might be waiting for it, that is fine
+                future.exception()
+                raise
+            else:
+                future.set_result(version)
+            finally:
+                self.inflight.pop(key, None)
+
+                if not future.done():
+                    future.cancel()
+
+        if version is EnvironmentModel.MISSING:
+            raise EnvironmentNotFound()
+
+        if version is EnvironmentModel.UNAVAILABLE:
+            raise EnvironmentUnavailable(
+                "Database is unavailable, and version {0} of the app {1} is not known".format(app_version, app_name))
+
+        return version
+
+    async def __load_version_environment(self, key):
+        """
+        Resolves a version that is not in the memory, returns the environment, MISSING, or UNAVAILABLE.
+        """
+
+        if not self.breaker.allow():
+            return self.__resolve_stale(key)
+
+        generation = self.versions_generation
+        started = time.monotonic()
+
+        try:
+            version = await self.__guard(self.__query_version_environment(*key))
+        except EnvironmentDataError as e:
+            self.breaker.failure()
+            logging.warning("Failed to resolve a version, falling back to the last known one: " + e.message)
+            return self.__resolve_stale(key)
+
+        self.breaker.success(time.monotonic() - started)
+        self.stale_cache.put(key, EnvironmentModel.MISSING if version is None else version)
+
+        if generation == self.versions_generation:
+            if version is None:
+                self.missing_cache.put(key, True)
+            else:
+                self.versions_cache.put(key, version)
+
+        return EnvironmentModel.MISSING if version is None else version
+
+    @timed("get_version_environment")
+    async def __query_version_environment(self, app_name, app_version):
+        """
+        Resolves a version with the database, returns None if there is no such version.
+        """
+
         try:
-            version = await self.db.get(
+            # the default of the application is fetched along, so a miss would not cost another query
+            versions = await self.db.query(
                 """
-                    SELECT `environment_discovery`, `environment_data`
+                    SELECT `applications`.`application_id`, `application_versions`.`version_id`,
+                        `environments`.`environment_id`, `environment_discovery`, `environment_data`,
+                        `version_name`
                     FROM `applications`, `application_versions`, `environments`
                     WHERE `application_versions`.`application_id`=`applications`.`application_id`
-                        AND `applications`.`application_name`=%s AND `application_versions`.`version_name`=%s
+                        AND `applications`.`application_name`=%s AND `application_versions`.`version_name` IN (%s, %s)
                         AND `environment_id`=`application_versions`.`version_environment`;
-                """, app_name, app_version)
+                """, app_name, app_version, DEFAULT)
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to get version environment: " + e.args[1])
 
+        # the names are compared case-insensitively by the database, so the rows are matched back the same way
+        versions = {
+            version["version_name"].lower(): EnvironmentPlusVersionAdapter(version)
+            for version in versions
+        }
+
+        version = versions.get(app_version.lower())
+
         if version is None:
-            raise EnvironmentNotFound()
+            matcher = await self.__get_version_matcher(app_name)
+            version = matcher.match(app_version) or versions.get(DEFAULT)
 
-        return EnvironmentPlusVersionAdapter(version)
+        return version
 
     @validate(data="json_dict")
     async def set_scheme(self, data):
@@ -162,6 +1339,8 @@ class EnvironmentModel(Model):
         if not isinstance(data, dict):
             raise AttributeError("data is not a dict")
 
+        compile_scheme(data)
+
         try:
             updated = await self.db.execute(
                 """
@@ -174,22 +1353,32 @@ class EnvironmentModel(Model):
             )
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to insert scheme: " + e.args[1])
-        else:
-            return bool(updated)
+
+        await self.scheme_changed()
+        return bool(updated)
 
     async def update_environment(self, record_id, env_name, env_discovery, env_data):
         if not isinstance(env_data, dict):
             raise AttributeError("env_data is not a dict")
 
+        await self.validate_environment_data(env_data)
+        parse_endpoints(env_discovery)
+
         try:
-            updated = await self.db.execute("""
-                UPDATE `environments`
-                SET `environment_name`=%s, `environment_discovery`=%s, `environment_data`=%s
-                WHERE `environment_id`=%s;
-            """, env_name, env_discovery, ujson.dumps(env_data), record_id)
+            async with transaction(self.db) as db:
+                revision = await EnvironmentModel.next_revision(db)
+                updated = await db.execute("""
+                    UPDATE `environments`
+                    SET `environment_name`=%s, `environment_discovery`=%s, `environment_data`=%s,
+                        `environment_revision`=%s
+                    WHERE `environment_id`=%s;
+                """, env_name, env_discovery, ujson.dumps(env_data), revision, record_id)
+                await db.commit()
         except DatabaseError as e:
             raise EnvironmentDataError("Failed to update environment: " + e.args[1])
 
+        await self.environments_changed(environment_id=record_id)
+        self.invalid_environments.pop(str(record_id), None)
         return bool(updated)
 
 
@@ -197,9 +1386,29 @@ class EnvironmentNotFound(Exception):
     pass
 
 
+class EnvironmentUnavailable(EnvironmentDataError):
+    pass
+
+
 class EnvironmentExists(Exception):
     pass
 
 
 class SchemeNotExists(Exception):
     pass
+
+
+class EnvironmentInvalid(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class SchemeInvalid(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
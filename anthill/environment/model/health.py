@@ -0,0 +1,125 @@
+from anthill.common.model import Model
+
+from tornado.gen import multi
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . environment import EnvironmentDataError
+
+import logging
+import time
+
+
+class EndpointHealthChecker(Model):
+    """
+    Probes the discovery endpoints of every environment that lists more than one, and keeps
+    EnvironmentModel.unhealthy_endpoints up to date, so discovery would stop pointing the clients to them.
+
+    An endpoint is unhealthy once 'failures' probes in a row have failed: not connected to, answered
+    with a server error, or answered slower than 'max_latency' seconds. A single successful probe brings it back.
+    The environments with a single endpoint are never probed, there is nothing else to point the clients to.
+    """
+
+    DEFAULT_INTERVAL = 10
+    DEFAULT_TIMEOUT = 5
+    DEFAULT_MAX_LATENCY = 1.0
+    DEFAULT_FAILURES = 3
+
+    def __init__(self, environment, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT,
+                 max_latency=DEFAULT_MAX_LATENCY, failures=DEFAULT_FAILURES, path=""):
+        """
+        :param interval: seconds between the rounds of probes
+        :param timeout: seconds a probe is given before it is counted as failed
+        :param max_latency: seconds a probe could take before it is counted as failed, 0 for no limit
+        :param failures: probes in a row to fail before an endpoint is left out
+        :param path: what to request from an endpoint url, appended to it as it is
+        """
+
+        self.environment = environment
+        self.interval = interval
+        self.timeout = timeout
+        self.max_latency = max_latency
+        self.failures = failures
+        self.path = path
+
+        # url -> probes failed in a row, for every url probed in the last round
+        self.failed = {}
+        self.checking = False
+        self.check_callback = None
+
+    async def started(self, application):
+        await super(EndpointHealthChecker, self).started(application)
+
+        if self.interval > 0:
+            self.check_callback = PeriodicCallback(self.__schedule_check, self.interval * 1000)
+            self.check_callback.start()
+
+    async def stopped(self):
+        if self.check_callback:
+            self.check_callback.stop()
+            self.check_callback = None
+
+        await super(EndpointHealthChecker, self).stopped()
+
+    def __schedule_check(self):
+        # a round that takes longer than the interval is not piled up on
+        if not self.checking:
+            IOLoop.current().spawn_callback(self.check)
+
+    async def check(self):
+        """
+        Probes every endpoint once, and updates the set of the unhealthy ones.
+        """
+
+        self.checking = True
+
+        try:
+            try:
+                environments = await self.environment.list_endpoints()
+            except EnvironmentDataError as e:
+                logging.warning("Failed to list environments to check the endpoints of: " + e.message)
+                return
+
+            urls = sorted({
+                endpoint.url
+                for endpoints in environments if len(endpoints) > 1
+                for endpoint in endpoints
+            })
+
+            results = await multi([self.__probe(url) for url in urls])
+
+            # the urls no longer listed are forgotten
+            self.failed = {
+                url: 0 if healthy else self.failed.get(url, 0) + 1
+                for url, healthy in zip(urls, results)
+            }
+
+            unhealthy = frozenset(url for url, failed in self.failed.items() if failed >= self.failures)
+
+            for url in unhealthy - self.environment.unhealthy_endpoints:
+                logging.warning("Discovery endpoint {0} is unhealthy, clients are pointed elsewhere".format(url))
+
+            for url in self.environment.unhealthy_endpoints - unhealthy:
+                logging.info("Discovery endpoint {0} is healthy again".format(url))
+
+            self.environment.unhealthy_endpoints = unhealthy
+        finally:
+            self.checking = False
+
+    async def __probe(self, url):
+        """
+        Returns True if the endpoint has answered in time and without a server error.
+        """
+
+        started = time.monotonic()
+
+        try:
+            response = await AsyncHTTPClient().fetch(
+                url + self.path, request_timeout=self.timeout, raise_error=False)
+        except (HTTPClientError, OSError, ValueError):
+            return False
+
+        if response.code >= 500:
+            return False
+
+        return not self.max_latency or time.monotonic() - started <= self.max_latency
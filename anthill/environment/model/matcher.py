@@ -0,0 +1,157 @@
+from bisect import bisect_right
+
+import re
+
+
+class VersionPatternError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+# bounds are compared against (version, 0) keys, see VersionMatcher.match
+UNBOUNDED_LOW = ((), 0)
+UNBOUNDED_HIGH = ((float("inf"), ), 0)
+
+# ascii digits only: \d and str.isdigit() take the other scripts' digits (and '²') as well, which int() does not
+NUMERIC_VERSION = re.compile(r"[0-9]+(?:\.[0-9]+)*")
+RANGE_TOKEN = re.compile(r"(>=|<=|>|<|=)?([0-9]+(?:\.[0-9]+)*)")
+
+
+def parse_version(version_name):
+    """
+    Turns a numeric version like '1.4.2' into a tuple (1, 4, 2), so versions could be compared.
+    Trailing zeroes are dropped, so '2', '2.0' and '2.0.0' are the same version.
+    Returns None for anything that is not a dot-separated list of numbers.
+    """
+
+    if NUMERIC_VERSION.fullmatch(version_name) is None:
+        return None
+
+    version = [int(part) for part in version_name.split(".")]
+
+    while version and version[-1] == 0:
+        version.pop()
+
+    return tuple(version)
+
+
+def parse_pattern(pattern):
+    """
+    Turns a version pattern into a (low, high) pair of keys, so a version matches if low <= (version, 0) < high.
+    Two forms are supported:
+        1.4.*            every version starting with 1.4 (and 1.4 itself)
+        >=2.0 <2.3       a range made of >, >=, <, <= and = constraints, all of which should hold
+    """
+
+    pattern = pattern.strip()
+
+    if not pattern:
+        raise VersionPatternError("Pattern is empty")
+
+    if pattern == "*":
+        return UNBOUNDED_LOW, UNBOUNDED_HIGH
+
+    if pattern.endswith(".*"):
+        prefix = parse_version(pattern[:-2])
+
+        if prefix is None:
+            raise VersionPatternError("Bad wildcard pattern: {0}".format(pattern))
+
+        # the same normalized version is used for the both bounds, '1.0.*' is [1, 1.1)
+        parts = pattern[:-2].split(".")
+        upper = [int(part) for part in parts]
+        upper[-1] += 1
+
+        return (prefix, 0), (parse_version(".".join(map(str, upper))), 0)
+
+    low, high = UNBOUNDED_LOW, UNBOUNDED_HIGH
+
+    for token in pattern.replace(",", " ").split():
+        match = RANGE_TOKEN.fullmatch(token)
+
+        if match is None:
+            raise VersionPatternError("Bad range constraint: {0}".format(token))
+
+        operator, version = match.group(1) or "=", parse_version(match.group(2))
+
+        if operator in (">=", "="):
+            low = max(low, (version, 0))
+        if operator == ">":
+            low = max(low, (version, 1))
+        if operator in ("<=", "="):
+            high = min(high, (version, 1))
+        if operator == "<":
+            high = min(high, (version, 0))
+
+    if low >= high:
+        raise VersionPatternError("Pattern {0} matches no versions".format(pattern))
+
+    return low, high
+
+
+class VersionMatcher(object):
+    """
+    A precompiled index of non-overlapping version patterns of an application, kept as a sorted list of intervals.
+    Finding the pattern a version belongs to is a single binary search.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: a list of (pattern, value) pairs; a pattern that overlaps with an earlier one
+                      is left out and reported in self.conflicts as a (pattern, other pattern) pair,
+                      a pattern that cannot be parsed is left out and reported in self.errors
+        """
+
+        intervals = []
+
+        self.conflicts = []
+        self.errors = []
+
+        for pattern, value in rules:
+            try:
+                low, high = parse_pattern(pattern)
+            except VersionPatternError as e:
+                self.errors.append(e.message)
+            else:
+                intervals.append((low, high, pattern, value))
+
+        intervals.sort(key=lambda interval: interval[0])
+
+        self.lows = []
+        self.highs = []
+        self.patterns = []
+        self.values = []
+
+        for low, high, pattern, value in intervals:
+            if self.highs and low < self.highs[-1]:
+                self.conflicts.append((pattern, self.patterns[-1]))
+                continue
+
+            self.lows.append(low)
+            self.highs.append(high)
+            self.patterns.append(pattern)
+            self.values.append(value)
+
+    def match(self, version_name):
+        """
+        Returns the value of the pattern the version matches, or None.
+        """
+
+        if not self.values:
+            return None
+
+        version = parse_version(version_name)
+
+        if version is None:
+            return None
+
+        key = (version, 0)
+        index = bisect_right(self.lows, key) - 1
+
+        if index < 0 or key >= self.highs[index]:
+            return None
+
+        return self.values[index]
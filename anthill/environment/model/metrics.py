@@ -0,0 +1,215 @@
+from bisect import bisect_left
+from functools import wraps
+
+import time
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    labels = ",".join('{0}="{1}"'.format(name, escape(value)) for name, value in zip(names, values))
+
+    if extra:
+        labels = labels + "," + extra if labels else extra
+
+    return "{" + labels + "}" if labels else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild(object):
+    __slots__ = ("value", )
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class HistogramChild(object):
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # the last one is +Inf
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(object):
+    """
+    A metric with a child per combination of label values. A child is created once, on the first use,
+    so a caller that keeps the child around does nothing but arithmetics on the hot path.
+    Each kind of metric defines new_child() and samples(values, child).
+    """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+
+        if child is None:
+            child = self.new_child()
+            self.children[values] = child
+
+        return child
+
+    def render(self):
+        lines = [
+            "# HELP {0} {1}".format(self.name, escape(self.documentation)),
+            "# TYPE {0} {1}".format(self.name, self.TYPE)
+        ]
+
+        for values, child in list(self.children.items()):
+            lines.extend(self.samples(values, child))
+
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def samples(self, values, child):
+        return ["{0}{1} {2}".format(self.name, format_labels(self.labelnames, values), format_value(child.value))]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = list(buckets)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self, values, child):
+        lines = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + [float("inf")], child.counts):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                self.name,
+                format_labels(self.labelnames, values, 'le="{0}"'.format(format_value(bound))),
+                cumulative))
+
+        labels = format_labels(self.labelnames, values)
+        lines.append("{0}_sum{1} {2}".format(self.name, labels, format_value(child.sum)))
+        lines.append("{0}_count{1} {2}".format(self.name, labels, child.count))
+        return lines
+
+
+class Collected(Metric):
+    """
+    A metric which values are not tracked, but collected with a callback at the time of a scrape,
+    the callback returns a list of (label values, value).
+    """
+
+    def __init__(self, name, documentation, labelnames, metric_type, callback):
+        super(Collected, self).__init__(name, documentation, labelnames)
+        self.TYPE = metric_type
+        self.callback = callback
+
+    def render(self):
+        lines = [
+            "# HELP {0} {1}".format(self.name, escape(self.documentation)),
+            "# TYPE {0} {1}".format(self.name, self.TYPE)
+        ]
+
+        for values, value in self.callback():
+            lines.append("{0}{1} {2}".format(self.name, format_labels(self.labelnames, values), format_value(value)))
+
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    A set of metrics rendered together in the prometheus text exposition format.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collected(self, name, documentation, labelnames, metric_type, callback):
+        return self.register(Collected(name, documentation, labelnames, metric_type, callback))
+
+    def render(self):
+        lines = []
+
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+# the metrics of the process, the same way there is only one process to scrape
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    "environment_request_duration_seconds", "Time spent on the requests, per route", ["route"])
+DISCOVER_RESPONSES = registry.counter(
+    "environment_discover_responses_total", "Discovery responses, per application and status code",
+    ["app", "code"])
+DB_QUERY_DURATION = registry.histogram(
+    "environment_db_query_duration_seconds", "Time spent on the database queries, per model method", ["method"])
+
+
+def timed(method):
+    """
+    Measures every call of the decorated coroutine into DB_QUERY_DURATION, as the given method.
+    Meant for the methods that do nothing but a database query.
+    """
+
+    def decorator(func):
+        child = DB_QUERY_DURATION.labels(method)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.monotonic() - started)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,132 @@
+from anthill.common.database import DatabaseError
+
+import logging
+
+
+# (table, column, definition) of every column added since the table was first released; the setup only creates
+# the tables that are missing, so the ones created by an earlier version get these added here
+COLUMNS = [
+    ("environments", "environment_revision", "bigint(20) NOT NULL DEFAULT '0'"),
+    ("applications", "application_revision", "bigint(20) NOT NULL DEFAULT '0'"),
+    ("application_versions", "version_revision", "bigint(20) NOT NULL DEFAULT '0'"),
+]
+
+# (table, column, length, definition) of every text column made longer since, same as above
+WIDENED = [
+    ("environments", "environment_discovery", 1024, "varchar(1024) NOT NULL"),
+]
+
+# (table, index, columns) of every index added since, same as above
+INDEXES = [
+    ("application_versions", "app_version_name_idx", "(`application_id`, `version_name`)"),
+]
+
+
+async def existing_columns(db, tables):
+    """
+    Returns a dict of every table of these that exists to a dict of its columns to their length
+    (None for the columns other than text).
+    """
+
+    columns = await db.query(
+        """
+            SELECT `TABLE_NAME` AS `table_name`, `COLUMN_NAME` AS `column_name`,
+                `CHARACTER_MAXIMUM_LENGTH` AS `column_length`
+            FROM `information_schema`.`COLUMNS`
+            WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME` IN ({0});
+        """.format(", ".join(["%s"] * len(tables))), *tables)
+
+    result = {}
+
+    for column in columns:
+        result.setdefault(column["table_name"], {})[column["column_name"]] = column["column_length"]
+
+    return result
+
+
+async def existing_indexes(db, tables):
+    """
+    Returns a dict of every table of these that has any index to the set of its index names.
+    """
+
+    indexes = await db.query(
+        """
+            SELECT DISTINCT `TABLE_NAME` AS `table_name`, `INDEX_NAME` AS `index_name`
+            FROM `information_schema`.`STATISTICS`
+            WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME` IN ({0});
+        """.format(", ".join(["%s"] * len(tables))), *tables)
+
+    result = {}
+
+    for index in indexes:
+        result.setdefault(index["table_name"], set()).add(index["index_name"])
+
+    return result
+
+
+async def migrate(db):
+    """
+    Brings the tables created by an earlier version up to date. The tables that do not exist yet are left alone,
+    the setup creates them as they are now.
+    Raises DatabaseError.
+    """
+
+    tables = list(dict.fromkeys(
+        [table for table, column, definition in COLUMNS] +
+        [table for table, column, length, definition in WIDENED] +
+        [table for table, index, columns in INDEXES]))
+    existing = await existing_columns(db, tables)
+
+    for table, column, definition in COLUMNS:
+        if table not in existing or column in existing[table]:
+            continue
+
+        logging.warning("Adding column `{0}`.`{1}` missing in a table created by an earlier version".format(
+            table, column))
+
+        try:
+            await db.execute(
+                """
+                    ALTER TABLE `{0}`
+                    ADD COLUMN `{1}` {2};
+                """.format(table, column, definition))
+        except DatabaseError:
+            # another instance starting at the same time might have just added it
+            if column not in (await existing_columns(db, [table])).get(table, {}):
+                raise
+
+    for table, column, length, definition in WIDENED:
+        current = existing.get(table, {}).get(column)
+
+        if current is None or current >= length:
+            continue
+
+        logging.warning("Widening column `{0}`.`{1}` from {2} to {3} characters".format(
+            table, column, current, length))
+
+        # widening again is harmless, so the instances starting at the same time do not have to care
+        await db.execute(
+            """
+                ALTER TABLE `{0}`
+                MODIFY COLUMN `{1}` {2};
+            """.format(table, column, definition))
+
+    indexes = await existing_indexes(db, tables)
+
+    for table, index, columns in INDEXES:
+        if table not in existing or index in indexes.get(table, set()):
+            continue
+
+        logging.warning("Adding index `{0}`.`{1}` missing in a table created by an earlier version".format(
+            table, index))
+
+        try:
+            await db.execute(
+                """
+                    ALTER TABLE `{0}`
+                    ADD INDEX `{1}` {2};
+                """.format(table, index, columns))
+        except DatabaseError:
+            # same as the columns, another instance might have just added it
+            if index not in (await existing_indexes(db, [table])).get(table, set()):
+                raise
@@ -0,0 +1,188 @@
+from tornado.ioloop import IOLoop
+
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import ujson
+
+
+class StaticPublishError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+# the service files next to the application directories (the service directories all start with a dot)
+MANIFEST = "manifest.json"
+
+
+def is_safe_name(name):
+    """
+    Only the names that cannot escape their directory, or clash with the service files, are published.
+    """
+    return bool(name) and not name.startswith(".") and name.lower() != MANIFEST and \
+        "/" not in name and "\\" not in name and "\0" not in name
+
+
+class StaticPublisher(object):
+    """
+    Writes every discovery answer of a routing snapshot as a static file, so a web server or a CDN could
+    answer the discovery requests directly, leaving DiscoverHandler as a fallback origin.
+
+    The published directory looks like this (the names lowercase, as the snapshot has them):
+        <app_name>/<app_version>.json       the answer as DiscoverHandler responds it to a client of no region
+        <app_name>/<app_version>.json.gz    the same, pre-compressed (for nginx gzip_static)
+        manifest.json                       what is published, and what can only be resolved by the origin
+                                            (version patterns and default versions)
+
+    A file is the same for every client, so only the versions of the environments with a single discovery
+    endpoint are published: picking one of several (by weight, leaving the unhealthy ones out) is left to
+    the origin. Regional overrides are not published either, the clients that should get them are to be
+    routed to the origin by whatever serves the files.
+
+    Each answer is rendered and compressed once per environment, the version files are hard links to it.
+    The path itself is a symlink, swapped at once to a freshly written directory, so the readers would
+    never see a half-written state.
+    """
+
+    DEFAULT_COMPRESS_LEVEL = 9
+    ENVIRONMENTS = ".environments"
+    MANIFEST = MANIFEST
+
+    def __init__(self, path, compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.path = os.path.abspath(path)
+        self.compress_level = compress_level
+        # the manifest of the last published snapshot, so an unchanged snapshot is not written again
+        self.published = None
+        # the latest snapshot waiting to be published, older ones are not worth publishing
+        self.pending = None
+        self.publishing = False
+
+    def schedule(self, snapshot):
+        """
+        Publishes the snapshot in background. Snapshots scheduled while another one is being published
+        are coalesced into the latest one.
+        """
+
+        self.pending = snapshot
+
+        if not self.publishing:
+            self.publishing = True
+            IOLoop.current().spawn_callback(self.__publish_pending)
+
+    async def __publish_pending(self):
+        try:
+            while self.pending is not None:
+                snapshot, self.pending = self.pending, None
+
+                try:
+                    await IOLoop.current().run_in_executor(None, self.publish, snapshot)
+                except (OSError, StaticPublishError) as e:
+                    logging.warning("Failed to publish static discovery: {0}".format(e))
+        finally:
+            self.publishing = False
+
+    def __manifest(self, snapshot):
+        manifest = {
+            "environments": {
+                str(environment_id): env.response.etag
+                for environment_id, env in snapshot.environments.items()
+                if len(env.endpoints) == 1
+            },
+            "applications": {}
+        }
+
+        for app_name, versions in snapshot.applications.items():
+            if not is_safe_name(app_name):
+                continue
+
+            matcher = snapshot.patterns.get(app_name)
+            default = snapshot.defaults.get(app_name)
+
+            manifest["applications"][app_name] = {
+                "versions": {
+                    version_name: str(env.environment_id)
+                    for version_name, env in versions.items()
+                    if is_safe_name(version_name) and str(env.environment_id) in manifest["environments"]
+                },
+                "patterns": list(matcher.patterns) if matcher is not None else [],
+                "default": str(default.environment_id) if default is not None else None
+            }
+
+        return manifest
+
+    def __write(self, snapshot, manifest, release):
+        environments_dir = os.path.join(release, StaticPublisher.ENVIRONMENTS)
+        os.mkdir(environments_dir)
+
+        for environment_id, env in snapshot.environments.items():
+            if str(environment_id) not in manifest["environments"]:
+                continue
+
+            body = env.response.body
+            path = os.path.join(environments_dir, "{0}.json".format(environment_id))
+
+            with open(path, "wb") as f:
+                f.write(body)
+
+            with open(path + ".gz", "wb") as f:
+                # no timestamp inside, so the same answer always compresses into the same bytes
+                f.write(gzip.compress(body, self.compress_level, mtime=0))
+
+        for app_name, app in manifest["applications"].items():
+            app_dir = os.path.join(release, app_name)
+            os.mkdir(app_dir)
+
+            for version_name, environment_id in app["versions"].items():
+                source = os.path.join(environments_dir, environment_id + ".json")
+                target = os.path.join(app_dir, version_name + ".json")
+
+                os.link(source, target)
+                os.link(source + ".gz", target + ".gz")
+
+        with open(os.path.join(release, StaticPublisher.MANIFEST), "w") as f:
+            f.write(ujson.dumps(manifest))
+
+    def publish(self, snapshot):
+        """
+        Writes the snapshot and swaps it in. Blocks, so it is meant to be run in an executor.
+        Returns False if the snapshot has not changed since the last publish.
+        """
+
+        manifest = self.__manifest(snapshot)
+
+        if manifest == self.published:
+            return False
+
+        if os.path.lexists(self.path) and not os.path.islink(self.path):
+            raise StaticPublishError("{0} exists and is not a symlink".format(self.path))
+
+        parent, name = os.path.split(self.path)
+        os.makedirs(parent, exist_ok=True)
+
+        release = tempfile.mkdtemp(prefix=name + ".", dir=parent)
+        previous = os.path.realpath(self.path) if os.path.islink(self.path) else None
+
+        try:
+            # mkdtemp is private to the owner, yet the web server should be able to read it
+            os.chmod(release, 0o755)
+            self.__write(snapshot, manifest, release)
+
+            link = release + ".link"
+            os.symlink(os.path.basename(release), link)
+            os.replace(link, self.path)
+        except BaseException:
+            shutil.rmtree(release, ignore_errors=True)
+            raise
+
+        if previous is not None and previous != release:
+            shutil.rmtree(previous, ignore_errors=True)
+
+        self.published = manifest
+        logging.info("Published static discovery of {0} applications into {1}".format(
+            len(manifest["applications"]), release))
+        return True
@@ -0,0 +1,374 @@
+from anthill.common.database import DatabaseError, DuplicateError
+from anthill.common.model import Model
+
+from . endpoints import parse_endpoints
+from . environment import EnvironmentDataError
+from . transaction import transaction
+
+import functools
+import ipaddress
+import logging
+import re
+import ujson
+
+
+# lowercase, as the region header is matched case-insensitively
+REGION_NAME_PATTERN = re.compile(r"^[a-z0-9_\-]{1,45}$")
+
+
+class RegionAdapter(object):
+    def __init__(self, data):
+        self.region_id = data.get("region_id")
+        self.environment_id = data.get("environment_id")
+        self.name = data.get("region_name")
+        # empty to keep the discovery location of the environment
+        self.discovery = data.get("region_discovery") or ""
+        self.data = data.get("region_data") or {}
+
+
+class PrefixIndex(object):
+    """
+    Longest prefix match of ip addresses to regions. The networks are kept in a dict per prefix length,
+    so a lookup takes a dict lookup per distinct prefix length in the table (33 at most for IPv4, 129 for IPv6),
+    however many networks are there.
+    """
+
+    BITS = {4: 32, 6: 128}
+
+    def __init__(self, networks=()):
+        # ip version -> {prefix length -> {network address -> region}}
+        self.tables = {4: {}, 6: {}}
+        # ip version -> [(prefix length, netmask)], the longest prefix first
+        self.masks = {4: [], 6: []}
+        self.size = 0
+
+        for network, region in networks:
+            self.add(network, region)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, network, region):
+        """
+        Maps a network, like "203.0.113.0/24" or "2001:db8::/32", to a region.
+        Raises ValueError if the network is malformed.
+        """
+
+        network = ipaddress.ip_network(network, strict=False)
+        tables = self.tables[network.version]
+        table = tables.setdefault(network.prefixlen, {})
+        address = int(network.network_address)
+
+        if address not in table:
+            self.size += 1
+
+        table[address] = region
+
+        bits = PrefixIndex.BITS[network.version]
+        self.masks[network.version] = [
+            (length, ((1 << length) - 1) << (bits - length))
+            for length in sorted(tables, reverse=True)
+        ]
+
+    def lookup(self, address):
+        """
+        Returns the region of the longest network the address belongs to, or None.
+        """
+
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        value = int(address)
+        tables = self.tables[address.version]
+
+        for length, mask in self.masks[address.version]:
+            region = tables[length].get(value & mask)
+
+            if region is not None:
+                return region
+
+        return None
+
+    @staticmethod
+    def load(path):
+        """
+        Reads a table of "<network> <region>" lines, like "203.0.113.0/24 apac".
+        Empty lines and the ones starting with # are skipped.
+        """
+
+        index = PrefixIndex()
+
+        try:
+            with open(path) as f:
+                for number, line in enumerate(f, start=1):
+                    line = line.strip()
+
+                    if not line or line.startswith("#"):
+                        continue
+
+                    parts = line.split()
+
+                    if len(parts) != 2:
+                        raise RegionError("Malformed line {0} of {1}".format(number, path))
+
+                    try:
+                        index.add(parts[0], parts[1].lower())
+                    except ValueError:
+                        raise RegionError("Malformed network at line {0} of {1}".format(number, path))
+        except OSError as e:
+            raise RegionError("Failed to read region prefixes: {0}".format(e))
+
+        return index
+
+
+class RegionsModel(Model):
+    """
+    Per-region overrides of the environments: another discovery service location, and some variables
+    to answer with instead of the environment's own, for the clients of a region.
+
+    The region of a client is told by a header (if it names a known region), or by its address looked up
+    in a PrefixIndex. Every override is kept in memory and reloaded on each change, so picking one costs
+    no database work.
+    """
+
+    def __init__(self, db, environment, prefixes=None):
+        """
+        :param prefixes: a PrefixIndex to tell the region of a client by its address, or None to only rely
+                         on the header
+        """
+
+        self.db = db
+        self.environment = environment
+        self.prefixes = prefixes
+
+        # environment_id -> {region_name -> RegionAdapter}
+        self.overrides = {}
+        # every region that overrides anything
+        self.region_names = frozenset()
+
+        self.environment.bus.subscribe(self.__on_bus_event)
+
+    def get_setup_db(self):
+        return self.db
+
+    def get_setup_tables(self):
+        return ["environment_regions"]
+
+    async def started(self, application):
+        # with the setup left to the background, the overrides are reloaded once it is done
+        await self.environment.setup_or_retry(
+            functools.partial(super(RegionsModel, self).started, application),
+            "regions", recovered=functools.partial(self.regions_changed, publish=False))
+        await self.regions_changed(publish=False)
+
+    async def __on_bus_event(self, event):
+        if event.get("kind") in ("regions", "everything"):
+            await self.regions_changed(publish=False)
+
+    async def regions_changed(self, publish=True):
+        """
+        Reloads every override. Should be called by every write to the regions.
+        """
+
+        if publish:
+            await self.environment.bus.publish({"kind": "regions"})
+
+        try:
+            regions = await self.db.query(
+                """
+                    SELECT *
+                    FROM `environment_regions`;
+                """)
+        except DatabaseError as e:
+            # the overrides there are still better than pointing everyone to the same place
+            logging.warning("Failed to load regional overrides: " + e.args[1])
+            return
+
+        overrides = {}
+
+        for region in map(RegionAdapter, regions):
+            overrides.setdefault(region.environment_id, {})[region.name] = region
+
+        self.overrides = overrides
+        self.region_names = frozenset(name for regions in overrides.values() for name in regions)
+
+    def detect_region(self, header=None, remote_ip=None):
+        """
+        Returns the region of a client: the one named by the header if it is known, otherwise the one its
+        address belongs to, or None.
+        """
+
+        if header:
+            region = header.strip().lower()
+
+            if region in self.region_names:
+                return region
+
+        if self.prefixes is not None and remote_ip:
+            return self.prefixes.lookup(remote_ip)
+
+        return None
+
+    def localize(self, version, region):
+        """
+        Returns the resolved environment as the clients of the region should see it (the environment itself
+        if the region does not override it).
+        """
+
+        if region is None:
+            return version
+
+        override = self.overrides.get(version.environment_id, {}).get(region)
+
+        if override is None:
+            return version
+
+        return version.localized(override)
+
+    async def list_regions(self, environment_id):
+        try:
+            regions = await self.db.query(
+                """
+                    SELECT *
+                    FROM `environment_regions`
+                    WHERE `environment_id`=%s
+                    ORDER BY `region_name` ASC;
+                """, environment_id)
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to list regions: " + e.args[1])
+
+        return list(map(RegionAdapter, regions))
+
+    async def get_region(self, environment_id, region_id):
+        try:
+            region = await self.db.get(
+                """
+                    SELECT *
+                    FROM `environment_regions`
+                    WHERE `environment_id`=%s AND `region_id`=%s;
+                """, environment_id, region_id)
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to get region: " + e.args[1])
+
+        if region is None:
+            raise RegionNotFound()
+
+        return RegionAdapter(region)
+
+    async def __validate(self, environment_id, region_name, region_discovery, region_data):
+        if not REGION_NAME_PATTERN.match(region_name):
+            raise RegionError("Region name should be lowercase letters, digits, - or _")
+
+        if not isinstance(region_data, dict):
+            raise RegionError("Region variables should be an object")
+
+        if region_discovery:
+            parse_endpoints(region_discovery)
+
+        # the environment as the region sees it should fit in the scheme as well
+        env = await self.environment.get_environment(environment_id)
+
+        data = dict(env.data)
+        data.update(region_data)
+
+        await self.environment.validate_environment_data(data)
+
+    @staticmethod
+    async def __stamp_environment(db, environment_id, revision):
+        await db.execute(
+            """
+                UPDATE `environments`
+                SET `environment_revision`=%s
+                WHERE `environment_id`=%s;
+            """, revision, environment_id)
+
+    async def __changed(self, environment_id):
+        await self.regions_changed()
+        await self.environment.environments_changed(environment_id=environment_id)
+
+    async def create_region(self, environment_id, region_name, region_discovery, region_data):
+        """
+        :param region_discovery: the discovery service location for the region, empty to keep the environment's
+        :param region_data: the variables to override
+        """
+
+        await self.__validate(environment_id, region_name, region_discovery, region_data)
+
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                region_id = await db.insert(
+                    """
+                        INSERT INTO `environment_regions`
+                        (`environment_id`, `region_name`, `region_discovery`, `region_data`)
+                        VALUES (%s, %s, %s, %s);
+                    """, environment_id, region_name, region_discovery, ujson.dumps(region_data))
+                await RegionsModel.__stamp_environment(db, environment_id, revision)
+                await db.commit()
+        except DuplicateError:
+            raise RegionExists()
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to create region: " + e.args[1])
+
+        await self.__changed(environment_id)
+        return region_id
+
+    async def update_region(self, environment_id, region_id, region_name, region_discovery, region_data):
+        await self.__validate(environment_id, region_name, region_discovery, region_data)
+
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                updated = await db.execute(
+                    """
+                        UPDATE `environment_regions`
+                        SET `region_name`=%s, `region_discovery`=%s, `region_data`=%s
+                        WHERE `environment_id`=%s AND `region_id`=%s;
+                    """, region_name, region_discovery, ujson.dumps(region_data), environment_id, region_id)
+                await RegionsModel.__stamp_environment(db, environment_id, revision)
+                await db.commit()
+        except DuplicateError:
+            raise RegionExists()
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to update region: " + e.args[1])
+
+        await self.__changed(environment_id)
+        return bool(updated)
+
+    async def delete_region(self, environment_id, region_id):
+        try:
+            async with transaction(self.db) as db:
+                revision = await self.environment.next_revision(db)
+                deleted = await db.execute(
+                    """
+                        DELETE FROM `environment_regions`
+                        WHERE `environment_id`=%s AND `region_id`=%s;
+                    """, environment_id, region_id)
+                await RegionsModel.__stamp_environment(db, environment_id, revision)
+                await db.commit()
+        except DatabaseError as e:
+            raise EnvironmentDataError("Failed to delete region: " + e.args[1])
+
+        await self.__changed(environment_id)
+        return bool(deleted)
+
+
+class RegionNotFound(Exception):
+    pass
+
+
+class RegionExists(Exception):
+    pass
+
+
+class RegionError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
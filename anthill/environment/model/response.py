@@ -0,0 +1,183 @@
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import gzip
+import hashlib
+import ujson
+
+
+def parse_accept(header):
+    """
+    Turns an Accept or an Accept-Encoding header into a dict of the tokens to their quality.
+    """
+
+    result = {}
+
+    if not header:
+        return result
+
+    for item in header.split(","):
+        token, _, params = item.partition(";")
+        token = token.strip().lower()
+
+        if not token:
+            continue
+
+        quality = 1.0
+
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        result[token] = quality
+
+    return result
+
+
+class ResponseVariant(object):
+    """
+    A single representation of a discovery answer, ready to be sent as it is.
+    """
+
+    def __init__(self, content_type, encoding, body):
+        self.content_type = content_type
+        # a Content-Encoding, or None
+        self.encoding = encoding
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class DiscoverResponse(object):
+    """
+    A discovery answer rendered once into ready-to-send bytes, along with its entity tag.
+    The other representations (compressed, or msgpack) are rendered once they are asked for for the first time,
+    and are kept along. So are the projections of the answer to a subset of its fields.
+    """
+
+    CONTENT_TYPE = "application/json"
+    MSGPACK_CONTENT_TYPE = "application/msgpack"
+    MSGPACK_ALIASES = ("application/msgpack", "application/x-msgpack")
+
+    # the answers smaller than that do not get any smaller being compressed
+    MIN_COMPRESS_SIZE = 256
+    # distinct field sets kept per answer, the ones beyond that are projected on every request
+    MAX_PROJECTIONS = 32
+
+    def __init__(self, discovery, data, fields=None):
+        """
+        :param fields: a frozenset of the fields to keep in the answer, or None to keep everything
+        """
+
+        self.discovery = discovery
+        self.data = data
+
+        self.result = {
+            "discovery": discovery
+        }
+
+        self.result.update(data)
+
+        if fields is not None:
+            self.result = {key: value for key, value in self.result.items() if key in fields}
+
+        # the same as JsonHandler writes it, the urls unescaped
+        self.body = ujson.dumps(self.result, escape_forward_slashes=False).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+        # (content type, encoding) -> ResponseVariant
+        self.variants = {
+            (DiscoverResponse.CONTENT_TYPE, None): ResponseVariant(DiscoverResponse.CONTENT_TYPE, None, self.body)
+        }
+        # frozenset of fields -> DiscoverResponse
+        self.projections = {}
+
+    def project(self, fields):
+        """
+        Returns the answer with only the given fields kept (the ones that do not exist are ignored).
+        """
+
+        fields = frozenset(fields)
+        projection = self.projections.get(fields)
+
+        if projection is None:
+            projection = DiscoverResponse(self.discovery, self.data, fields)
+
+            if len(self.projections) < DiscoverResponse.MAX_PROJECTIONS:
+                self.projections[fields] = projection
+
+        return projection
+
+    def variant(self, content_type=CONTENT_TYPE, encoding=None):
+        key = (content_type, encoding)
+        variant = self.variants.get(key)
+
+        if variant is None:
+            if encoding is None:
+                body = self.__encode(content_type)
+            else:
+                body = self.__compress(self.variant(content_type).body, encoding)
+
+            variant = ResponseVariant(content_type, encoding, body)
+            self.variants[key] = variant
+
+        return variant
+
+    def __encode(self, content_type):
+        if content_type == DiscoverResponse.MSGPACK_CONTENT_TYPE:
+            return msgpack.packb(self.result, use_bin_type=True)
+
+        raise ValueError("Unsupported content type: {0}".format(content_type))
+
+    @staticmethod
+    def __compress(body, encoding):
+        if encoding == "br":
+            return brotli.compress(body)
+
+        if encoding == "gzip":
+            # no timestamp inside, so the same answer always compresses into the same bytes (and etag)
+            return gzip.compress(body, 9, mtime=0)
+
+        raise ValueError("Unsupported encoding: {0}".format(encoding))
+
+    def negotiate(self, accept=None, accept_encoding=None):
+        """
+        Picks the best representation for the Accept and Accept-Encoding headers of a request:
+        msgpack if it is preferred over json (and msgpack is installed), compressed with brotli or gzip if accepted.
+        """
+
+        content_type = DiscoverResponse.CONTENT_TYPE
+
+        if accept and msgpack is not None:
+            types = parse_accept(accept)
+            json_quality = max(types.get(DiscoverResponse.CONTENT_TYPE, 0.0), types.get("*/*", 0.0))
+            msgpack_quality = max(types.get(alias, 0.0) for alias in DiscoverResponse.MSGPACK_ALIASES)
+
+            if msgpack_quality > 0 and msgpack_quality >= json_quality:
+                content_type = DiscoverResponse.MSGPACK_CONTENT_TYPE
+
+        encoding = None
+
+        if accept_encoding:
+            encodings = parse_accept(accept_encoding)
+
+            if brotli is not None and encodings.get("br", 0.0) > 0:
+                encoding = "br"
+            elif encodings.get("gzip", 0.0) > 0:
+                encoding = "gzip"
+
+        if encoding is not None and len(self.variant(content_type).body) < DiscoverResponse.MIN_COMPRESS_SIZE:
+            encoding = None
+
+        return self.variant(content_type, encoding)
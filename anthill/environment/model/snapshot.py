@@ -0,0 +1,110 @@
+from . application import DEFAULT
+from . matcher import VersionMatcher
+
+
+class RoutingSnapshot(object):
+    """
+    An immutable, indexed copy of everything discovery depends on.
+    Versions pointing to the same environment share a single resolved entry (and so its rendered response).
+    The names are indexed lowercase, as the database compares them case-insensitively.
+    """
+
+    def __init__(self, applications, versions, patterns, environments, revision=0):
+        # the latest revision of any write the snapshot includes
+        self.revision = revision
+        # environment_id -> resolved environment
+        self.environments = environments
+        # application_name -> {version_name -> resolved environment}
+        self.applications = {}
+        # application_name -> VersionMatcher of resolved environments, for the versions not defined exactly
+        self.patterns = {}
+        # application_name -> resolved environment, for the versions neither defined, nor matched by a pattern
+        self.defaults = {}
+        # application_name -> the latest revision of the application or any of its versions; tracked per
+        # application rather than per version, so watching is not worth a second million-entry index
+        self.revisions = {}
+
+        application_names = {}
+
+        for app in applications:
+            app_name = app["application_name"].lower()
+            application_names[app["application_id"]] = app_name
+            self.applications[app_name] = {}
+            self.revisions[app_name] = app.get("application_revision", 0)
+
+        for version in versions:
+            app_name = application_names.get(version["application_id"])
+            env = self.environments.get(version["version_environment"])
+
+            if app_name is None or env is None:
+                continue
+
+            self.applications[app_name][version["version_name"].lower()] = env
+
+            version_revision = version.get("version_revision", 0)
+
+            if version_revision > self.revisions[app_name]:
+                self.revisions[app_name] = version_revision
+
+        for app_name, app_versions in self.applications.items():
+            default = app_versions.pop(DEFAULT, None)
+
+            if default is not None:
+                self.defaults[app_name] = default
+
+        rules = {}
+
+        for pattern in patterns:
+            app_name = application_names.get(pattern["application_id"])
+            env = self.environments.get(pattern["pattern_environment"])
+
+            if app_name is None or env is None:
+                continue
+
+            rules.setdefault(app_name, []).append((pattern["pattern"], env))
+
+        for app_name, app_rules in rules.items():
+            self.patterns[app_name] = VersionMatcher(app_rules)
+
+    def resolve(self, app_name, app_version):
+        """
+        Returns the resolved environment or None if there is no such application version
+        """
+        app_name = app_name.lower()
+        versions = self.applications.get(app_name)
+
+        if versions is None:
+            return None
+
+        version = versions.get(app_version.lower())
+
+        if version is not None:
+            return version
+
+        matcher = self.patterns.get(app_name)
+
+        if matcher is not None:
+            version = matcher.match(app_version)
+
+            if version is not None:
+                return version
+
+        return self.defaults.get(app_name)
+
+    def revision_of(self, app_name, app_version):
+        """
+        Returns the revision of whatever the version resolves with, 0 if the application does not exist.
+        It changes whenever the answer for that version might have.
+        """
+
+        revision = self.revisions.get(app_name.lower())
+
+        if revision is None:
+            return 0
+
+        env = self.resolve(app_name, app_version)
+
+        if env is not None and env.revision > revision:
+            return env.revision
+
+        return revision
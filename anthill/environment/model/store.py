@@ -0,0 +1,121 @@
+import logging
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+
+class SnapshotStoreError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class SnapshotStore(object):
+    """
+    Keeps the rows of the last successfully loaded routing snapshot in a file, so a restarted instance could
+    answer discovery before (or without) the database.
+
+    The rows are stored with marshal, the fastest thing to load plain python data with. Since marshal is not
+    portable between python versions, the file header carries the version it was written with, and a file
+    written by another version (or a damaged one) is simply ignored.
+    """
+
+    # magic, format version, python major, python minor, crc32 of the payload
+    HEADER = struct.Struct("!8sHBBI")
+    MAGIC = b"ENVSNAP\0"
+    FORMAT_VERSION = 1
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        # the rows known to be in the file, so an unchanged snapshot is not written again
+        self.stored = None
+
+    def load(self):
+        """
+        Returns the stored rows, or None if there are none that could be used.
+        """
+
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning("Failed to read stored routing snapshot: {0}".format(e))
+            return None
+
+        try:
+            rows = self.__decode(data)
+        except SnapshotStoreError as e:
+            logging.warning("Stored routing snapshot {0} is ignored: {1}".format(self.path, e.message))
+            return None
+
+        self.stored = rows
+        return rows
+
+    def __decode(self, data):
+        if len(data) < SnapshotStore.HEADER.size:
+            raise SnapshotStoreError("truncated")
+
+        magic, format_version, major, minor, checksum = SnapshotStore.HEADER.unpack_from(data)
+        payload = data[SnapshotStore.HEADER.size:]
+
+        if magic != SnapshotStore.MAGIC or format_version != SnapshotStore.FORMAT_VERSION:
+            raise SnapshotStoreError("unknown format")
+
+        if (major, minor) != sys.version_info[:2]:
+            raise SnapshotStoreError("written by python {0}.{1}".format(major, minor))
+
+        if zlib.crc32(payload) != checksum:
+            raise SnapshotStoreError("corrupted")
+
+        try:
+            return marshal.loads(payload)
+        except (EOFError, ValueError, TypeError):
+            raise SnapshotStoreError("corrupted")
+
+    def save(self, rows):
+        """
+        Atomically replaces the stored rows. Blocks, so it is meant to be run in an executor.
+        Returns False if the rows are the same as already stored.
+        """
+
+        if rows == self.stored:
+            return False
+
+        try:
+            payload = marshal.dumps(rows)
+        except ValueError as e:
+            raise SnapshotStoreError("Cannot store routing snapshot: {0}".format(e))
+
+        header = SnapshotStore.HEADER.pack(
+            SnapshotStore.MAGIC, SnapshotStore.FORMAT_VERSION,
+            sys.version_info[0], sys.version_info[1], zlib.crc32(payload))
+
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+
+        temp = "{0}.{1}.tmp".format(self.path, os.getpid())
+
+        try:
+            with open(temp, "wb") as f:
+                f.write(header)
+                f.write(payload)
+                f.flush()
+                # the file has to survive a crash, or the rename could point to nothing
+                os.fsync(f.fileno())
+
+            os.replace(temp, self.path)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+
+        self.stored = rows
+        return True
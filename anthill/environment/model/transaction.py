@@ -0,0 +1,38 @@
+from anthill.common.database import DatabaseError
+
+import logging
+
+
+class transaction(object):
+    """
+    Acquires a connection with a transaction open, same as db.acquire(auto_commit=False) does, and rolls the
+    transaction back if anything raises within. The connection goes back to the pool as it is once released,
+    so a transaction left open would keep its locks until the connection is reused, and would be committed
+    then, half-done.
+
+        async with transaction(self.db) as db:
+            ...
+            await db.commit()
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.acquire = None
+        self.connection = None
+
+    async def __aenter__(self):
+        self.acquire = self.db.acquire(auto_commit=False)
+        self.connection = await self.acquire.__aenter__()
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is not None:
+                try:
+                    await self.connection.rollback()
+                except DatabaseError as e:
+                    logging.warning("Failed to roll back a transaction: {0}".format(e))
+        finally:
+            released = await self.acquire.__aexit__(exc_type, exc_val, exc_tb)
+
+        return released
@@ -0,0 +1,745 @@
+from anthill.common.database import DatabaseError
+from anthill.common.model import Model
+
+from . endpoints import parse_endpoints, EndpointsInvalid, MAX_DISCOVERY_LENGTH
+from . environment import compile_scheme, validation_error, SchemeInvalid, EnvironmentDataError
+from . matcher import VersionMatcher
+from . region import REGION_NAME_PATTERN
+from . transaction import transaction
+
+import ujson
+
+
+class TransferError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class ImportReport(object):
+    """
+    What an import has done: how many items of each kind were created, updated or left as they were,
+    and the conflicts, each being a dict with the 'line' number and the 'reason'.
+    """
+
+    KINDS = ["scheme", "environment", "region", "application", "version", "pattern"]
+
+    def __init__(self):
+        self.counts = {
+            kind: {"created": 0, "updated": 0, "unchanged": 0}
+            for kind in ImportReport.KINDS
+        }
+        self.conflicts = []
+
+    def count(self, kind, what, amount=1):
+        self.counts[kind][what] += amount
+
+    def conflict(self, line, reason):
+        self.conflicts.append({"line": line, "reason": reason})
+
+    def dump(self):
+        return {
+            "counts": self.counts,
+            "conflicts": self.conflicts
+        }
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+class TransferModel(Model):
+    """
+    Exports the whole configuration as json lines, and imports it back with a handful of batched queries.
+    Each line is a json object with a 'type':
+        {"type": "scheme", "data": {...}}
+        {"type": "environment", "name": "dev", "discovery": "http://...", "data": {...}}
+        {"type": "region", "environment": "dev", "name": "apac", "discovery": "http://...", "data": {...}}
+        {"type": "application", "name": "test", "title": "Test application"}
+        {"type": "version", "app": "test", "version": "1.0", "environment": "dev"}
+        {"type": "pattern", "app": "test", "pattern": "1.4.*", "environment": "dev"}
+    """
+
+    EXPORT_PAGE = 1000
+    IMPORT_CHUNK = 500
+
+    def __init__(self, db, environment, regions=None):
+        self.db = db
+        self.environment = environment
+        self.regions = regions
+
+    async def export_configuration(self):
+        """
+        An async generator of the configuration lines (as dicts). Versions are read page by page,
+        so the whole table never has to be in memory at once.
+        """
+
+        try:
+            scheme = await self.db.get(
+                """
+                    SELECT `data` FROM `scheme`;
+                """)
+
+            if scheme is not None:
+                yield {"type": "scheme", "data": scheme["data"]}
+
+            environments = await self.db.query(
+                """
+                    SELECT `environment_name`, `environment_discovery`, `environment_data`
+                    FROM `environments`
+                    ORDER BY `environment_id` ASC;
+                """)
+
+            for env in environments:
+                yield {
+                    "type": "environment",
+                    "name": env["environment_name"],
+                    "discovery": env["environment_discovery"],
+                    "data": env["environment_data"]
+                }
+
+            regions = await self.db.query(
+                """
+                    SELECT `environment_name`, `region_name`, `region_discovery`, `region_data`
+                    FROM `environment_regions`, `environments`
+                    WHERE `environments`.`environment_id`=`environment_regions`.`environment_id`
+                    ORDER BY `region_id` ASC;
+                """)
+
+            for region in regions:
+                yield {
+                    "type": "region",
+                    "environment": region["environment_name"],
+                    "name": region["region_name"],
+                    "discovery": region["region_discovery"],
+                    "data": region["region_data"]
+                }
+
+            applications = await self.db.query(
+                """
+                    SELECT `application_name`, `application_title`
+                    FROM `applications`
+                    ORDER BY `application_id` ASC;
+                """)
+
+            for app in applications:
+                yield {
+                    "type": "application",
+                    "name": app["application_name"],
+                    "title": app["application_title"]
+                }
+
+            last_version_id = 0
+
+            while True:
+                versions = await self.db.query(
+                    """
+                        SELECT `version_id`, `application_name`, `version_name`, `environment_name`
+                        FROM `application_versions`, `applications`, `environments`
+                        WHERE `application_versions`.`application_id`=`applications`.`application_id`
+                            AND `environment_id`=`application_versions`.`version_environment`
+                            AND `version_id`>%s
+                        ORDER BY `version_id` ASC
+                        LIMIT %s;
+                    """, last_version_id, TransferModel.EXPORT_PAGE)
+
+                for version in versions:
+                    yield {
+                        "type": "version",
+                        "app": version["application_name"],
+                        "version": version["version_name"],
+                        "environment": version["environment_name"]
+                    }
+
+                if len(versions) < TransferModel.EXPORT_PAGE:
+                    break
+
+                last_version_id = versions[-1]["version_id"]
+
+            patterns = await self.db.query(
+                """
+                    SELECT `application_name`, `pattern`, `environment_name`
+                    FROM `application_version_patterns`, `applications`, `environments`
+                    WHERE `application_version_patterns`.`application_id`=`applications`.`application_id`
+                        AND `environment_id`=`application_version_patterns`.`pattern_environment`
+                    ORDER BY `pattern_id` ASC;
+                """)
+
+            for pattern in patterns:
+                yield {
+                    "type": "pattern",
+                    "app": pattern["application_name"],
+                    "pattern": pattern["pattern"],
+                    "environment": pattern["environment_name"]
+                }
+
+        except DatabaseError as e:
+            raise TransferError("Failed to export configuration: " + e.args[1])
+
+    @staticmethod
+    def __parse(lines, report):
+        """
+        Sorts the lines out by type, reporting the malformed ones.
+        Returns a dict type -> list of (line number, item).
+        """
+
+        fields = {
+            "scheme": {"data": dict},
+            "environment": {"name": str, "discovery": str, "data": dict},
+            "region": {"environment": str, "name": str, "discovery": str, "data": dict},
+            "application": {"name": str, "title": str},
+            "version": {"app": str, "version": str, "environment": str},
+            "pattern": {"app": str, "pattern": str, "environment": str},
+        }
+
+        # the sizes of the columns the fields are stored in
+        lengths = {
+            "name": 45, "discovery": MAX_DISCOVERY_LENGTH, "title": 128, "app": 45, "version": 45, "environment": 45,
+            "pattern": 64
+        }
+
+        items = {kind: [] for kind in ImportReport.KINDS}
+
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                item = ujson.loads(line)
+            except ValueError:
+                report.conflict(number, "Corrupted JSON")
+                continue
+
+            kind = item.get("type") if isinstance(item, dict) else None
+
+            if kind not in fields:
+                report.conflict(number, "Unknown type")
+                continue
+
+            malformed = [
+                name for name, field_type in fields[kind].items()
+                if not isinstance(item.get(name), field_type)
+            ]
+
+            if malformed:
+                report.conflict(number, "Malformed fields: {0}".format(", ".join(malformed)))
+                continue
+
+            too_long = [
+                name for name in fields[kind]
+                if name in lengths and len(item[name]) > lengths[name]
+            ]
+
+            if too_long:
+                report.conflict(number, "Fields are too long: {0}".format(", ".join(too_long)))
+                continue
+
+            items[kind].append((number, item))
+
+        return items
+
+    async def import_configuration(self, lines, overwrite=False, dry_run=False):
+        """
+        Applies the configuration lines within a single transaction, with batched multi-row upserts.
+        An item that exists already and differs is a conflict, unless overwrite is set.
+        Conflicting or malformed lines are skipped and reported, and never stop the rest from being applied.
+        With dry_run, everything is checked and reported, but nothing is applied.
+        Returns an ImportReport.
+        """
+
+        report = ImportReport()
+        items = TransferModel.__parse(lines, report)
+
+        try:
+            async with transaction(self.db) as db:
+                # everything the import changes gets the same revision
+                revision = await self.environment.next_revision(db)
+                scheme = await self.__import_scheme(db, items["scheme"], overwrite, report)
+                validator = await self.__scheme_validator(scheme)
+                environments = await self.__import_environments(
+                    db, items["environment"], validator, overwrite, report, revision)
+                await self.__import_regions(
+                    db, items["region"], environments, validator, overwrite, report, revision)
+                applications = await self.__import_applications(
+                    db, items["application"], overwrite, report, revision)
+                await self.__import_versions(
+                    db, items["version"], applications, environments, overwrite, report, revision)
+                await self.__import_patterns(
+                    db, items["pattern"], applications, environments, overwrite, report, revision)
+
+                if dry_run:
+                    await db.rollback()
+                else:
+                    await db.commit()
+        except DatabaseError as e:
+            raise TransferError("Failed to import configuration: " + e.args[1])
+
+        if not dry_run:
+            if self.regions is not None:
+                await self.regions.regions_changed(publish=False)
+
+            await self.environment.everything_changed()
+
+        return report
+
+    async def __scheme_validator(self, scheme):
+        """
+        Returns the validator the imported environments are checked with, the one of the imported scheme
+        if any has been applied, or the one of the current scheme. None means nothing to check against.
+        """
+
+        try:
+            if scheme is not None:
+                return compile_scheme(scheme)
+
+            return await self.environment.get_scheme_validator()
+        except (SchemeInvalid, EnvironmentDataError):
+            return None
+
+    async def __import_scheme(self, db, items, overwrite, report):
+        """
+        Returns the scheme if it has been applied.
+        """
+
+        if not items:
+            return None
+
+        if len(items) > 1:
+            for number, item in items[:-1]:
+                report.conflict(number, "Scheme is defined more than once, the last one is used")
+
+        number, item = items[-1]
+
+        try:
+            compile_scheme(item["data"])
+        except SchemeInvalid as e:
+            report.conflict(number, e.message)
+            return None
+
+        existing = await db.get(
+            """
+                SELECT `data` FROM `scheme`;
+            """)
+
+        if existing is not None:
+            if existing["data"] == item["data"]:
+                report.count("scheme", "unchanged")
+                return None
+
+            if not overwrite:
+                report.conflict(number, "Scheme differs")
+                return None
+
+        await db.execute(
+            """
+                INSERT INTO `scheme`
+                (`data`)
+                VALUES (%s)
+                ON DUPLICATE KEY
+                UPDATE `data`=VALUES(`data`);
+            """, ujson.dumps(item["data"]))
+
+        report.count("scheme", "created" if existing is None else "updated")
+        return item["data"]
+
+    async def __import_environments(self, db, items, validator, overwrite, report, revision):
+        """
+        Returns a dict environment name (lowercase) -> id of every environment there is after the import.
+        """
+
+        # lowercase, as the unique key the upsert runs into compares the names case-insensitively
+        existing = {
+            env["environment_name"].lower(): env
+            for env in await db.query(
+                """
+                    SELECT `environment_id`, `environment_name`, `environment_discovery`, `environment_data`
+                    FROM `environments`;
+                """)
+        }
+
+        upsert = {}
+
+        for number, item in items:
+            try:
+                parse_endpoints(item["discovery"])
+            except EndpointsInvalid as e:
+                report.conflict(number, "Environment {0} has a malformed discovery: {1}".format(
+                    item["name"], e.message))
+                continue
+
+            if validator is not None:
+                error = validation_error(validator, item["data"])
+
+                if error is not None:
+                    report.conflict(number, "Environment {0} does not fit in the scheme: {1}".format(
+                        item["name"], error))
+                    continue
+
+            env = existing.get(item["name"].lower())
+
+            if env is None:
+                report.count("environment", "created")
+            elif env["environment_discovery"] == item["discovery"] and env["environment_data"] == item["data"]:
+                report.count("environment", "unchanged")
+                continue
+            elif overwrite:
+                report.count("environment", "updated")
+            else:
+                report.conflict(number, "Environment {0} differs".format(item["name"]))
+                continue
+
+            upsert[item["name"].lower()] = item
+
+        for chunk in chunks(list(upsert.values()), TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    INSERT INTO `environments`
+                    (`environment_name`, `environment_discovery`, `environment_data`, `environment_revision`)
+                    VALUES {0}
+                    ON DUPLICATE KEY UPDATE
+                        `environment_discovery`=VALUES(`environment_discovery`),
+                        `environment_data`=VALUES(`environment_data`),
+                        `environment_revision`=VALUES(`environment_revision`);
+                """.format(", ".join(["(%s, %s, %s, %s)"] * len(chunk))),
+                *[value for item in chunk for value in (
+                    item["name"], item["discovery"], ujson.dumps(item["data"]), revision)])
+
+        if not upsert:
+            return {name: env["environment_id"] for name, env in existing.items()}
+
+        return {
+            env["environment_name"].lower(): env["environment_id"]
+            for env in await db.query(
+                """
+                    SELECT `environment_id`, `environment_name`
+                    FROM `environments`;
+                """)
+        }
+
+    async def __import_regions(self, db, items, environments, validator, overwrite, report, revision):
+        # environment_id -> the variables of the environment as imported, the regions override them
+        environment_data = {}
+
+        if validator is not None and items:
+            environment_data = {
+                env["environment_id"]: env["environment_data"]
+                for env in await db.query(
+                    """
+                        SELECT `environment_id`, `environment_data`
+                        FROM `environments`;
+                    """)
+            }
+
+        # (environment_id, region_name) -> region
+        existing = {
+            (region["environment_id"], region["region_name"]): region
+            for region in await db.query(
+                """
+                    SELECT `region_id`, `environment_id`, `region_name`, `region_discovery`, `region_data`
+                    FROM `environment_regions`;
+                """)
+        }
+
+        upsert = {}
+
+        for number, item in items:
+            environment_id = environments.get(item["environment"].lower())
+
+            if environment_id is None:
+                report.conflict(number, "No such environment: {0}".format(item["environment"]))
+                continue
+
+            if not REGION_NAME_PATTERN.match(item["name"]):
+                report.conflict(number, "Malformed region name: {0}".format(item["name"]))
+                continue
+
+            if item["discovery"]:
+                try:
+                    parse_endpoints(item["discovery"])
+                except EndpointsInvalid as e:
+                    report.conflict(number, "Region {0} of {1} has a malformed discovery: {2}".format(
+                        item["name"], item["environment"], e.message))
+                    continue
+
+            if validator is not None:
+                # the environment as the region sees it should fit in the scheme as well
+                data = dict(environment_data.get(environment_id) or {})
+                data.update(item["data"])
+                error = validation_error(validator, data)
+
+                if error is not None:
+                    report.conflict(number, "Region {0} of {1} does not fit in the scheme: {2}".format(
+                        item["name"], item["environment"], error))
+                    continue
+
+            key = (environment_id, item["name"])
+            region = existing.get(key)
+
+            if region is None:
+                report.count("region", "created")
+                region_id = None
+            elif region["region_discovery"] == item["discovery"] and region["region_data"] == item["data"]:
+                report.count("region", "unchanged")
+                continue
+            elif overwrite:
+                report.count("region", "updated")
+                region_id = region["region_id"]
+            else:
+                report.conflict(number, "Region {0} of {1} differs".format(item["name"], item["environment"]))
+                continue
+
+            upsert[key] = (region_id, environment_id, item["name"], item["discovery"], ujson.dumps(item["data"]))
+
+        for chunk in chunks(list(upsert.values()), TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    INSERT INTO `environment_regions`
+                    (`region_id`, `environment_id`, `region_name`, `region_discovery`, `region_data`)
+                    VALUES {0}
+                    ON DUPLICATE KEY UPDATE
+                        `region_discovery`=VALUES(`region_discovery`),
+                        `region_data`=VALUES(`region_data`);
+                """.format(", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk))),
+                *[value for row in chunk for value in row])
+
+        # regions carry no revision of their own, the environments they override do
+        changed = list({environment_id for environment_id, region_name in upsert})
+
+        for chunk in chunks(changed, TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    UPDATE `environments`
+                    SET `environment_revision`=%s
+                    WHERE `environment_id` IN ({0});
+                """.format(", ".join(["%s"] * len(chunk))), revision, *chunk)
+
+    async def __import_applications(self, db, items, overwrite, report, revision):
+        """
+        Returns a dict application name (lowercase) -> id of every application there is after the import.
+        """
+
+        # lowercase, same as the environments
+        existing = {
+            app["application_name"].lower(): app
+            for app in await db.query(
+                """
+                    SELECT `application_id`, `application_name`, `application_title`
+                    FROM `applications`;
+                """)
+        }
+
+        upsert = {}
+
+        for number, item in items:
+            app = existing.get(item["name"].lower())
+
+            if app is None:
+                report.count("application", "created")
+            elif app["application_title"] == item["title"]:
+                report.count("application", "unchanged")
+                continue
+            elif overwrite:
+                report.count("application", "updated")
+            else:
+                report.conflict(number, "Application {0} differs".format(item["name"]))
+                continue
+
+            upsert[item["name"].lower()] = item
+
+        for chunk in chunks(list(upsert.values()), TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    INSERT INTO `applications`
+                    (`application_name`, `application_title`, `application_revision`)
+                    VALUES {0}
+                    ON DUPLICATE KEY UPDATE
+                        `application_title`=VALUES(`application_title`),
+                        `application_revision`=VALUES(`application_revision`);
+                """.format(", ".join(["(%s, %s, %s)"] * len(chunk))),
+                *[value for item in chunk for value in (item["name"], item["title"], revision)])
+
+        if not upsert:
+            return {name: app["application_id"] for name, app in existing.items()}
+
+        return {
+            app["application_name"].lower(): app["application_id"]
+            for app in await db.query(
+                """
+                    SELECT `application_id`, `application_name`
+                    FROM `applications`;
+                """)
+        }
+
+    @staticmethod
+    def __resolve_names(number, item, applications, environments, report):
+        application_id = applications.get(item["app"].lower())
+
+        if application_id is None:
+            report.conflict(number, "No such application: {0}".format(item["app"]))
+            return None
+
+        environment_id = environments.get(item["environment"].lower())
+
+        if environment_id is None:
+            report.conflict(number, "No such environment: {0}".format(item["environment"]))
+            return None
+
+        return application_id, environment_id
+
+    @staticmethod
+    def __application_ids(items, applications):
+        return list({
+            applications[item["app"].lower()]
+            for number, item in items if item["app"].lower() in applications
+        })
+
+    async def __import_versions(self, db, items, applications, environments, overwrite, report, revision):
+        application_ids = TransferModel.__application_ids(items, applications)
+
+        if not application_ids:
+            for number, item in items:
+                TransferModel.__resolve_names(number, item, applications, environments, report)
+            return
+
+        # (application_id, version_name lowercase) -> (version_id, version_environment)
+        existing = {
+            (version["application_id"], version["version_name"].lower()):
+                (version["version_id"], version["version_environment"])
+            for version in await db.query(
+                """
+                    SELECT `version_id`, `application_id`, `version_name`, `version_environment`
+                    FROM `application_versions`
+                    WHERE `application_id` IN ({0});
+                """.format(", ".join(["%s"] * len(application_ids))), *application_ids)
+        }
+
+        upsert = {}
+
+        for number, item in items:
+            resolved = TransferModel.__resolve_names(number, item, applications, environments, report)
+
+            if resolved is None:
+                continue
+
+            application_id, environment_id = resolved
+            key = (application_id, item["version"].lower())
+            version = existing.get(key)
+
+            if version is None:
+                report.count("version", "created")
+                version_id = None
+            elif version[1] == environment_id:
+                report.count("version", "unchanged")
+                continue
+            elif overwrite:
+                report.count("version", "updated")
+                version_id = version[0]
+            else:
+                report.conflict(number, "Version {0} of {1} is mapped to another environment".format(
+                    item["version"], item["app"]))
+                continue
+
+            # a null id inserts a new row, an existing one updates it in place
+            upsert[key] = (version_id, application_id, item["version"], environment_id, revision)
+
+        for chunk in chunks(list(upsert.values()), TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    INSERT INTO `application_versions`
+                    (`version_id`, `application_id`, `version_name`, `version_environment`, `version_revision`)
+                    VALUES {0}
+                    ON DUPLICATE KEY UPDATE
+                        `version_environment`=VALUES(`version_environment`),
+                        `version_revision`=VALUES(`version_revision`);
+                """.format(", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk))),
+                *[value for row in chunk for value in row])
+
+    async def __import_patterns(self, db, items, applications, environments, overwrite, report, revision):
+        application_ids = TransferModel.__application_ids(items, applications)
+
+        if not application_ids:
+            for number, item in items:
+                TransferModel.__resolve_names(number, item, applications, environments, report)
+            return
+
+        # application_id -> {pattern -> (pattern_id, pattern_environment)}
+        existing = {}
+
+        for pattern in await db.query(
+                """
+                    SELECT `pattern_id`, `application_id`, `pattern`, `pattern_environment`
+                    FROM `application_version_patterns`
+                    WHERE `application_id` IN ({0});
+                """.format(", ".join(["%s"] * len(application_ids))), *application_ids):
+            existing.setdefault(pattern["application_id"], {})[pattern["pattern"]] = \
+                (pattern["pattern_id"], pattern["pattern_environment"])
+
+        upsert = []
+        # application_id -> patterns that are known to fit in together
+        accepted = {
+            application_id: list(patterns)
+            for application_id, patterns in existing.items()
+        }
+
+        for number, item in items:
+            resolved = TransferModel.__resolve_names(number, item, applications, environments, report)
+
+            if resolved is None:
+                continue
+
+            application_id, environment_id = resolved
+            pattern = item["pattern"].strip()
+            current = existing.get(application_id, {}).get(pattern)
+
+            if current is None:
+                app_patterns = accepted.setdefault(application_id, [])
+                matcher = VersionMatcher([(other, other) for other in app_patterns] + [(pattern, pattern)])
+
+                if matcher.errors or matcher.conflicts:
+                    report.conflict(number, "Pattern {0} of {1} is malformed or overlaps with another one".format(
+                        pattern, item["app"]))
+                    continue
+
+                app_patterns.append(pattern)
+                report.count("pattern", "created")
+                pattern_id = None
+            elif current[1] == environment_id:
+                report.count("pattern", "unchanged")
+                continue
+            elif overwrite:
+                report.count("pattern", "updated")
+                pattern_id = current[0]
+            else:
+                report.conflict(number, "Pattern {0} of {1} is mapped to another environment".format(
+                    pattern, item["app"]))
+                continue
+
+            upsert.append((pattern_id, application_id, pattern, environment_id))
+
+        for chunk in chunks(upsert, TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    INSERT INTO `application_version_patterns`
+                    (`pattern_id`, `application_id`, `pattern`, `pattern_environment`)
+                    VALUES {0}
+                    ON DUPLICATE KEY UPDATE
+                        `pattern_environment`=VALUES(`pattern_environment`);
+                """.format(", ".join(["(%s, %s, %s, %s)"] * len(chunk))),
+                *[value for row in chunk for value in row])
+
+        # patterns carry no revision of their own, the applications they belong to do
+        changed = list({application_id for pattern_id, application_id, pattern, environment_id in upsert})
+
+        for chunk in chunks(changed, TransferModel.IMPORT_CHUNK):
+            await db.execute(
+                """
+                    UPDATE `applications`
+                    SET `application_revision`=%s
+                    WHERE `application_id` IN ({0});
+                """.format(", ".join(["%s"] * len(chunk))), revision, *chunk)
+
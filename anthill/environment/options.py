@@ -38,4 +38,150 @@ define("db_password",
 define("db_name",
        default="dev_environment",
        type=str,
-       help="MySQL database name")
\ No newline at end of file
+       help="MySQL database name")
+# Discovery
+
+define("discover_cache_size",
+       default=10000,
+       type=int,
+       help="Maximum amount of resolved (application, version) environments kept in memory")
+
+define("discover_snapshot",
+       default=True,
+       type=bool,
+       help="Keep a full in-memory routing snapshot so discovery is resolved without the database")
+
+define("discover_snapshot_refresh",
+       default=60,
+       type=int,
+       help="Seconds between periodic routing snapshot rebuilds (0 to rebuild on changes only)")
+
+define("discover_snapshot_path",
+       default="",
+       type=str,
+       help="A file to keep the last loaded routing snapshot in, so the service could answer discovery right after "
+            "a start and through database outages. Empty to disable")
+
+define("discover_missing_cache_time",
+       default=10,
+       type=int,
+       help="Seconds a lookup of an unknown application version is remembered as missing")
+
+define("environment_cache_time",
+       default=600,
+       type=int,
+       help="Seconds environments are cached for; changes made on any instance drop the cache right away")
+
+define("discover_breaker_failures",
+       default=5,
+       type=int,
+       help="Database failures in a row after which discovery stops asking the database for a while, "
+            "and answers with the last known environments instead (0 to never stop)")
+
+define("discover_breaker_latency",
+       default=1.0,
+       type=float,
+       help="Seconds a discovery query could take before it is counted as a failure (0 for no limit)")
+
+define("discover_breaker_reset",
+       default=10,
+       type=int,
+       help="Seconds discovery stops asking the database for, before probing it again")
+
+# Discovery endpoints health
+
+define("endpoint_health_interval",
+       default=10,
+       type=int,
+       help="Seconds between the health checks of the discovery endpoints (of the environments that list "
+            "several), 0 to never check them")
+
+define("endpoint_health_timeout",
+       default=5,
+       type=int,
+       help="Seconds a health check of a discovery endpoint is given")
+
+define("endpoint_health_latency",
+       default=1.0,
+       type=float,
+       help="Seconds a discovery endpoint could take to answer a health check before it counts as failed, "
+            "0 for no limit")
+
+define("endpoint_health_failures",
+       default=3,
+       type=int,
+       help="Failed health checks in a row to stop pointing the clients to a discovery endpoint")
+
+define("endpoint_health_path",
+       default="",
+       type=str,
+       help="What to request from a discovery endpoint url to check its health")
+
+# Regions
+
+define("region_header",
+       default="X-Region",
+       type=str,
+       help="A request header the clients could name their region with (only the regions that override "
+            "something are taken)")
+
+define("region_prefixes_path",
+       default="",
+       type=str,
+       help="A file of \"<network> <region>\" lines to tell the region of a client by its address, "
+            "when the header names none. Empty to rely on the header only")
+
+# Invalidation
+
+define("invalidation_bus",
+       default="local",
+       type=str,
+       help="How change events reach the other instances: local[:channel] (single node), "
+            "or udp:host:port to listen for the events of invalidation_peers (on 127.0.0.1 if host is omitted)")
+
+define("invalidation_peers",
+       default="",
+       type=str,
+       help="Comma-separated host:port list of the other instances to send change events to (for udp bus)")
+
+define("invalidation_secret",
+       default="",
+       type=str,
+       help="A secret shared by the instances to sign the change events with (required for udp bus)")
+
+define("discover_batch_limit",
+       default=100,
+       type=int,
+       help="Maximum amount of application versions resolved by a single batch discovery request")
+
+define("watch_max_timeout",
+       default=60,
+       type=int,
+       help="Most seconds a watch request waits for a change before it is answered with no change")
+
+# Static publishing
+
+define("static_publish_dir",
+       default="",
+       type=str,
+       help="A path to publish every discovery answer at as static files (a symlink swapped on each change), "
+            "for a web server or a CDN to serve them directly. Empty to disable")
+
+define("static_publish_compress_level",
+       default=9,
+       type=int,
+       help="Gzip compression level of the pre-compressed static discovery answers")
+
+# Metrics
+
+define("metrics_token",
+       default="",
+       type=str,
+       help="A secret the scrapers of the /metrics endpoint should pass as 'Authorization: Bearer <token>'. "
+            "Empty to disable the endpoint")
+
+define("metrics_networks",
+       default="127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16",
+       type=str,
+       help="Comma-separated networks allowed to scrape the /metrics endpoint, on top of the token. The address "
+            "is the one of the peer, a load balancer in front would have to be trusted with xheaders")
@@ -8,7 +8,17 @@ from . import options as _opts
 from anthill.common import server, access, database
 
 from . model.environment import EnvironmentModel
+from . model.health import EndpointHealthChecker
 from . model.application import ApplicationsModel
+from . model.breaker import CircuitBreaker
+from . model.bus import create_bus
+from . model.metrics import registry
+from . model.publish import StaticPublisher
+from . model.region import RegionsModel, PrefixIndex
+from . model.store import SnapshotStore
+from . model.transfer import TransferModel
+
+import logging
 
 
 class EnvironmentServer(server.Server):
@@ -21,11 +31,52 @@ class EnvironmentServer(server.Server):
             user=options.db_username,
             password=options.db_password)
 
-        self.environment = EnvironmentModel(self.db)
+        self.bus = create_bus(options.invalidation_bus, options.invalidation_peers, options.invalidation_secret)
+
+        self.environment = EnvironmentModel(
+            self.db,
+            cache_size=options.discover_cache_size,
+            missing_cache_time=options.discover_missing_cache_time,
+            snapshot=options.discover_snapshot,
+            snapshot_refresh=options.discover_snapshot_refresh,
+            environment_cache_time=options.environment_cache_time,
+            bus=self.bus,
+            snapshot_store=SnapshotStore(options.discover_snapshot_path) if options.discover_snapshot_path else None,
+            breaker=CircuitBreaker(
+                "discovery",
+                failures=options.discover_breaker_failures,
+                latency=options.discover_breaker_latency,
+                reset_timeout=options.discover_breaker_reset))
         self.applications = ApplicationsModel(self.db, self.environment)
+        self.regions = RegionsModel(
+            self.db, self.environment,
+            prefixes=PrefixIndex.load(options.region_prefixes_path) if options.region_prefixes_path else None)
+        self.transfer = TransferModel(self.db, self.environment, self.regions)
+        self.health = EndpointHealthChecker(
+            self.environment,
+            interval=options.endpoint_health_interval,
+            timeout=options.endpoint_health_timeout,
+            max_latency=options.endpoint_health_latency,
+            failures=options.endpoint_health_failures,
+            path=options.endpoint_health_path)
+
+        self.publisher = None
+
+        if options.static_publish_dir and not options.discover_snapshot:
+            logging.warning("Static discovery is not published: it requires discover_snapshot to be enabled")
+        elif options.static_publish_dir:
+            self.publisher = StaticPublisher(
+                options.static_publish_dir,
+                compress_level=options.static_publish_compress_level)
+            self.environment.add_snapshot_listener(self.publisher.schedule)
+
+        self.environment.register_metrics(registry)
+
+        # before anything touches the database, so discovery is answered as soon as the server listens
+        self.environment.load_stored_snapshot()
 
     def get_models(self):
-        return [self.environment, self.applications]
+        return [self.environment, self.regions, self.applications, self.transfer, self.health]
 
     def get_admin(self):
         return {
@@ -35,8 +86,13 @@ class EnvironmentServer(server.Server):
             "new_app": admin.NewApplicationController,
             "app_version": admin.ApplicationVersionController,
             "new_app_version": admin.NewApplicationVersionController,
+            "app_pattern": admin.VersionPatternController,
+            "new_app_pattern": admin.NewVersionPatternController,
+            "move_versions": admin.MoveVersionsController,
             "envs": admin.EnvironmentsController,
             "environment": admin.EnvironmentController,
+            "env_region": admin.EnvironmentRegionController,
+            "new_env_region": admin.NewEnvironmentRegionController,
             "new_env": admin.NewEnvironmentController,
             "vars": admin.EnvironmentVariablesController,
         }
@@ -53,6 +109,12 @@ class EnvironmentServer(server.Server):
 
     def get_handlers(self):
         return [
+            (r"/batch", h.BatchDiscoverHandler),
+            (r"/metrics", h.MetricsHandler),
+            (r"/export", h.ExportHandler),
+            (r"/import", h.ImportHandler),
+            (r"/watch", h.WatchHandler),
+            (r"/watch/(.*)/(.*)", h.WatchHandler),
             (r"/(.*)/(.*)", h.DiscoverHandler),
         ]
 
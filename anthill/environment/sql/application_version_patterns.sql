@@ -0,0 +1,11 @@
+CREATE TABLE `application_version_patterns` (
+  `pattern_id` int(11) NOT NULL AUTO_INCREMENT,
+  `application_id` int(11) NOT NULL,
+  `pattern` varchar(64) NOT NULL,
+  `pattern_environment` int(11) NOT NULL,
+  PRIMARY KEY (`pattern_id`),
+  KEY `pattern_app_idx` (`application_id`),
+  KEY `pattern_env_idx` (`pattern_environment`),
+  CONSTRAINT `application_version_patterns_ibfk_1` FOREIGN KEY (`application_id`) REFERENCES `applications` (`application_id`) ON DELETE CASCADE,
+  CONSTRAINT `application_version_patterns_ibfk_2` FOREIGN KEY (`pattern_environment`) REFERENCES `environments` (`environment_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
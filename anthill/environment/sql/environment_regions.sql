@@ -0,0 +1,10 @@
+CREATE TABLE `environment_regions` (
+  `region_id` int(11) NOT NULL AUTO_INCREMENT,
+  `environment_id` int(11) NOT NULL,
+  `region_name` varchar(45) NOT NULL,
+  `region_discovery` varchar(1024) NOT NULL DEFAULT '',
+  `region_data` json NOT NULL,
+  PRIMARY KEY (`region_id`),
+  UNIQUE KEY `environment_region_UNIQUE` (`environment_id`,`region_name`),
+  CONSTRAINT `environment_regions_ibfk_1` FOREIGN KEY (`environment_id`) REFERENCES `environments` (`environment_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
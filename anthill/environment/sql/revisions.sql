@@ -0,0 +1,5 @@
+CREATE TABLE `revisions` (
+  `key` int(11) NOT NULL DEFAULT '1',
+  `revision` bigint(20) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Generates a synthetic catalogue of applications, versions and environments, and fills a FakeDatabase with it.
+The same seed always gives the same catalogue, so the runs could be compared to each other.
+"""
+
+from anthill.environment.model.application import DEFAULT
+
+import random
+import string
+import ujson
+
+
+class Catalogue(object):
+    def __init__(self, apps, versions, environments, data_size, seed=1):
+        """
+        :param apps: amount of applications
+        :param versions: amount of versions per application
+        :param environments: amount of environments
+        :param data_size: approximate size, in bytes, of each environment's variables
+        """
+
+        self.apps = apps
+        self.versions = versions
+        self.environments = environments
+        self.data_size = data_size
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def app_name(index):
+        return "game{0}".format(index)
+
+    @staticmethod
+    def version_name(index):
+        return "{0}.{1}.{2}".format(index // 10000, (index // 100) % 100, index % 100)
+
+    def environment_data(self):
+        """
+        Looks like what the games keep there: urls, identifiers, flags and a few nested lists.
+        """
+
+        data = {}
+        size = 2
+
+        while size < self.data_size:
+            key = "option-{0}".format(len(data))
+            kind = self.random.randint(0, 3)
+
+            if kind == 0:
+                value = "https://{0}.example.com/{1}".format(
+                    "".join(self.random.choices(string.ascii_lowercase, k=8)),
+                    "".join(self.random.choices(string.ascii_lowercase, k=16)))
+            elif kind == 1:
+                value = self.random.randint(0, 1 << 31)
+            elif kind == 2:
+                value = self.random.random() < 0.5
+            else:
+                value = ["".join(self.random.choices(string.ascii_letters, k=12)) for _ in range(8)]
+
+            data[key] = value
+            size += len(ujson.dumps({key: value}))
+
+        return data
+
+    def populate(self, db):
+        """
+        Fills up the FakeDatabase. Every application also gets a default version.
+        """
+
+        db.bulk(
+            """
+                INSERT INTO `environments`
+                (`environment_id`, `environment_name`, `environment_discovery`, `environment_data`)
+                VALUES (%s, %s, %s, %s);
+            """,
+            [
+                (env_id, "env{0}".format(env_id), "http://discovery-{0}.example.com".format(env_id),
+                 ujson.dumps(self.environment_data()))
+                for env_id in range(1, self.environments + 1)
+            ])
+
+        db.bulk(
+            """
+                INSERT INTO `applications`
+                (`application_id`, `application_name`, `application_title`)
+                VALUES (%s, %s, %s);
+            """,
+            [
+                (app_id, Catalogue.app_name(app_id), "Game {0}".format(app_id))
+                for app_id in range(1, self.apps + 1)
+            ])
+
+        def versions():
+            for app_id in range(1, self.apps + 1):
+                yield (app_id, DEFAULT, 1)
+
+                for index in range(self.versions):
+                    yield (app_id, Catalogue.version_name(index), self.random.randint(1, self.environments))
+
+        db.bulk(
+            """
+                INSERT INTO `application_versions`
+                (`application_id`, `version_name`, `version_environment`)
+                VALUES (%s, %s, %s);
+            """, versions())
+
+        db.bulk(
+            """
+                INSERT INTO `scheme`
+                (`key`, `data`)
+                VALUES (%s, %s);
+            """, [(1, ujson.dumps({"type": "object"}))])
+
+    def lookups(self, count, miss_ratio=0.0):
+        """
+        Returns a list of (app_name, app_version) to look up, a miss_ratio of them being unknown versions
+        (which resolve to the default version).
+        """
+
+        result = []
+
+        for _ in range(count):
+            app_name = Catalogue.app_name(self.random.randint(1, self.apps))
+
+            if self.random.random() < miss_ratio:
+                result.append((app_name, "999.{0}".format(self.random.randint(0, 1 << 20))))
+            else:
+                result.append((app_name, Catalogue.version_name(self.random.randint(0, self.versions - 1))))
+
+        return result
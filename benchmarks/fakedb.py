@@ -0,0 +1,204 @@
+"""
+An in-memory stand-in for anthill.common.database.Database, backed by sqlite, so the models could be
+benchmarked without a MySQL server.
+
+The MySQL dialect the models use is translated on the fly (placeholders, ON DUPLICATE KEY UPDATE,
+FOR UPDATE, LIKE escaping, LAST_INSERT_ID(expr)), and json columns are decoded the same way the real driver does.
+Multi-table updates are not supported.
+Every call can be given an artificial latency, to see how the service behaves with a remote database.
+
+Transactions are not isolated: everything is committed right away, which is fine for reading benchmarks.
+"""
+
+from anthill.common.database import DatabaseError, DuplicateError
+
+import asyncio
+import re
+import sqlite3
+import ujson
+
+
+SCHEMA = """
+    CREATE TABLE `applications` (
+        `application_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `application_name` VARCHAR(45) NOT NULL UNIQUE,
+        `application_title` VARCHAR(128) NOT NULL,
+        `min_api` VARCHAR(8) NOT NULL DEFAULT '0.1',
+        `application_revision` BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE `environments` (
+        `environment_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `environment_name` VARCHAR(45) NOT NULL UNIQUE,
+        `environment_discovery` VARCHAR(1024) NOT NULL,
+        `environment_data` JSON NOT NULL,
+        `environment_revision` BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE `environment_regions` (
+        `region_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `environment_id` INTEGER NOT NULL REFERENCES `environments` (`environment_id`) ON DELETE CASCADE,
+        `region_name` VARCHAR(45) NOT NULL,
+        `region_discovery` VARCHAR(1024) NOT NULL DEFAULT '',
+        `region_data` JSON NOT NULL,
+        UNIQUE (`environment_id`, `region_name`)
+    );
+    CREATE TABLE `application_versions` (
+        `version_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `application_id` INTEGER NOT NULL REFERENCES `applications` (`application_id`) ON DELETE CASCADE,
+        `version_name` VARCHAR(45) NOT NULL,
+        `version_environment` INTEGER NOT NULL REFERENCES `environments` (`environment_id`) ON DELETE CASCADE,
+        `version_revision` BIGINT NOT NULL DEFAULT 0
+    );
+    CREATE INDEX `app_version_name_idx` ON `application_versions` (`application_id`, `version_name`);
+    CREATE INDEX `app_env_idx` ON `application_versions` (`version_environment`);
+    CREATE TABLE `application_version_patterns` (
+        `pattern_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `application_id` INTEGER NOT NULL REFERENCES `applications` (`application_id`) ON DELETE CASCADE,
+        `pattern` VARCHAR(64) NOT NULL,
+        `pattern_environment` INTEGER NOT NULL REFERENCES `environments` (`environment_id`) ON DELETE CASCADE
+    );
+    CREATE INDEX `pattern_app_idx` ON `application_version_patterns` (`application_id`);
+    CREATE TABLE `scheme` (
+        -- not INTEGER, or it would become the rowid and ignore the default
+        `key` INT NOT NULL DEFAULT 1 PRIMARY KEY,
+        `data` JSON NOT NULL
+    );
+    CREATE TABLE `revisions` (
+        `key` INT NOT NULL DEFAULT 1 PRIMARY KEY,
+        `revision` BIGINT NOT NULL DEFAULT 0
+    );
+"""
+
+# the columns the real driver returns decoded
+JSON_COLUMNS = {"environment_data", "region_data", "data"}
+
+ON_DUPLICATE = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE", re.IGNORECASE)
+VALUES_OF = re.compile(r"VALUES\((`\w+`)\)", re.IGNORECASE)
+FOR_UPDATE = re.compile(r"FOR\s+UPDATE", re.IGNORECASE)
+LIKE = re.compile(r"LIKE\s+%s", re.IGNORECASE)
+
+
+def translate(sql):
+    """
+    Turns a MySQL query of the models into a sqlite one.
+    """
+
+    sql = ON_DUPLICATE.sub("ON CONFLICT DO UPDATE SET", sql)
+    sql = VALUES_OF.sub(r"excluded.\1", sql)
+    sql = FOR_UPDATE.sub("", sql)
+    sql = LIKE.sub(r"LIKE %s ESCAPE '\\'", sql)
+    return sql.replace("%s", "?")
+
+
+def decode(cursor, row):
+    result = {}
+
+    for (name, *_), value in zip(cursor.description, row):
+        if name in JSON_COLUMNS and isinstance(value, str):
+            value = ujson.loads(value)
+        result[name] = value
+
+    return result
+
+
+class FakeConnection(object):
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, sql, *args):
+        return await self.db.get(sql, *args)
+
+    async def query(self, sql, *args):
+        return await self.db.query(sql, *args)
+
+    async def insert(self, sql, *args):
+        return await self.db.insert(sql, *args)
+
+    async def execute(self, sql, *args):
+        return await self.db.execute(sql, *args)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeAcquire(object):
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return FakeConnection(self.db)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class FakeDatabase(object):
+    """
+    :param latency: seconds every call waits for before it is executed
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = 0
+        # what LAST_INSERT_ID(expr) has been given during the current call, returned by insert() as MySQL does
+        self.last_insert_id = None
+
+        self.connection = sqlite3.connect(":memory:", isolation_level=None)
+        self.connection.row_factory = decode
+        self.connection.execute("PRAGMA foreign_keys=ON;")
+        self.connection.create_function("LAST_INSERT_ID", 1, self.__last_insert_id)
+        self.connection.executescript(SCHEMA)
+
+    def acquire(self, auto_commit=True):
+        return FakeAcquire(self)
+
+    def __last_insert_id(self, value):
+        self.last_insert_id = value
+        return value
+
+    async def __run(self, sql, args):
+        self.calls += 1
+        self.last_insert_id = None
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        try:
+            return self.connection.execute(translate(sql), args)
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" in str(e):
+                raise DuplicateError(1062, str(e))
+            raise DatabaseError(1452, str(e))
+        except sqlite3.Error as e:
+            raise DatabaseError(1064, str(e))
+
+    async def get(self, sql, *args):
+        cursor = await self.__run(sql, args)
+        return cursor.fetchone()
+
+    async def query(self, sql, *args):
+        cursor = await self.__run(sql, args)
+        return cursor.fetchall()
+
+    async def insert(self, sql, *args):
+        cursor = await self.__run(sql, args)
+
+        if self.last_insert_id is not None:
+            return self.last_insert_id
+
+        return cursor.lastrowid
+
+    async def execute(self, sql, *args):
+        cursor = await self.__run(sql, args)
+        return cursor.rowcount
+
+    def bulk(self, sql, rows):
+        """
+        Inserts a lot of rows at once, bypassing the latency, for filling up the catalogue.
+        """
+
+        self.connection.execute("BEGIN;")
+        self.connection.executemany(translate(sql), rows)
+        self.connection.execute("COMMIT;")
@@ -0,0 +1,161 @@
+"""
+HTTP load benchmark of the environment service, running entirely offline against a FakeDatabase.
+
+    python -m benchmarks.http_bench --apps 100 --versions 50 --environments 5 --latency 0.001
+
+Reports requests per second and p50/p99 latency of:
+    discover           GET /<app>/<version> over HTTP, as the game clients do
+    batch              POST /batch over HTTP
+    get_app_info       the internal get_app_info call, as other services make it
+    admin:*            what the admin pages of applications, an application and environments fetch
+
+The load is generated from the same process the service runs in, so the numbers are lower than a dedicated
+machine would give, yet they are comparable between the runs with the same arguments.
+"""
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+
+from anthill.environment import options as _opts
+from anthill.environment.admin import ITEMS_PER_PAGE
+from anthill.environment.handler import InternalHandler
+from anthill.environment.model.application import ApplicationsModel
+from anthill.environment.model.environment import EnvironmentModel
+from anthill.environment.model.region import RegionsModel
+from anthill.environment.server import EnvironmentServer
+
+from . catalogue import Catalogue
+from . fakedb import FakeDatabase
+from . stats import measure, report
+
+import argparse
+import functools
+import ujson
+
+
+class BenchmarkApplication(Application):
+    """
+    The service with the same models and routes as EnvironmentServer has, minus everything that needs
+    other services to be around (authentication, discovery registration).
+    """
+
+    def __init__(self, db, snapshot):
+        self.db = db
+        self.environment = EnvironmentModel(db, snapshot=snapshot, snapshot_refresh=0)
+        self.applications = ApplicationsModel(db, self.environment)
+        self.regions = RegionsModel(db, self.environment)
+
+        super(BenchmarkApplication, self).__init__(EnvironmentServer.get_handlers(self))
+
+    async def start(self):
+        await self.regions.regions_changed(publish=False)
+
+        if self.environment.snapshot_enabled:
+            await self.environment.reload_snapshot()
+        else:
+            await self.environment.applications_changed(publish=False)
+
+
+async def discover(client, url):
+    response = await client.fetch(url, raise_error=False)
+
+    if response.code != 200:
+        raise Exception("Unexpected response: {0}".format(response.code))
+
+
+async def batch(client, url, versions):
+    await client.fetch(url, method="POST", body="versions=" + ujson.dumps(versions))
+
+
+async def run(args):
+    db = FakeDatabase()
+    catalogue = Catalogue(args.apps, args.versions, args.environments, args.data_size, seed=args.seed)
+    catalogue.populate(db)
+
+    # the catalogue is filled up instantly, the latency only applies to the service
+    db.latency = args.latency
+
+    application = BenchmarkApplication(db, snapshot=args.snapshot)
+    await application.start()
+
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(application)
+    server.add_sockets(sockets)
+
+    base = "http://127.0.0.1:{0}".format(port)
+    client = AsyncHTTPClient(max_clients=args.concurrency)
+    internal = InternalHandler(application)
+
+    lookups = catalogue.lookups(args.requests, miss_ratio=args.miss_ratio)
+    results = []
+
+    try:
+        results.append(await measure("discover", [
+            functools.partial(discover, client, "{0}/{1}/{2}".format(base, app_name, app_version))
+            for app_name, app_version in lookups
+        ], args.concurrency))
+
+        results.append(await measure("batch ({0} versions)".format(args.batch_size), [
+            functools.partial(batch, client, base + "/batch", [
+                [app_name, app_version] for app_name, app_version in lookups[index:index + args.batch_size]
+            ])
+            for index in range(0, len(lookups), args.batch_size)
+        ], args.concurrency))
+
+        results.append(await measure("get_app_info", [
+            functools.partial(internal.get_app_info, app_name)
+            for app_name, app_version in lookups[:args.internal_requests]
+        ], args.concurrency))
+
+        results.append(await measure("admin:applications", [
+            functools.partial(application.applications.list_applications, limit=ITEMS_PER_PAGE)
+        ] * args.admin_requests, args.concurrency))
+
+        results.append(await measure("admin:application", [
+            functools.partial(application.applications.list_application_versions,
+                              (index % args.apps) + 1, limit=ITEMS_PER_PAGE)
+            for index in range(args.admin_requests)
+        ], args.concurrency))
+
+        results.append(await measure("admin:environments", [
+            application.environment.list_environments
+        ] * args.admin_requests, args.concurrency))
+    finally:
+        client.close()
+        server.stop()
+
+    report(results, as_json=args.json)
+
+    if not args.json:
+        print("database calls: {0}".format(db.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load benchmark of the environment service")
+    parser.add_argument("--apps", type=int, default=100)
+    parser.add_argument("--versions", type=int, default=50, help="versions per application")
+    parser.add_argument("--environments", type=int, default=5)
+    parser.add_argument("--data-size", type=int, default=4096, help="bytes of variables per environment")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every database call takes")
+    parser.add_argument("--requests", type=int, default=20000, help="discovery requests")
+    parser.add_argument("--internal-requests", type=int, default=2000)
+    parser.add_argument("--admin-requests", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--miss-ratio", type=float, default=0.05,
+                        help="fraction of versions that are not defined (and resolve to the default)")
+    parser.add_argument("--no-snapshot", dest="snapshot", action="store_false",
+                        help="resolve with the caches and the database instead of the routing snapshot")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the results as json, for the CI")
+
+    args = parser.parse_args()
+    IOLoop.current().run_sync(functools.partial(run, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Data-scale benchmark of the model layer, driving EnvironmentModel and ApplicationsModel directly
+against a FakeDatabase, without any HTTP in between.
+
+    python -m benchmarks.model_bench --apps 10000 --versions 100 --environments 20 --data-size 262144
+
+Reports the time per call, and the peak memory allocated while all the calls of a benchmark run, for:
+    list_applications, list_application_versions, list_environments     (the admin listings)
+    get_version_environment                                             (cold, then cached)
+    reload_snapshot                                                     (the whole routing snapshot)
+
+With --profile DIR every benchmark is also run under cProfile, its stats are saved into DIR/<name>.prof
+and the top functions are printed. With --tracemalloc N the top N allocation sites of each benchmark
+are printed.
+"""
+
+from tornado.ioloop import IOLoop
+
+from anthill.environment.admin import ITEMS_PER_PAGE
+from anthill.environment.model.application import ApplicationsModel
+from anthill.environment.model.environment import EnvironmentModel
+
+from . catalogue import Catalogue
+from . fakedb import FakeDatabase
+
+import argparse
+import cProfile
+import functools
+import os
+import pstats
+import time
+import tracemalloc
+import ujson
+
+
+class Measurement(object):
+    def __init__(self, name, calls, elapsed, peak, top=None):
+        self.name = name
+        self.calls = calls
+        self.elapsed = elapsed
+        self.peak = peak
+        self.top = top or []
+
+    def dump(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "total_s": round(self.elapsed, 4),
+            "per_call_ms": round(self.elapsed / self.calls * 1000, 4) if self.calls else 0,
+            "peak_mb": round(self.peak / (1024 * 1024), 2)
+        }
+
+
+async def run_calls(calls, reset):
+    if reset is not None:
+        await reset()
+
+    for call in calls:
+        await call()
+
+
+async def measure(name, calls, args, reset=None):
+    """
+    Runs the calls three times: for the time, under tracemalloc for the peak memory (it slows everything
+    down too much to measure the time along), and under cProfile if asked to.
+    The reset coroutine, if given, is called before each run (and is not measured).
+    """
+
+    if reset is not None:
+        await reset()
+
+    started = time.perf_counter()
+    await run_calls(calls, None)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+
+    try:
+        await run_calls(calls, reset)
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+    finally:
+        tracemalloc.stop()
+
+    top = []
+
+    if snapshot is not None:
+        top = [str(stat) for stat in snapshot.statistics("lineno")[:args.tracemalloc]]
+
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+
+        try:
+            await run_calls(calls, reset)
+        finally:
+            profile.disable()
+
+        os.makedirs(args.profile, exist_ok=True)
+        profile.dump_stats(os.path.join(args.profile, name.replace(" ", "_") + ".prof"))
+
+        if not args.json:
+            print("== " + name)
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(15)
+
+    return Measurement(name, len(calls), elapsed, peak, top)
+
+
+async def run(args):
+    db = FakeDatabase()
+
+    started = time.perf_counter()
+    catalogue = Catalogue(args.apps, args.versions, args.environments, args.data_size, seed=args.seed)
+    catalogue.populate(db)
+
+    if not args.json:
+        print("catalogue of {0} applications, {1} versions, {2} environments populated in {3:.1f}s".format(
+            args.apps, args.apps * args.versions, args.environments, time.perf_counter() - started))
+
+    db.latency = args.latency
+
+    # the snapshot is only built when measured, so the lookups below go through the caches and the database
+    environment = EnvironmentModel(db, cache_size=args.lookups, snapshot=False, snapshot_refresh=0)
+    applications = ApplicationsModel(db, environment)
+
+    lookups = list(dict.fromkeys(catalogue.lookups(args.lookups)))
+    results = []
+
+    async def drop_environments():
+        await environment.environments_changed(publish=False)
+
+    async def drop_versions():
+        environment.versions_cache.clear()
+        environment.missing_cache.clear()
+        environment.patterns_cache.clear()
+
+    results.append(await measure("list_applications (all)", [
+        applications.list_applications
+    ], args))
+
+    results.append(await measure("list_applications (page)", [
+        functools.partial(applications.list_applications, limit=ITEMS_PER_PAGE)
+    ] * args.repeat, args))
+
+    results.append(await measure("list_application_versions", [
+        functools.partial(applications.list_application_versions, (index % args.apps) + 1)
+        for index in range(args.repeat)
+    ], args))
+
+    # not cached, so the decoding of the payloads is measured
+    results.append(await measure("list_environments", [
+        environment.list_environments
+    ], args, reset=drop_environments))
+
+    results.append(await measure("get_version_environment (cold)", [
+        functools.partial(environment.get_version_environment, app_name, app_version)
+        for app_name, app_version in lookups
+    ], args, reset=drop_versions))
+
+    results.append(await measure("get_version_environment (cached)", [
+        functools.partial(environment.get_version_environment, app_name, app_version)
+        for app_name, app_version in lookups
+    ], args))
+
+    environment.snapshot_enabled = True
+
+    results.append(await measure("reload_snapshot", [
+        environment.reload_snapshot
+    ], args))
+
+    if args.json:
+        print(ujson.dumps([result.dump() for result in results]))
+        return
+
+    print("{0:<36} {1:>8} {2:>12} {3:>14} {4:>10}".format("benchmark", "calls", "total s", "per call ms", "peak MB"))
+
+    for result in results:
+        print("{name:<36} {calls:>8} {total_s:>12} {per_call_ms:>14} {peak_mb:>10}".format(**result.dump()))
+
+        for line in result.top:
+            print("    " + line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-scale benchmark of the environment models")
+    parser.add_argument("--apps", type=int, default=10000)
+    parser.add_argument("--versions", type=int, default=100, help="versions per application")
+    parser.add_argument("--environments", type=int, default=20)
+    parser.add_argument("--data-size", type=int, default=256 * 1024, help="bytes of variables per environment")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every database call takes")
+    parser.add_argument("--lookups", type=int, default=10000, help="distinct versions to look up")
+    parser.add_argument("--repeat", type=int, default=100, help="calls of the paged listings")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", metavar="DIR", help="save cProfile stats of each benchmark into DIR")
+    parser.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                        help="print the top N allocation sites of each benchmark")
+    parser.add_argument("--json", action="store_true", help="print the results as json, for the CI")
+
+    args = parser.parse_args()
+    IOLoop.current().run_sync(functools.partial(run, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Running a workload with a given concurrency, and reporting the throughput and latency percentiles of it.
+"""
+
+import asyncio
+import time
+import ujson
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Result(object):
+    def __init__(self, name, latencies, errors, elapsed):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def dump(self):
+        return {
+            "name": self.name,
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "rps": round(len(self.latencies) / self.elapsed, 1) if self.elapsed else 0,
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 3)
+        }
+
+
+async def measure(name, calls, concurrency):
+    """
+    Runs every call (a coroutine function with no arguments) with up to 'concurrency' of them at a time.
+    A call that raises is counted as an error, its latency is counted all the same.
+    """
+
+    pending = iter(calls)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+
+        for call in pending:
+            started = time.perf_counter()
+
+            try:
+                await call()
+            except Exception:
+                errors += 1
+
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    return Result(name, latencies, errors, time.perf_counter() - started)
+
+
+def report(results, as_json=False):
+    if as_json:
+        print(ujson.dumps([result.dump() for result in results]))
+        return
+
+    print("{0:<32} {1:>10} {2:>8} {3:>12} {4:>10} {5:>10}".format(
+        "benchmark", "requests", "errors", "rps", "p50 ms", "p99 ms"))
+
+    for result in results:
+        dump = result.dump()
+        print("{name:<32} {requests:>10} {errors:>8} {rps:>12} {p50_ms:>10} {p99_ms:>10}".format(**dump))
@@ -2,7 +2,8 @@
 from setuptools import setup, find_namespace_packages
 
 DEPENDENCIES = [
-    "anthill-common>=0.2.5"
+    "anthill-common>=0.2.5",
+    "jsonschema"
 ]
 
 setup(
@@ -20,5 +21,9 @@ setup(
     include_package_data=True,
     packages=find_namespace_packages(include=["anthill.*"]),
     zip_safe=False,
-    install_requires=DEPENDENCIES
+    install_requires=DEPENDENCIES,
+    extras_require={
+        # brotli compressed and msgpack encoded discovery answers
+        "encodings": ["brotli", "msgpack"]
+    }
 )
@@ -0,0 +1,106 @@
+from anthill.environment.model.breaker import CircuitBreaker
+
+from unittest import mock
+
+import unittest
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("anthill.environment.model.breaker.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.breaker = CircuitBreaker("test", failures=3, latency=1.0, reset_timeout=10)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+
+    def test_opens_after_failures_in_a_row(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        self.fail(2)
+        self.breaker.success(0.1)
+        self.fail(2)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_success_is_failure(self):
+        for _ in range(3):
+            self.breaker.success(1.5)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_probe_closes(self):
+        self.fail(3)
+
+        self.clock.now += 9
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # only a single probe is let through
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.success(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_again(self):
+        self.fail(3)
+
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_probe(self):
+        self.fail(3)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+
+        # the probe never reports back, another one is let through after a while
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+
+    def test_never_opens(self):
+        breaker = CircuitBreaker("test", failures=0)
+
+        for _ in range(100):
+            breaker.failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_no_latency_limit(self):
+        breaker = CircuitBreaker("test", failures=1, latency=0)
+        breaker.success(100)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from anthill.environment.model.cache import LRUCache
+
+from unittest import mock
+
+import unittest
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", "default"), "default")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # "a" is used, so "b" is the least recently used one now
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_put_refreshes(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 10)
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), 10)
+        self.assertIsNone(cache.get("b"))
+
+    def test_no_size(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get("a"))
+
+    def test_ttl(self):
+        clock = Clock()
+
+        with mock.patch("anthill.environment.model.cache.time", clock):
+            cache = LRUCache(10, ttl=5)
+            cache.put("a", 1)
+
+            clock.now += 5
+            self.assertEqual(cache.get("a"), 1)
+
+            clock.now += 0.1
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.evictions, 1)
+
+            # put again, it lives for another ttl
+            cache.put("a", 2)
+            clock.now += 3
+            self.assertEqual(cache.get("a"), 2)
+
+    def test_remove(self):
+        cache = LRUCache(10, ttl=5)
+        cache.put("a", 1)
+        cache.remove("a")
+        cache.remove("missing")
+
+        self.assertIsNone(cache.get("a"))
+
+    def test_remove_if(self):
+        for ttl in (None, 5):
+            cache = LRUCache(10, ttl=ttl)
+
+            for key in range(6):
+                cache.put(key, key * 10)
+
+            self.assertEqual(cache.remove_if(lambda key, value: value >= 30), 3)
+            self.assertEqual(sorted(cache.entries), [0, 1, 2])
+            self.assertEqual(cache.get(2), 20)
+
+    def test_clear(self):
+        cache = LRUCache(10)
+        cache.put("a", 1)
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
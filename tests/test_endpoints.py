@@ -0,0 +1,85 @@
+from anthill.environment.model.endpoints import parse_endpoints, read_endpoints, select_endpoint, EndpointsInvalid
+
+import collections
+import unittest
+
+
+class ParseEndpointsTestCase(unittest.TestCase):
+    def test_single(self):
+        endpoints = parse_endpoints("http://discovery")
+
+        self.assertEqual([(e.url, e.weight) for e in endpoints], [("http://discovery", 1)])
+
+    def test_weighted(self):
+        endpoints = parse_endpoints("http://a 3, http://b 1,http://c")
+
+        self.assertEqual([(e.url, e.weight) for e in endpoints], [("http://a", 3), ("http://b", 1), ("http://c", 1)])
+
+    def test_malformed(self):
+        for discovery in ["", "  ", None, "http://a,", "http://a 1 2", "http://a x", "http://a 0",
+                          "http://a 1001", "http://a, http://a", "http://" + "a" * 1024]:
+            with self.assertRaises(EndpointsInvalid, msg=repr(discovery)):
+                parse_endpoints(discovery)
+
+    def test_read_stored(self):
+        self.assertEqual([e.url for e in read_endpoints("http://a, http://b")], ["http://a", "http://b"])
+        # stored before the lists were supported, taken as it is
+        self.assertEqual([e.url for e in read_endpoints("http://a 0")], ["http://a 0"])
+
+
+class SelectEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.endpoints = parse_endpoints("http://a 3, http://b 1, http://c 1")
+
+    def test_single(self):
+        endpoints = parse_endpoints("http://a")
+
+        self.assertIs(select_endpoint(endpoints, "client"), endpoints[0])
+        self.assertIs(select_endpoint(endpoints, "client", exclude={"http://a"}), endpoints[0])
+
+    def test_stable(self):
+        for client in range(100):
+            client_id = "client-{0}".format(client)
+            picked = select_endpoint(self.endpoints, client_id).url
+
+            for _ in range(3):
+                self.assertEqual(select_endpoint(self.endpoints, client_id).url, picked)
+
+            # the order the endpoints are listed in does not matter
+            self.assertEqual(select_endpoint(list(reversed(self.endpoints)), client_id).url, picked)
+
+    def test_weights(self):
+        picked = collections.Counter(
+            select_endpoint(self.endpoints, "client-{0}".format(client)).url
+            for client in range(5000))
+
+        # 3:1:1, give or take
+        self.assertAlmostEqual(picked["http://a"] / 5000, 0.6, delta=0.05)
+        self.assertAlmostEqual(picked["http://b"] / 5000, 0.2, delta=0.05)
+        self.assertAlmostEqual(picked["http://c"] / 5000, 0.2, delta=0.05)
+
+    def test_exclude_moves_only_its_clients(self):
+        for client in range(500):
+            client_id = "client-{0}".format(client)
+            before = select_endpoint(self.endpoints, client_id).url
+            after = select_endpoint(self.endpoints, client_id, exclude={"http://b"}).url
+
+            self.assertNotEqual(after, "http://b")
+
+            if before != "http://b":
+                self.assertEqual(after, before)
+
+    def test_exclude_everything(self):
+        urls = {e.url for e in self.endpoints}
+
+        self.assertIn(select_endpoint(self.endpoints, "client", exclude=urls).url, urls)
+
+    def test_random(self):
+        urls = {e.url for e in self.endpoints}
+
+        for _ in range(50):
+            self.assertIn(select_endpoint(self.endpoints, exclude={"http://a"}).url, urls - {"http://a"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+from anthill.environment.model.matcher import parse_version, parse_pattern, VersionMatcher, VersionPatternError
+
+import unittest
+
+
+class ParseVersionTestCase(unittest.TestCase):
+    def test_numeric(self):
+        self.assertEqual(parse_version("1.4.2"), (1, 4, 2))
+        self.assertEqual(parse_version("10"), (10, ))
+
+    def test_trailing_zeroes(self):
+        self.assertEqual(parse_version("2"), parse_version("2.0"))
+        self.assertEqual(parse_version("2.0.0"), (2, ))
+        self.assertEqual(parse_version("0"), ())
+
+    def test_not_numeric(self):
+        for version in ["", "1.", ".1", "1..2", "1.0a", "beta", "1.0\n", " 1.0", "-1"]:
+            self.assertIsNone(parse_version(version), version)
+
+    def test_unicode_digits(self):
+        for version in ["²", "1.²", "١.٢", "１.0"]:
+            self.assertIsNone(parse_version(version), version)
+
+
+class ParsePatternTestCase(unittest.TestCase):
+    def test_wildcard(self):
+        low, high = parse_pattern("1.4.*")
+        self.assertEqual(low, ((1, 4), 0))
+        self.assertEqual(high, ((1, 5), 0))
+
+    def test_wildcard_of_zero(self):
+        low, high = parse_pattern("1.0.*")
+        self.assertEqual(low, ((1, ), 0))
+        self.assertEqual(high, ((1, 1), 0))
+
+    def test_range(self):
+        low, high = parse_pattern(">=2.0 <2.3")
+        self.assertEqual(low, ((2, ), 0))
+        self.assertEqual(high, ((2, 3), 0))
+
+    def test_exact(self):
+        low, high = parse_pattern("=1.2")
+        self.assertEqual(low, ((1, 2), 0))
+        self.assertEqual(high, ((1, 2), 1))
+
+    def test_everything(self):
+        low, high = parse_pattern("*")
+        self.assertLess(low, ((0, ), 0))
+        self.assertGreater(high, ((10 ** 9, ), 0))
+
+    def test_malformed(self):
+        for pattern in ["", "  ", "a.*", ".*", "1.x", ">=1.0 <", "=>1.0", "²", "².*", "1.²", ">=²", "1.0\n.*"]:
+            with self.assertRaises(VersionPatternError, msg=pattern):
+                parse_pattern(pattern)
+
+    def test_empty_range(self):
+        with self.assertRaises(VersionPatternError):
+            parse_pattern(">2.0 <2.0")
+
+
+class VersionMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.matcher = VersionMatcher([
+            ("1.4.*", "old"),
+            (">=2.0 <2.3", "current"),
+            ("=3", "next")
+        ])
+
+    def test_match(self):
+        self.assertEqual(self.matcher.match("1.4"), "old")
+        self.assertEqual(self.matcher.match("1.4.99"), "old")
+        self.assertEqual(self.matcher.match("2.0"), "current")
+        self.assertEqual(self.matcher.match("2.2.9"), "current")
+        self.assertEqual(self.matcher.match("3.0.0"), "next")
+
+    def test_no_match(self):
+        for version in ["1.3", "1.5", "2.3", "3.1", "0"]:
+            self.assertIsNone(self.matcher.match(version), version)
+
+    def test_not_a_version(self):
+        for version in ["", "beta", "²", "2.²", "١"]:
+            self.assertIsNone(self.matcher.match(version), version)
+
+    def test_empty(self):
+        self.assertIsNone(VersionMatcher([]).match("1.0"))
+
+    def test_conflicts(self):
+        matcher = VersionMatcher([("1.*", "a"), ("1.4.*", "b"), ("2.*", "c")])
+        self.assertEqual(matcher.conflicts, [("1.4.*", "1.*")])
+        self.assertEqual(matcher.match("1.4"), "a")
+        self.assertEqual(matcher.match("2.1"), "c")
+
+    def test_errors(self):
+        matcher = VersionMatcher([("².*", "a"), ("1.*", "b")])
+        self.assertEqual(len(matcher.errors), 1)
+        self.assertEqual(matcher.match("1.2"), "b")
+
+
+if __name__ == "__main__":
+    unittest.main()
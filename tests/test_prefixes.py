@@ -0,0 +1,86 @@
+from anthill.environment.model.region import PrefixIndex, RegionError
+
+import os
+import tempfile
+import unittest
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            ("10.0.0.0/8", "private"),
+            ("10.1.0.0/16", "eu"),
+            ("10.1.2.0/24", "eu-west"),
+            ("2001:db8::/32", "docs"),
+            ("2001:db8:1::/48", "docs-1"),
+        ])
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.index.lookup("10.1.2.3"), "eu-west")
+        self.assertEqual(self.index.lookup("10.1.3.4"), "eu")
+        self.assertEqual(self.index.lookup("10.200.0.1"), "private")
+
+    def test_ipv6(self):
+        self.assertEqual(self.index.lookup("2001:db8:1::5"), "docs-1")
+        self.assertEqual(self.index.lookup("2001:db8:2::5"), "docs")
+        self.assertIsNone(self.index.lookup("2001:db9::1"))
+
+    def test_ipv4_mapped(self):
+        self.assertEqual(self.index.lookup("::ffff:10.1.2.3"), "eu-west")
+
+    def test_no_match(self):
+        self.assertIsNone(self.index.lookup("192.168.0.1"))
+        self.assertIsNone(PrefixIndex().lookup("10.0.0.1"))
+
+    def test_malformed_address(self):
+        self.assertIsNone(self.index.lookup("not an address"))
+        self.assertIsNone(self.index.lookup(""))
+
+    def test_host_bits(self):
+        index = PrefixIndex([("192.168.1.77/24", "lan")])
+
+        self.assertEqual(index.lookup("192.168.1.1"), "lan")
+
+    def test_replace(self):
+        self.index.add("10.1.0.0/16", "us")
+
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.lookup("10.1.3.4"), "us")
+
+    def test_malformed_network(self):
+        with self.assertRaises(ValueError):
+            self.index.add("10.0.0.0/33", "bad")
+
+
+class PrefixIndexLoadTestCase(unittest.TestCase):
+    def load(self, content):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+
+        return PrefixIndex.load(path)
+
+    def test_load(self):
+        index = self.load("# comment\n\n203.0.113.0/24 APAC\n198.51.100.0/24 emea\n")
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.lookup("203.0.113.5"), "apac")
+        self.assertEqual(index.lookup("198.51.100.5"), "emea")
+
+    def test_malformed_line(self):
+        with self.assertRaises(RegionError):
+            self.load("203.0.113.0/24\n")
+
+    def test_malformed_network(self):
+        with self.assertRaises(RegionError):
+            self.load("203.0.113.0/40 apac\n")
+
+    def test_missing_file(self):
+        with self.assertRaises(RegionError):
+            PrefixIndex.load(os.path.join(tempfile.gettempdir(), "no-such-prefixes-file"))
+
+
+if __name__ == '__main__':
+    unittest.main()
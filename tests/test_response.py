@@ -0,0 +1,108 @@
+from anthill.environment.model import response
+from anthill.environment.model.response import DiscoverResponse, parse_accept
+
+import gzip
+import ujson
+import unittest
+
+
+# big enough to be worth compressing
+LARGE = {"key-{0}".format(index): "value-{0}".format(index) for index in range(50)}
+
+
+class ParseAcceptTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_accept("application/json;q=0.5, Application/MsgPack, */*;q=0.1"),
+            {"application/json": 0.5, "application/msgpack": 1.0, "*/*": 0.1})
+
+    def test_empty(self):
+        self.assertEqual(parse_accept(None), {})
+        self.assertEqual(parse_accept(""), {})
+        self.assertEqual(parse_accept(" , ,"), {})
+
+    def test_malformed_quality(self):
+        self.assertEqual(parse_accept("gzip;q=high"), {"gzip": 0.0})
+
+
+class DiscoverResponseTestCase(unittest.TestCase):
+    def test_body(self):
+        answer = DiscoverResponse("http://discovery/", {"a": 1})
+
+        self.assertEqual(ujson.loads(answer.body), {"discovery": "http://discovery/", "a": 1})
+        # the slashes are not escaped, same as JsonHandler writes json
+        self.assertIn(b'"http://discovery/"', answer.body)
+
+    def test_project(self):
+        answer = DiscoverResponse("http://discovery", {"a": 1, "b": 2})
+        projected = answer.project(["a", "missing"])
+
+        self.assertEqual(ujson.loads(projected.body), {"a": 1})
+        self.assertIs(answer.project(["missing", "a"]), projected)
+        self.assertNotEqual(projected.etag, answer.etag)
+
+    def test_json_by_default(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+
+        for accept in [None, "", "*/*", "application/json", "text/html"]:
+            variant = answer.negotiate(accept, None)
+            self.assertEqual(variant.content_type, DiscoverResponse.CONTENT_TYPE)
+            self.assertIsNone(variant.encoding)
+            self.assertEqual(variant.body, answer.body)
+
+    def test_gzip(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+        variant = answer.negotiate(None, "deflate, gzip")
+
+        self.assertEqual(variant.encoding, "gzip")
+        self.assertEqual(gzip.decompress(variant.body), answer.body)
+        self.assertNotEqual(variant.etag, answer.etag)
+        # rendered once and kept
+        self.assertIs(answer.negotiate(None, "gzip"), variant)
+
+    def test_gzip_refused(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+
+        self.assertIsNone(answer.negotiate(None, "gzip;q=0").encoding)
+        self.assertIsNone(answer.negotiate(None, "identity").encoding)
+
+    def test_small_not_compressed(self):
+        answer = DiscoverResponse("http://discovery", {"a": 1})
+
+        self.assertIsNone(answer.negotiate(None, "gzip").encoding)
+
+    @unittest.skipIf(response.brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+        variant = answer.negotiate(None, "gzip, br")
+
+        self.assertEqual(variant.encoding, "br")
+        self.assertEqual(response.brotli.decompress(variant.body), answer.body)
+
+    @unittest.skipIf(response.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+        variant = answer.negotiate("application/x-msgpack", None)
+
+        self.assertEqual(variant.content_type, DiscoverResponse.MSGPACK_CONTENT_TYPE)
+        self.assertEqual(response.msgpack.unpackb(variant.body, raw=False), answer.result)
+
+        # json is preferred if it is wanted as much, or more
+        self.assertEqual(
+            answer.negotiate("application/json, application/msgpack;q=0.5", None).content_type,
+            DiscoverResponse.CONTENT_TYPE)
+        self.assertEqual(
+            answer.negotiate("application/msgpack;q=0", None).content_type, DiscoverResponse.CONTENT_TYPE)
+
+    def test_unsupported(self):
+        answer = DiscoverResponse("http://discovery", LARGE)
+
+        with self.assertRaises(ValueError):
+            answer.variant("text/plain")
+
+        with self.assertRaises(ValueError):
+            answer.variant(DiscoverResponse.CONTENT_TYPE, "compress")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+from anthill.environment.model.store import SnapshotStore, SnapshotStoreError
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+ROWS = {
+    "applications": [{"application_id": 1, "application_name": "test"}],
+    "versions": [{"application_id": 1, "version_name": "1.0", "version_environment": 1}],
+    "patterns": [],
+    "environments": [{"environment_id": 1, "environment_discovery": "http://a", "environment_data": "{}"}],
+    "revision": 3
+}
+
+
+class SnapshotStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "nested", "snapshot.bin")
+
+    def test_round_trip(self):
+        self.assertTrue(SnapshotStore(self.path).save(ROWS))
+        self.assertEqual(SnapshotStore(self.path).load(), ROWS)
+
+    def test_unchanged(self):
+        store = SnapshotStore(self.path)
+
+        self.assertTrue(store.save(ROWS))
+        self.assertFalse(store.save(dict(ROWS)))
+        self.assertTrue(store.save(dict(ROWS, revision=4)))
+
+        # nothing is left behind but the file itself
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["snapshot.bin"])
+
+    def test_missing(self):
+        self.assertIsNone(SnapshotStore(self.path).load())
+
+    def write(self, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_truncated(self):
+        self.write(b"ENV")
+        self.assertIsNone(SnapshotStore(self.path).load())
+
+    def test_unknown_format(self):
+        SnapshotStore(self.path).save(ROWS)
+        self.write(b"NOTSNAP\0" + self.read()[8:])
+
+        self.assertIsNone(SnapshotStore(self.path).load())
+
+    def test_corrupted(self):
+        SnapshotStore(self.path).save(ROWS)
+        data = bytearray(self.read())
+        data[-1] ^= 0xff
+        self.write(bytes(data))
+
+        self.assertIsNone(SnapshotStore(self.path).load())
+
+    def test_other_python(self):
+        SnapshotStore(self.path).save(ROWS)
+        data = self.read()
+        magic, format_version, major, minor, checksum = SnapshotStore.HEADER.unpack_from(data)
+        header = SnapshotStore.HEADER.pack(magic, format_version, major, minor + 1, checksum)
+        self.write(header + data[SnapshotStore.HEADER.size:])
+
+        self.assertIsNone(SnapshotStore(self.path).load())
+
+    def test_not_storable(self):
+        with self.assertRaises(SnapshotStoreError):
+            SnapshotStore(self.path).save({"rows": object()})
+
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
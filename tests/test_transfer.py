@@ -0,0 +1,137 @@
+from anthill.environment.model.transfer import TransferModel
+
+import asyncio
+import ujson
+import unittest
+
+
+class FakeConnection(object):
+    """
+    Answers the selects of an import with the rows given, and records every other statement.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.executed = []
+        self.committed = False
+
+    async def query(self, sql, *args):
+        for table, rows in self.tables.items():
+            if "FROM `{0}`".format(table) in sql:
+                return [dict(row) for row in rows]
+        return []
+
+    async def get(self, sql, *args):
+        rows = await self.query(sql, *args)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, *args):
+        self.executed.append((" ".join(sql.split()), args))
+        return 1
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        pass
+
+
+class FakeAcquire(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class FakeDatabase(object):
+    def __init__(self, tables):
+        self.connection = FakeConnection(tables)
+
+    def acquire(self, auto_commit=True):
+        return FakeAcquire(self.connection)
+
+
+class FakeEnvironment(object):
+    @staticmethod
+    async def next_revision(db):
+        return 1
+
+    async def get_scheme_validator(self):
+        return None
+
+    async def everything_changed(self):
+        pass
+
+
+def lines(*items):
+    return [ujson.dumps(item) for item in items]
+
+
+class ImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase({
+            "environments": [{
+                "environment_id": 1,
+                "environment_name": "dev",
+                "environment_discovery": "http://localhost:9502",
+                "environment_data": {}
+            }],
+            "applications": [{
+                "application_id": 1,
+                "application_name": "test",
+                "application_title": "Test application"
+            }]
+        })
+        self.transfer = TransferModel(self.db, FakeEnvironment())
+
+    def inserted(self, table):
+        return [
+            statement for statement, args in self.db.connection.executed
+            if statement.startswith("INSERT INTO `{0}`".format(table))
+        ]
+
+    def test_names_differing_in_case_conflict(self):
+        report = asyncio.run(self.transfer.import_configuration(lines(
+            {"type": "environment", "name": "DEV", "discovery": "http://other:9502", "data": {}},
+            {"type": "application", "name": "TEST", "title": "Other title"}
+        )))
+
+        self.assertEqual([conflict["line"] for conflict in report.conflicts], [1, 2])
+        self.assertEqual(self.inserted("environments"), [])
+        self.assertEqual(self.inserted("applications"), [])
+
+    def test_names_differing_in_case_unchanged(self):
+        report = asyncio.run(self.transfer.import_configuration(lines(
+            {"type": "environment", "name": "Dev", "discovery": "http://localhost:9502", "data": {}},
+            {"type": "application", "name": "Test", "title": "Test application"}
+        )))
+
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.counts["environment"]["unchanged"], 1)
+        self.assertEqual(report.counts["application"]["unchanged"], 1)
+
+    def test_names_differing_in_case_overwrite(self):
+        report = asyncio.run(self.transfer.import_configuration(lines(
+            {"type": "environment", "name": "DEV", "discovery": "http://other:9502", "data": {}}
+        ), overwrite=True))
+
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.counts["environment"]["updated"], 1)
+        self.assertEqual(len(self.inserted("environments")), 1)
+
+    def test_references_differing_in_case(self):
+        report = asyncio.run(self.transfer.import_configuration(lines(
+            {"type": "version", "app": "Test", "version": "1.0", "environment": "DEV"}
+        )))
+
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.counts["version"]["created"], 1)
+        self.assertTrue(self.db.connection.committed)
+
+
+if __name__ == '__main__':
+    unittest.main()